@@ -0,0 +1,196 @@
+import os
+import sys
+import time
+import logging
+import argparse
+from datetime import datetime
+
+current_script_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_script_dir, '../'))
+
+from demo_src.tasks_runner import TasksRunner, MIN_TRANSFER_LENGTH, MAX_TRANSFER_LENGTH, FILL_LEVEL_INTERVAL
+from demo_src.ddr_monitor import DDRMonitor
+from demo_src.dsp_stage import MovingAverage, Decimator
+from demo_src.signal_monitor import format_signal_stats
+from demo_src.event_capture import EventTrigger, PRE_TRIGGER_TIME, POST_TRIGGER_TIME
+from demo_src.stage_metrics import format_stats
+from demo_src.shared_memory_feed import DEFAULT_NAME as DEFAULT_SHARED_MEMORY_NAME
+
+EXIT_DATA_LOST = 1
+EXIT_ACQUISITION_FAILED = 2
+SIGNAL_STATS_WINDOW = 1.0  # in seconds, one of signal_monitor.STATS_WINDOWS
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Receives data from the FPGA and writes it to hdf5 file, without GUI.")
+    parser.add_argument('bit_file', nargs='?', help="bit file loaded to the FPGA, not needed with --emulated")
+    parser.add_argument('-c', '--channels', type=int, default=4, help="number of channels")
+    parser.add_argument('-r', '--rate', type=float, default=1000, help="sampling rate in Hz")
+    parser.add_argument('-l', '--packet-length', type=int, default=512, help="packet length in bytes")
+    parser.add_argument('-d', '--duration', type=float, default=None, help="capture duration in seconds")
+    parser.add_argument('-s', '--size', type=float, default=None, help="capture size limit in MB")
+    parser.add_argument('-o', '--output', default=None,
+                        help="output hdf5 file, received_data<date>.h5 in the current directory by default")
+    parser.add_argument('-p', '--processes', type=int, default=0, help="number of unpacking processes")
+    parser.add_argument('-i', '--interval', type=float, default=1, help="statistics interval in seconds")
+    parser.add_argument('--raw', action='store_true', help="write received data without unpacking it")
+    parser.add_argument('--emulated', action='store_true', help="use the FPGA emulator instead of the device")
+    parser.add_argument('--serve', default=None,
+                        help="serve received data to clients on HOST:PORT or a Unix socket path, see stream_server.py")
+    parser.add_argument('--shared-memory', nargs='?', const=DEFAULT_SHARED_MEMORY_NAME, default=None, metavar='NAME',
+                        help="publish received data in a shared memory ring, see shared_memory_feed.py")
+    parser.add_argument('--pause-on-overflow', action='store_true',
+                        help="pause data generation when DDR is almost full, instead of losing data")
+    parser.add_argument('--fill-level-interval', type=float, default=FILL_LEVEL_INTERVAL,
+                        help="how often DDR fill level is read, in seconds")
+    parser.add_argument('--moving-average', type=int, default=None, metavar='N',
+                        help="write the mean of the last N samples instead of raw samples")
+    parser.add_argument('--decimate', type=int, default=None, metavar='N',
+                        help="write every N-th sample, use with --moving-average to avoid aliasing")
+    parser.add_argument('--signal-stats', action='store_true',
+                        help="print min/max/mean/RMS of every channel over the last second and its spectrum peak")
+    parser.add_argument('--trigger', default=None, metavar='CHANNEL:LEVEL',
+                        help="write only events triggered by the channel crossing the level, see event_capture.py")
+    parser.add_argument('--trigger-mode', choices=(EventTrigger.MODE_EDGE, EventTrigger.MODE_LEVEL),
+                        default=EventTrigger.MODE_EDGE)
+    parser.add_argument('--trigger-slope', choices=(EventTrigger.SLOPE_RISING, EventTrigger.SLOPE_FALLING),
+                        default=EventTrigger.SLOPE_RISING)
+    parser.add_argument('--pre-trigger', type=float, default=PRE_TRIGGER_TIME,
+                        help="time saved before every trigger, in seconds")
+    parser.add_argument('--post-trigger', type=float, default=POST_TRIGGER_TIME,
+                        help="time saved after every trigger, in seconds")
+    parser.add_argument('--hold-off', type=float, default=None,
+                        help="minimal time between triggers in seconds, post-trigger time by default")
+    parser.add_argument('--calibrate', action='store_true',
+                        help="measure the best block and transfer length first, results are kept next to the bit file")
+    parser.add_argument('--min-transfer-length', type=int, default=MIN_TRANSFER_LENGTH)
+    parser.add_argument('--max-transfer-length', type=int, default=MAX_TRANSFER_LENGTH)
+    args = parser.parse_args()
+    if args.bit_file is None and not args.emulated:
+        parser.error("bit_file is required when not using --emulated")
+    if args.serve is not None and ':' in args.serve:
+        host, port = args.serve.rsplit(':', 1)
+        args.serve = (host, int(port))
+    if args.trigger is not None:
+        channel, level = args.trigger.split(':')
+        args.trigger = EventTrigger(int(channel), int(level), args.trigger_mode, args.trigger_slope, args.hold_off)
+    if args.output is None:
+        args.output = 'received_data{:%Y_%m_%d_%H_%M_%S}.h5'.format(datetime.now())
+    return args
+
+
+def get_dsp_processors(args):
+    processors = []
+    if args.moving_average is not None:
+        processors.append(MovingAverage(args.moving_average))
+    if args.decimate is not None:
+        processors.append(Decimator(args.decimate))
+    return processors
+
+
+def count_lost_data(tasks_runner):
+    # packets with wrong ids or checksums, and buffers dropped by full queues; raw capture is not unpacked
+    # during the acquisition, so DDR overflows and transfers shorter than requested are counted instead
+    lost = 0
+    if tasks_runner.raw_capture:
+        lost += tasks_runner.short_transfers
+        if tasks_runner.ddr_monitor is not None:
+            lost += tasks_runner.ddr_monitor.overflows
+    if tasks_runner.data_unpacker is not None:
+        lost += tasks_runner.data_unpacker.with_incorrect_id + tasks_runner.data_unpacker.with_incorrect_checksum
+    for stage in (tasks_runner.data_manager, tasks_runner.dsp_stage, tasks_runner.file_writer,
+                  tasks_runner.event_recorder, tasks_runner.raw_capture_writer):
+        if stage is not None:
+            lost += stage.queue.dropped
+    return lost
+
+
+def print_statistics(tasks_runner, elapsed, bytes_in_interval, interval, previous_stats, stats):
+    # DDR monitor is created when the device is opened
+    ddr_monitor = tasks_runner.ddr_monitor
+    ddr_stats = ddr_monitor.get_stats() if ddr_monitor is not None else None  # device is used only from the tasks runner thread
+    line = '{:.1f} s: received {:.1f} MB, {:.2f} MB/s'.format(
+        elapsed,
+        tasks_runner.bytes_received / (1024 * 1024),
+        bytes_in_interval / (1024 * 1024 * interval))
+    if ddr_stats is not None:
+        line += ', DDR fill level {} B (max {} B, {:+.2f} MB/s)'.format(
+            ddr_stats['fill_level'],
+            ddr_stats['high_water'],
+            ddr_stats['fill_rate'] / (1024 * 1024))
+    print(line + ', lost packets/buffers {}'.format(count_lost_data(tasks_runner)))
+    if ddr_stats is not None and ddr_stats['pauses']:
+        print('    data generation paused {} times, for {:.1f} s'.format(ddr_stats['pauses'], ddr_stats['paused_time']))
+    print('    ' + format_stats(previous_stats, stats, interval))
+    if tasks_runner.event_recorder is not None:
+        print('    events triggered {}, written {}'.format(tasks_runner.event_recorder.events_triggered,
+                                                          tasks_runner.event_recorder.events_written))
+    snapshot = tasks_runner.get_signal_snapshot()
+    if snapshot is not None:
+        for line in format_signal_stats(snapshot, SIGNAL_STATS_WINDOW):
+            print('    ' + line)
+    if tasks_runner.stream_server is not None:
+        for client in tasks_runner.stream_server.get_clients_stats():
+            print('    client {}: lag {:.3f} s, frames sent {}, dropped {}'.format(
+                client['address'], client['lag'], client['frames_sent'], client['frames_dropped']))
+
+
+def run(args):
+    tasks_runner = TasksRunner()
+    tasks_runner.report_transfers = False
+    tasks_runner.log_stats = False
+    tasks_runner.fill_level_interval = args.fill_level_interval
+    tasks_runner.start(args.bit_file, args.output, args.channels, args.packet_length, args.rate,
+                       emulated=args.emulated,
+                       min_transfer_length=args.min_transfer_length,
+                       max_transfer_length=args.max_transfer_length,
+                       unpacking_processes=args.processes,
+                       raw_capture=args.raw,
+                       plotting=False,
+                       calibrate=args.calibrate,
+                       stream_server_address=args.serve,
+                       shared_memory_name=args.shared_memory,
+                       ddr_policy=DDRMonitor.POLICY_PAUSE if args.pause_on_overflow else DDRMonitor.POLICY_WARN,
+                       dsp_processors=get_dsp_processors(args),
+                       signal_monitoring=args.signal_stats,
+                       trigger=args.trigger,
+                       pre_trigger_time=args.pre_trigger,
+                       post_trigger_time=args.post_trigger)
+
+    start = time.time()
+    last_report = start
+    last_bytes_received = 0
+    previous_stats = []
+    try:
+        while tasks_runner.thread.is_alive():
+            time.sleep(min(args.interval, 0.1))
+            now = time.time()
+            if now - last_report >= args.interval:
+                stats = tasks_runner.get_stats()
+                print_statistics(tasks_runner, now - start, tasks_runner.bytes_received - last_bytes_received,
+                                 now - last_report, previous_stats, stats)
+                previous_stats = stats
+                last_report = now
+                last_bytes_received = tasks_runner.bytes_received
+            if args.duration is not None and now - start >= args.duration:
+                break
+            if args.size is not None and tasks_runner.bytes_received >= args.size * 1024 * 1024:
+                break
+    except KeyboardInterrupt:
+        print("Interrupted, stopping...")
+    tasks_runner.stop()
+    tasks_runner.thread.join()
+
+    print("Received {} bytes in {:.1f} s".format(tasks_runner.bytes_received, time.time() - start))
+
+    if tasks_runner.error is not None:
+        return EXIT_ACQUISITION_FAILED
+    if count_lost_data(tasks_runner) > 0:
+        print("Data was lost!")
+        return EXIT_DATA_LOST
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    sys.exit(run(parse_args()))
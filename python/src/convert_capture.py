@@ -0,0 +1,29 @@
+import os
+import sys
+import time
+import argparse
+
+current_script_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_script_dir, '../'))
+
+from demo_src.raw_capture_converter import convert_raw_capture
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Converts raw capture file to hdf5 file.")
+    parser.add_argument('capture_file', help="raw capture file, with its .json info file next to it")
+    parser.add_argument('-o', '--output', help="output hdf5 file, capture file name with .h5 extension by default")
+    parser.add_argument('-p', '--processes', type=int, default=None,
+                        help="number of unpacking processes, number of CPUs by default")
+    args = parser.parse_args()
+    if args.output is None:
+        args.output = os.path.splitext(args.capture_file)[0] + '.h5'
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    start = time.time()
+    data_unpacker = convert_raw_capture(args.capture_file, args.output, args.processes)
+    data_unpacker.print_summary()
+    print("Execution time: {} seconds".format(time.time()-start))
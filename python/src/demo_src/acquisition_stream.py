@@ -0,0 +1,207 @@
+import queue
+import asyncio
+import logging
+import threading
+import time
+
+from .fpga_device import FPGADevice
+from .fpga_emulator import FPGAEmulator
+from .capture_replay import CaptureReplay
+from .data_unpacker import DataUnpacker
+from .pipeline_queue import PipelineQueue, STOP_SENTINEL
+from .stage_metrics import StageMetrics
+from .tasks_runner import BLOCK_LENGTH, MIN_TRANSFER_LENGTH, MAX_TRANSFER_LENGTH
+
+logger = logging.getLogger("Status bar logger")
+
+DEFAULT_PREFETCH = 8  # unpacked blocks waiting for the consumer
+WAIT_INTERVAL = 0.1  # in seconds, how often blocked threads check if the stream is closed
+
+
+# Acquisition session for embedding the pipeline in other programs. Received transfers are unpacked in
+# the stream thread and the (samples x channels) blocks are yielded by iterating over the stream, with
+# "for" or "async for". At most prefetch blocks wait for the consumer; when it is slower than the data,
+# the stream thread waits and the backlog is kept in the device DDR, not in memory.
+#
+#     with open_emulated_stream(4, 512, 100000) as stream:
+#         for block in stream:
+#             ...
+#
+#     async with open_emulated_stream(4, 512, 100000) as stream:
+#         async for block in stream:
+#             ...
+#
+# The stream ends after close(), at the end of a replayed capture or after an error, which is raised by
+# the iterator once the blocks received before it are consumed.
+class AcquisitionStream:
+    def __init__(self, device, number_of_channels, packet_length_in_bytes, bit_file_path=None,
+                 prefetch=DEFAULT_PREFETCH, block_length=BLOCK_LENGTH, min_transfer_length=MIN_TRANSFER_LENGTH,
+                 max_transfer_length=MAX_TRANSFER_LENGTH, bad_packets_policy=DataUnpacker.BAD_PACKETS_PASS):
+        self.device = device
+        self.bit_file_path = bit_file_path
+        self.block_length = block_length
+        self.min_transfer_length = max(min_transfer_length - min_transfer_length % block_length, block_length)
+        self.max_transfer_length = max(max_transfer_length - max_transfer_length % block_length,
+                                       self.min_transfer_length)
+        self.data_unpacker = DataUnpacker(packet_length_in_bytes, number_of_channels, bad_packets_policy)
+
+        self.queue = PipelineQueue(prefetch)
+        self.thread = threading.Thread(target=self._run, name="Acquisition stream")
+        self.metrics = StageMetrics("stream", self.queue)
+        self.samples_received = 0
+        self.error = None
+        self._started = False
+        self._should_stop = False
+        self._finished = False
+        self._pending_block = None  # block requested by "async for", kept when the awaiting task is cancelled
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        self.device.load_bit_file(self.bit_file_path)
+        self.device.reset_design()
+        self.device.start_data_generation()
+        self.thread.start()
+
+    def close(self):
+        self._should_stop = True
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def _run(self):
+        try:
+            self._receive_data()
+        except Exception as exception:
+            logger.error("Acquisition stream failed: {}".format(exception))
+            self.error = exception
+        try:
+            self.device.stop_data_generation()
+        except Exception as exception:
+            logger.error("Data generation not stopped: {}".format(exception))
+        self._put(STOP_SENTINEL)
+
+    def _receive_data(self):
+        while not self._should_stop:
+            fill_level = self.device.get_DDR_fill_level()
+            transfer_length = fill_level - fill_level % self.block_length
+            transfer_length = min(max(transfer_length, self.min_transfer_length), self.max_transfer_length)
+            received_buffer = self.device.receive_data(self.block_length, transfer_length)
+            if received_buffer is None:
+                continue  # timeout, the device raises an exception when it repeats
+            if len(received_buffer) == 0:
+                break  # end of replayed capture
+            start = time.perf_counter()
+            block = self.data_unpacker.unpack_from_buffer(received_buffer)
+            self.metrics.add_item(len(received_buffer), block.nbytes, time.perf_counter() - start)
+            self.metrics.corrupt = self.data_unpacker.with_incorrect_id + self.data_unpacker.with_incorrect_checksum
+            if len(block) > 0:
+                self.samples_received += len(block)
+                if not self._put(block):
+                    break
+
+    def _put(self, item):
+        # waits for a free place in the queue, returns False when the stream is closed in the meantime
+        while True:
+            if self._should_stop and item is not STOP_SENTINEL:
+                return False
+            try:
+                self.queue.put(item, timeout=WAIT_INTERVAL)
+                return True
+            except queue.Full:
+                if self._should_stop:
+                    # nobody reads the queue anymore, blocks left in it are dropped
+                    self._clear_queue()
+
+    def _clear_queue(self):
+        try:
+            while True:
+                self.queue.get_nowait()
+                self.queue.dropped += 1
+        except queue.Empty:
+            pass
+
+    def get_block(self, timeout=None):
+        # returns the next block, None after the end of the stream
+        if self._finished:
+            self._raise_error()
+            return None
+        if not self._started:
+            raise Exception("Stream is not started")
+        try:
+            block = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("No data received in {} s".format(timeout))
+        if block is STOP_SENTINEL:
+            self._finished = True
+            self._raise_error()
+            return None
+        return block
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None  # raised only once
+            raise error
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        block = self.get_block()
+        if block is None:
+            raise StopIteration
+        return block
+
+    async def __aenter__(self):
+        await asyncio.get_running_loop().run_in_executor(None, self.start)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        # the queue is read in an executor thread, the event loop is not blocked while waiting for data
+        if self._pending_block is None:
+            self._pending_block = asyncio.get_running_loop().run_in_executor(None, self.get_block)
+        try:
+            block = await asyncio.shield(self._pending_block)
+        finally:
+            if self._pending_block.done():
+                self._pending_block = None
+        if block is None:
+            raise StopAsyncIteration
+        return block
+
+
+def open_device_stream(bit_file_path, number_of_channels, packet_length_in_bytes, **kwargs):
+    return AcquisitionStream(FPGADevice(), number_of_channels, packet_length_in_bytes, bit_file_path, **kwargs)
+
+
+def open_emulated_stream(number_of_channels, packet_length_in_bytes, sampling_rate_Hz, **kwargs):
+    device = FPGAEmulator(number_of_channels, sampling_rate_Hz, packet_length_in_bytes)
+    return AcquisitionStream(device, number_of_channels, packet_length_in_bytes, **kwargs)
+
+
+def open_replay_stream(capture_file_path, real_time=False, **kwargs):
+    device = CaptureReplay(capture_file_path, real_time)
+    return AcquisitionStream(device, device.number_of_channels, device.packet_length, **kwargs)
+
+
+if __name__ == '__main__':
+    # run as: python -m demo_src.acquisition_stream
+    with open_emulated_stream(4, 512, 100000) as stream:
+        for i, block in enumerate(stream):
+            print("block {}: {} samples, first {}".format(i, len(block), block[0]))
+            if i == 9:
+                break
+    print("Received {} samples".format(stream.samples_received))
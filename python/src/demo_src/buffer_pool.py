@@ -0,0 +1,28 @@
+import mmap
+import queue
+
+
+# Preallocated, page aligned buffers for received transfers, so the acquisition doesn't allocate memory for
+# every transfer. Every buffer is a separate anonymous memory map. Transfers are memoryviews of these buffers;
+# the sink which consumes a transfer gives it back with release() when its data is no longer needed.
+# acquire() blocks while all buffers are in use, like a full queue of the sink.
+class BufferPool:
+    def __init__(self, number_of_buffers, buffer_length):
+        buffer_length = -(-buffer_length // mmap.PAGESIZE) * mmap.PAGESIZE
+        self.buffer_length = buffer_length
+        self.number_of_buffers = number_of_buffers
+        self._buffers = [mmap.mmap(-1, buffer_length) for i in range(number_of_buffers)]
+        self._free_buffers = queue.Queue()
+        for buffer in self._buffers:
+            self._free_buffers.put(buffer)
+
+    def acquire(self, timeout=None):
+        # returns a free buffer, raises queue.Empty after timeout
+        return self._free_buffers.get(timeout=timeout)
+
+    def release(self, transfer):
+        # transfer is a memoryview of a pool buffer, or the buffer itself
+        self._free_buffers.put(transfer.obj if isinstance(transfer, memoryview) else transfer)
+
+    def get_free_buffers(self):
+        return self._free_buffers.qsize()
@@ -0,0 +1,83 @@
+import time
+import logging
+
+import numpy as np
+
+from .raw_capture_converter import read_capture_info, get_capture_length
+
+
+logger = logging.getLogger("Status bar logger")
+
+
+# Replacement of FPGADevice which serves transfers from a raw capture (see raw_capture_writer.py), e.g. to run
+# the processing on recorded data. With real_time the capture is served no faster than it was recorded,
+# otherwise as fast as it is read. After the end of the capture receive_data returns an empty buffer.
+class CaptureReplay:
+    def __init__(self, capture_file_path, real_time=False):
+        info = read_capture_info(capture_file_path)
+        self.number_of_channels = info['number_of_channels']
+        self.packet_length = info['packet_length_in_bytes']
+        self.sampling_interval = info['sampling_interval']
+        self.sampling_rate = 1 / self.sampling_interval
+        self.start_time = info['start_time']
+        self.real_time = real_time
+
+        length = get_capture_length(capture_file_path, info)
+        self._capture = np.memmap(capture_file_path, dtype=np.uint8, mode='r', shape=(length,)) if length > 0 \
+            else np.empty(0, dtype=np.uint8)
+        # bytes of the capture per second, with packet IDs and checksums
+        samples_in_packet = self.packet_length // 2 - 4
+        self._byte_rate = self.sampling_rate * self.number_of_channels * self.packet_length / samples_in_packet
+
+        self._generation_enabled = False
+        self._generation_start_time = 0
+        self._position = 0
+        self._position_at_start = 0
+        logger.info("Replaying capture {}".format(capture_file_path))
+
+    def load_bit_file(self, bit_file_path):
+        logger.info("Capture replay, bitfile {} not loaded".format(bit_file_path))
+
+    def reset_design(self, f_rate=0, sig_type=1):
+        self._position = 0
+        self._position_at_start = 0
+        self._generation_start_time = time.monotonic()
+
+    def start_data_generation(self):
+        if not self._generation_enabled:
+            self._generation_start_time = time.monotonic()
+            self._position_at_start = self._position
+            self._generation_enabled = True
+
+    def stop_data_generation(self):
+        self._generation_enabled = False
+
+    def set_slope_max(self, value):
+        pass
+
+    def receive_data(self, block_length, buffer_length, buffer=None):
+        length = min(buffer_length, len(self._capture) - self._position)
+        if self.real_time and self._generation_enabled:
+            while self._available() < length:
+                time.sleep(min((length - self._available()) / self._byte_rate, 0.1))
+        length = min(length, self._available())
+        data = self._capture[self._position:self._position + length]
+        self._position += length
+        if buffer is None:
+            return bytearray(data)
+        transfer = memoryview(buffer)[:length]
+        transfer[:] = data
+        return transfer
+
+    def get_DDR_fill_level(self):
+        return self._available()
+
+    def _available(self):
+        # bytes "received" by the emulated DDR and not read yet
+        remaining = len(self._capture) - self._position
+        if not self.real_time:
+            return remaining
+        if not self._generation_enabled:
+            return 0
+        produced = int((time.monotonic() - self._generation_start_time) * self._byte_rate)
+        return min(self._position_at_start + produced - self._position, remaining)
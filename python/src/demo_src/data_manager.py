@@ -1,38 +1,43 @@
-import queue
-import time
 import threading
+import time
+
+from .pipeline_queue import PipelineQueue, STOP_SENTINEL
+from .stage_metrics import StageMetrics
+
 
 class DataManager:
+    QUEUE_SIZE = 32
+
     def __init__(self):
-        self.should_stop = False
-        self.queue = queue.Queue()
+        self.queue = PipelineQueue(self.QUEUE_SIZE)
         self.thread = threading.Thread(target=self._run, name="Data manager")
         self._list_with_all_data_sinks = []
+        self.metrics = StageMetrics("manager", self.queue)
 
     def add_buffer(self, buffer):
-        self.queue.put(buffer)
+        self.queue.put_buffer(buffer)
 
+    # sinks list is replaced, not modified, so it can be changed while the thread iterates over it
     def add_data_sink(self, data_sink):
-        self._list_with_all_data_sinks.append(data_sink)
+        self._list_with_all_data_sinks = self._list_with_all_data_sinks + [data_sink]
 
     def remove_data_sink(self, data_sink):
-        self._list_with_all_data_sinks.remove(data_sink)
+        self._list_with_all_data_sinks = [sink for sink in self._list_with_all_data_sinks if sink is not data_sink]
 
     def _run(self):
         while True:
-            should_stop = self.should_stop and self.queue.empty()
-            if should_stop:
+            buffer = self.queue.get()
+            if buffer is STOP_SENTINEL:
                 break
-            if self.queue.empty():
-                time.sleep(0.01)
-            else:
-                buffer = self.queue.get()
-                for sink in self._list_with_all_data_sinks:
-                    sink.add_buffer_to_queue(buffer)
-                self.queue.task_done()
+            start = time.perf_counter()
+            data_sinks = self._list_with_all_data_sinks
+            for sink in data_sinks:
+                sink.add_buffer_to_queue(buffer)
+            self.metrics.add_item(buffer.nbytes, buffer.nbytes * len(data_sinks), time.perf_counter() - start)
+            self.queue.task_done()
 
     def stop(self):
-        self.should_stop = True
+        self.queue.put_stop()
         self.thread.join()
 
     def start(self):
@@ -40,29 +45,17 @@ class DataManager:
 
 
 if __name__ == '__main__':
+    # run as: python -m demo_src.data_manager
     import numpy as np
-    from file_writer import FileWriter
-    file_writer = FileWriter()
+    from .file_writer import FileWriter
+    file_writer = FileWriter(1e-6)
     file_writer.open_file('test.h5', 2)
     file_writer.start()
     data_manager = DataManager()
     data_manager.add_data_sink(file_writer)
     data_manager.start()
-    data = np.arange(500* 2, dtype=np.uint16)
-    data = data.reshape((500, 2))
-    data = data.astype('uint16')
-    data_manager.add_buffer(data)
-    data_manager.add_buffer(data)
-    data_manager.add_buffer(data)
-    data_manager.add_buffer(data)
-    data_manager.add_buffer(data)
-    data_manager.add_buffer(data)
-    data_manager.add_buffer(data)
-    data_manager.add_buffer(data)
-    data_manager.add_buffer(data)
-    data_manager.add_buffer(data)
-    data_manager.add_buffer(data)
-    data_manager.add_buffer(data)
+    data = np.arange(500 * 2, dtype=np.uint16).reshape((500, 2))
+    for i in range(12):
+        data_manager.add_buffer(data)
     data_manager.stop()
     file_writer.stop()
-    file_writer.stop()
@@ -2,132 +2,261 @@ import sys
 import os
 import time
 import numpy as np
-import struct
 
-import queue
 import threading
 
+from .pipeline_queue import PipelineQueue, STOP_SENTINEL
+from .stage_metrics import StageMetrics
+
 
 class DataUnpacker:
-    def __init__(self, packet_length_in_bytes, number_of_channels):
-        self.last_id = -1
+    QUEUE_SIZE = 32
+
+    # what happens with data of packets with wrong checksum or unexpected ID
+    BAD_PACKETS_PASS = 'pass'    # passed on as correct data
+    BAD_PACKETS_FLAG = 'flag'    # passed on, IDs of such packets are stored in flagged_packet_ids
+    BAD_PACKETS_DROP = 'drop'    # replaced with FILL_VALUE, recorded in missing_ranges
+    # any value is a valid sample, so filled samples are told apart only by missing_ranges
+    FILL_VALUE = 0
+    MAX_FILLED_PACKETS = 65536   # bigger ID jumps are treated as corrupted IDs, not as lost packets
+
+    def __init__(self, packet_length_in_bytes, number_of_channels, bad_packets_policy=BAD_PACKETS_PASS, fill_gaps=True):
+        self.last_id = -1  # of the last packet with correct checksum
+        self._packets_after_last_id = 0  # with wrong checksum, their IDs are not trusted
         self.packet_length = packet_length_in_bytes
         self.number_of_channels = number_of_channels
+        self.bad_packets_policy = bad_packets_policy
+        self.fill_gaps = fill_gaps
 
-        self.should_stop = False
-        self.queue = queue.Queue()
+        self.queue = PipelineQueue(self.QUEUE_SIZE)
         self.thread = threading.Thread(target=self._run, name="Data unpacker")
+        self.metrics = StageMetrics("unpacker", self.queue)
 
         self.all_received = 0
         self.with_incorrect_id = 0
         self.with_incorrect_checksum = 0
+        self.filled_packets = 0
+        self.flagged_packet_ids = []
+        # (first sample, number of samples) of filled gaps and dropped packets, samples are counted
+        # from the start in all channels together, like in the received packets
+        self.missing_ranges = []
+        self._samples_unpacked = 0
         self.unpacked_data_handler = None
+        self.buffer_pool = None  # received buffers are given back to it after unpacking
+
+        self._remainder = bytearray()
+        self._samples_remainder = np.empty(0, dtype=np.uint16)
 
     def add_buffer_to_queue(self, buffer):
-        self.queue.put(buffer)
+        self.queue.put_buffer(buffer)
 
     def add_data_handler(self, data_handler):
         self.unpacked_data_handler = data_handler
 
     def _run(self):
         while True:
-            should_stop =  self.should_stop and self.queue.empty()
-            if should_stop:
+            buffer = self.queue.get()
+            if buffer is STOP_SENTINEL:
                 break
-            if self.queue.empty():
-                time.sleep(0.01)
-            else:
-                buffer = self.queue.get()
-                self.process_buffer(buffer)
-                self.queue.task_done()
+            self.process_buffer(buffer)
+            self.queue.task_done()
 
     def process_buffer(self, buffer):
+        start = time.perf_counter()
         data = self.unpack_from_buffer(buffer)
-        data = data.transpose()
+        if self.buffer_pool is not None:
+            self.buffer_pool.release(buffer)
+        self.metrics.add_item(len(buffer), data.nbytes, time.perf_counter() - start)
+        self.metrics.corrupt = self.with_incorrect_id + self.with_incorrect_checksum
+        if len(data) == 0:
+            return
         if self.unpacked_data_handler is not None:
             self.unpacked_data_handler.add_buffer(data)
 
     def stop(self):
-        self.should_stop = True
+        self.queue.put_stop()
         self.thread.join()
 
     def start(self):
         self.thread.start()
 
-    def validate_checksum(self, packet):
-        buff_int = struct.unpack('<{}H'.format(len(packet) // 2), packet)
-        temp_checksum = 0
-        for i in range((len(buff_int) // 2) - 1):
-            temp_checksum += (buff_int[2 * i] << 16) + buff_int[2 * i + 1]
-            temp_checksum = temp_checksum % (2 ** 32)
+    def unpack_from_buffer(self, buff, out=None):
+        # decodes all complete packets of a transfer at once, the transfer is viewed as
+        # an (packets x words in packet) array of uint16, incomplete packet is kept for the next call
+        if self._remainder:
+            buff = self._remainder + buff
+        number_of_packets = len(buff) // self.packet_length
+        self._remainder = bytearray(buff[number_of_packets * self.packet_length:])
 
-        return temp_checksum == ((buff_int[-2] << 16) + buff_int[-1])
+        words = np.frombuffer(buff, dtype='<u2', count=number_of_packets * self.packet_length // 2)
+        words = words.reshape((number_of_packets, self.packet_length // 2))
+        payload = words[:, 2:-2]
+        if number_of_packets > 0:
+            packet_ids, wrong_checksum = self.check_packets(words)
+            payload = self.process_packets(payload, packet_ids, wrong_checksum)
+        return self._copy_payload(payload, out)
 
-    def unpack_package(self, packet) -> np.array:
-        self.all_received += 1
+    def check_packets(self, words):
+        # returns IDs of all packets in (packets x words in packet) array and mask of packets with wrong checksum
+        packet_ids = (words[:, 0].astype(np.int64) << 16) | words[:, 1]
+        # checksum is a sum (mod 2^32) of all 32-bit words but the last one, which holds the checksum
+        high_words = words[:, 0:-2:2].sum(axis=1, dtype=np.int64)
+        low_words = words[:, 1:-2:2].sum(axis=1, dtype=np.int64)
+        checksum = ((high_words << 16) + low_words) & 0xFFFFFFFF
+        received_checksum = (words[:, -2].astype(np.int64) << 16) | words[:, -1]
+        return packet_ids, checksum != received_checksum
 
-        wrong_checksum = False
-        wrong_id = False
+    def process_packets(self, payload, packet_ids, wrong_checksum):
+        # applies the bad packets policy and fills gaps in (packets x payload words) data
+        expected_ids, wrong_id = self.validate_packets(packet_ids, wrong_checksum)
+        missing_packets = self.count_missing_packets(packet_ids, expected_ids, wrong_checksum)
+        bad_packets = (wrong_id & (missing_packets == 0)) | wrong_checksum
+        payload = self.apply_bad_packets_policy(payload, packet_ids, bad_packets)
+        if not self.fill_gaps:
+            missing_packets = np.zeros_like(missing_packets)
+        self._record_missing_ranges(payload.shape[1], missing_packets,
+                                    bad_packets if self.bad_packets_policy == self.BAD_PACKETS_DROP else None)
+        return self.fill_missing_packets(payload, missing_packets)
 
-        packet_id = struct.unpack('<2H', packet[:4])
-        packet_id = (packet_id[0]<<16) + packet_id[1]
+    def validate_packets(self, packet_ids, wrong_checksum):
+        # returns IDs expected from the packets before and mask of packets with other IDs, updates counters.
+        # IDs of packets with wrong checksum are not trusted, expected IDs follow the last packet with correct
+        # checksum, counting the packets after it
+        positions = np.arange(len(packet_ids))
+        trusted = np.where(wrong_checksum, -1, positions)
+        np.maximum.accumulate(trusted, out=trusted)
+        previous = np.empty_like(trusted)
+        previous[0] = -1
+        previous[1:] = trusted[:-1]
+        has_previous = previous >= 0
+        previous_ids = np.where(has_previous, packet_ids[np.maximum(previous, 0)], self.last_id)
+        previous_positions = np.where(has_previous, previous, -1 - self._packets_after_last_id)
+        expected_ids = previous_ids + positions - previous_positions
+        wrong_id = (packet_ids != expected_ids) & (packet_ids != 0)
 
-        if (packet_id != self.last_id+1) and (packet_id != 0):
-            self.with_incorrect_id += 1
-            wrong_id = True
+        self.all_received += len(packet_ids)
+        self.with_incorrect_id += int(np.count_nonzero(wrong_id))
+        self.with_incorrect_checksum += int(np.count_nonzero(wrong_checksum))
+        if trusted[-1] >= 0:
+            self.last_id = int(packet_ids[trusted[-1]])
+            self._packets_after_last_id = len(packet_ids) - 1 - int(trusted[-1])
         else:
-            self.last_id = packet_id
-
-        if not self.validate_checksum(packet):
-            self.with_incorrect_checksum += 1
-            wrong_checksum = True
-
-        #buff_int = struct.unpack('<{}H'.format(self.number_of_channels), packet[4:-4])
-        dt = np.dtype(np.uint16)
-        dt.newbyteorder('<')
-        buff_array = np.frombuffer(packet[4:-4], dtype=dt)
-        buff_array = buff_array.reshape((len(buff_array)//self.number_of_channels), self.number_of_channels)
-        buff_array = buff_array.transpose()
-        return buff_array
-
-    def unpack_from_buffer(self, buff):
-        unpacked_array = None
-        while len(buff) >= self.packet_length:
-            packet = buff[:self.packet_length]
-            del buff[:self.packet_length]
-            if unpacked_array is None:
-                unpacked_array = self.unpack_package(packet)
+            self._packets_after_last_id += len(packet_ids)
+        return expected_ids, wrong_id
+
+    def count_missing_packets(self, packet_ids, expected_ids, wrong_checksum):
+        # number of packets lost before every packet, IDs of packets with wrong checksum are not trusted
+        missing = packet_ids - expected_ids
+        is_gap = (missing > 0) & (missing <= self.MAX_FILLED_PACKETS) & (packet_ids != 0) & ~wrong_checksum
+        return np.where(is_gap, missing, 0)
+
+    def _record_missing_ranges(self, payload_words, missing_packets, dropped_packets):
+        # ranges of samples filled before packets and of dropped packets, in positions after filling
+        positions = np.arange(len(missing_packets)) + np.cumsum(missing_packets)
+        first_packets = []
+        lengths = []
+        gaps = np.flatnonzero(missing_packets)
+        first_packets.append(positions[gaps] - missing_packets[gaps])
+        lengths.append(missing_packets[gaps])
+        if dropped_packets is not None:
+            first_packets.append(positions[dropped_packets])
+            lengths.append(np.ones(np.count_nonzero(dropped_packets), dtype=np.int64))
+        first_packets = np.concatenate(first_packets)
+        if len(first_packets) > 0:
+            lengths = np.concatenate(lengths)
+            order = np.argsort(first_packets, kind='stable')
+            first_samples = self._samples_unpacked + first_packets[order] * payload_words
+            self.missing_ranges.extend(zip(first_samples.tolist(), (lengths[order] * payload_words).tolist()))
+        self._samples_unpacked += (len(missing_packets) + int(missing_packets.sum())) * payload_words
+
+    def get_missing_rows(self):
+        # (first row, number of rows) of unpacked data with missing samples in any channel, adjacent merged
+        rows = []
+        for first_sample, number_of_samples in self.missing_ranges:
+            first_row = first_sample // self.number_of_channels
+            end_row = -(-(first_sample + number_of_samples) // self.number_of_channels)
+            if rows and rows[-1][0] + rows[-1][1] >= first_row:
+                rows[-1][1] = max(rows[-1][1], end_row - rows[-1][0])
             else:
-                unpacked_array = np.concatenate((unpacked_array, self.unpack_package(packet)), axis=1)
-        return unpacked_array
+                rows.append([first_row, end_row - first_row])
+        return np.array(rows, dtype=np.int64).reshape(-1, 2)
+
+    def apply_bad_packets_policy(self, payload, packet_ids, bad_packets):
+        if self.bad_packets_policy == self.BAD_PACKETS_PASS or not bad_packets.any():
+            return payload
+        if self.bad_packets_policy == self.BAD_PACKETS_FLAG:
+            self.flagged_packet_ids.extend(packet_ids[bad_packets].tolist())
+            return payload
+        payload = payload.copy()
+        payload[bad_packets] = self.FILL_VALUE
+        return payload
+
+    def fill_missing_packets(self, payload, missing_packets):
+        # lost packets are replaced with FILL_VALUE, so the sample index always corresponds to time
+        total_missing = int(missing_packets.sum())
+        if total_missing == 0:
+            return payload
+        self.filled_packets += total_missing
+        positions = np.arange(len(payload)) + np.cumsum(missing_packets)
+        filled_payload = np.full((len(payload) + total_missing, payload.shape[1]), self.FILL_VALUE,
+                                 dtype=np.uint16)
+        filled_payload[positions] = payload
+        return filled_payload
+
+    def _copy_payload(self, payload, out):
+        # samples of one time point may be split between two packets, those are carried over
+        carried = len(self._samples_remainder)
+        total_samples = carried + payload.size
+        number_of_rows = total_samples // self.number_of_channels
+        if out is None:
+            out = np.empty((number_of_rows, self.number_of_channels), dtype=np.uint16)
+        else:
+            out = out[:number_of_rows]
+        out_flat = out.reshape(-1)
+
+        if number_of_rows == 0:
+            # transfer shorter than a packet, nothing completes a time point yet
+            self._samples_remainder = np.concatenate((self._samples_remainder, payload.reshape(-1)))
+        elif carried == 0 and total_samples == out_flat.size:
+            out_flat.reshape(payload.shape)[:] = payload
+        else:
+            payload = payload.reshape(-1)
+            used = out_flat.size - carried
+            out_flat[:carried] = self._samples_remainder
+            out_flat[carried:] = payload[:used]
+            self._samples_remainder = payload[used:].copy()
+        return out
 
     def read_from_file_and_unpack(self, file_path):
-        with open(file_path, 'rb') as file:
-            buff = file.read()
-            buff = bytearray(buff)
-            unpacked_data = self.unpack_from_buffer(buff)
-        return unpacked_data
+        # file is memory mapped, not read into memory
+        buff = np.memmap(file_path, dtype=np.uint8, mode='r')
+        return self.unpack_from_buffer(buff)
 
     def print_summary(self):
-        print('Packets read: {}, with wrong checksums: {}, with wrong ids: {}'.format(
+        print('Packets read: {}, with wrong checksums: {}, with wrong ids: {}, missing packets filled: {}'.format(
             self.all_received,
             self.with_incorrect_checksum,
-            self.with_incorrect_id))
+            self.with_incorrect_id,
+            self.filled_packets))
         print('Unpacked {} bytes of data total.'.format(self.all_received*self.packet_length))
 
 
 if __name__ == '__main__':
 
+    # run as: python -m demo_src.data_unpacker file_path [number_of_channels] [packet_length]
     if len(sys.argv) > 1:
         file_path = sys.argv[1]
     else:
         print('File to read not provided')
         sys.exit(1)
+    number_of_channels = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    packet_length = int(sys.argv[3]) if len(sys.argv) > 3 else 512
 
-    du = DataUnpacker()
+    du = DataUnpacker(packet_length, number_of_channels)
     start = time.time()
     du.read_from_file_and_unpack(file_path)
     print("Execution time: {} seconds".format(time.time()-start))
+    du.print_summary()
 
 
 
@@ -0,0 +1,112 @@
+import time
+import logging
+from collections import deque
+
+from .fpga_device import FPGADevice
+
+logger = logging.getLogger("Status bar logger")
+
+
+# Keeps a time series of DDR fill levels read between transfers, its high-water mark and the trend,
+# warns when the headroom gets small or the DDR would overflow soon at the current rate.
+# With POLICY_PAUSE data generation is stopped (trigger in 0x40) before the DDR overflows and started again
+# when it is drained - samples are not generated in the meantime, but the received data stays continuous.
+# Sampling rate of the design is fixed in the bitfile, so it can't be lowered instead.
+class DDRMonitor:
+    POLICY_WARN = 'warn'
+    POLICY_PAUSE = 'pause'
+
+    HISTORY_LENGTH = 10000
+    TREND_WINDOW = 1.0  # in seconds, fill rate is computed over this time
+    WARNING_INTERVAL = 5.0  # in seconds, warnings are repeated not more often
+
+    def __init__(self, capacity=FPGADevice.DDR_CAPACITY_IN_BYTES, warning_level=0.5, warning_time=10.0, policy=POLICY_WARN,
+                 pause_level=0.9, pause_time=1.0, resume_level=0.25):
+        # levels are fractions of the capacity, warning_time and pause_time are times to overflow in seconds
+        self.capacity = capacity
+        self.warning_level = warning_level
+        self.warning_time = warning_time
+        self.policy = policy
+        self.pause_level = pause_level
+        self.pause_time = pause_time
+        self.resume_level = resume_level
+
+        self.history = deque(maxlen=self.HISTORY_LENGTH)  # (time, fill level in bytes)
+        self._trend = deque()  # samples from the last TREND_WINDOW
+        self.high_water = 0
+        self.fill_level = 0
+        self.fill_rate = 0.0  # in bytes per second, positive when DDR fills up
+        self.warnings = 0
+        self.overflows = 0  # times the DDR got full, data generated in the meantime is lost
+        self.pauses = 0
+        self.paused = False
+        self.paused_time = 0.0  # in seconds
+        self._pause_start = None
+        self._last_warning = None
+
+    def add_fill_level(self, fill_level, device=None, now=None):
+        # device is needed for POLICY_PAUSE
+        if now is None:
+            now = time.monotonic()
+        self.history.append((now, fill_level))
+        self._trend.append((now, fill_level))
+        while now - self._trend[0][0] > self.TREND_WINDOW:
+            self._trend.popleft()
+        if fill_level >= self.capacity > self.fill_level:
+            self.overflows += 1
+            logger.error("DDR full, data is lost")
+        self.fill_level = fill_level
+        if fill_level > self.high_water:
+            self.high_water = fill_level
+        first_time, first_fill_level = self._trend[0]
+        self.fill_rate = (fill_level - first_fill_level) / (now - first_time) if now > first_time else 0.0
+        self._check_warning(now)
+        if self.policy == self.POLICY_PAUSE and device is not None:
+            self._apply_pause_policy(device, now)
+
+    def get_time_to_overflow(self):
+        # in seconds at the current fill rate, None when DDR doesn't fill up
+        if self.fill_rate <= 0:
+            return None
+        return (self.capacity - self.fill_level) / self.fill_rate
+
+    def _check_warning(self, now):
+        headroom = 1 - self.fill_level / self.capacity
+        time_to_overflow = self.get_time_to_overflow()
+        if headroom >= 1 - self.warning_level and (time_to_overflow is None or time_to_overflow > self.warning_time):
+            return
+        if self._last_warning is not None and now - self._last_warning < self.WARNING_INTERVAL:
+            return
+        self._last_warning = now
+        self.warnings += 1
+        logger.warning("DDR filled in {:.0f}%, {}".format(
+            100 * self.fill_level / self.capacity,
+            "overflow in {:.1f} s".format(time_to_overflow) if time_to_overflow is not None else "draining"))
+
+    def _apply_pause_policy(self, device, now):
+        time_to_overflow = self.get_time_to_overflow()
+        if not self.paused and (self.fill_level >= self.pause_level * self.capacity or
+                                (time_to_overflow is not None and time_to_overflow < self.pause_time)):
+            device.stop_data_generation()
+            self.paused = True
+            self.pauses += 1
+            self._pause_start = now
+            logger.warning("DDR filled in {:.0f}%, data generation paused".format(
+                100 * self.fill_level / self.capacity))
+        elif self.paused and self.fill_level <= self.resume_level * self.capacity:
+            device.start_data_generation()
+            self.paused = False
+            self.paused_time += now - self._pause_start
+            logger.warning("Data generation resumed after {:.1f} s".format(now - self._pause_start))
+
+    def get_stats(self):
+        return {'fill_level': self.fill_level,
+                'high_water': self.high_water,
+                'capacity': self.capacity,
+                'fill_rate': self.fill_rate,
+                'time_to_overflow': self.get_time_to_overflow(),
+                'warnings': self.warnings,
+                'overflows': self.overflows,
+                'pauses': self.pauses,
+                'paused': self.paused,
+                'paused_time': self.paused_time}
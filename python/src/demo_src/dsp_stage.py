@@ -0,0 +1,159 @@
+import time
+import threading
+
+import numpy as np
+
+try:
+    from scipy import signal
+except ImportError:
+    signal = None  # scipy is needed only for IIR filters
+
+from .pipeline_queue import PipelineQueue, STOP_SENTINEL
+from .stage_metrics import StageMetrics
+
+
+# Processors work on (samples x channels) float64 arrays, all channels at once. Their state is carried from
+# one buffer to the next, so processing data in parts gives the same result as processing all of it at once.
+
+class FIRFilter:
+    CHUNK_LENGTH = 4096  # in samples
+
+    def __init__(self, coefficients):
+        self.coefficients = np.asarray(coefficients, dtype=np.float64)
+        self._history = None  # last len(coefficients) - 1 input samples
+
+    def process(self, data):
+        taps = len(self.coefficients)
+        if self._history is None:
+            self._history = np.zeros((taps - 1, data.shape[1]))
+        extended = np.concatenate((self._history, data))
+        output = np.zeros(data.shape)
+        # computed in parts which fit in the CPU cache, every tap is a pass over the data
+        for start in range(0, len(data), self.CHUNK_LENGTH):
+            end = min(start + self.CHUNK_LENGTH, len(data))
+            part = output[start:end]
+            product = np.empty(part.shape)
+            for tap, coefficient in enumerate(self.coefficients):
+                np.multiply(extended[start + taps - 1 - tap:end + taps - 1 - tap], coefficient, out=product)
+                part += product
+        self._history = extended[len(extended) - (taps - 1):]
+        return output
+
+    def reset(self):
+        self._history = None
+
+
+class IIRFilter:
+    # b, a coefficients like in scipy.signal.lfilter, state starts from zero
+    def __init__(self, b, a):
+        if signal is None:
+            raise Exception("scipy is needed for IIR filters")
+        self.b = np.asarray(b, dtype=np.float64)
+        self.a = np.asarray(a, dtype=np.float64)
+        self._state = None
+
+    def process(self, data):
+        if self._state is None:
+            self._state = np.zeros((max(len(self.a), len(self.b)) - 1, data.shape[1]))
+        output, self._state = signal.lfilter(self.b, self.a, data, axis=0, zi=self._state)
+        return output
+
+    def reset(self):
+        self._state = None
+
+
+class MovingAverage:
+    # mean of the last length samples, from differences of cumulative sums of the whole stream. The sums are
+    # carried from buffer to buffer, so the additions are the same as when all data is processed at once.
+    def __init__(self, length):
+        self.length = length
+        self._sums = None  # last length cumulative sums, the first ones are of samples before the stream
+
+    def process(self, data):
+        if self._sums is None:
+            self._sums = np.zeros((self.length, data.shape[1]))
+        sums = np.empty((len(data) + self.length, data.shape[1]))
+        sums[:self.length] = self._sums
+        sums[self.length:] = data
+        np.cumsum(sums[self.length - 1:], axis=0, out=sums[self.length - 1:])
+        self._sums = sums[len(sums) - self.length:]
+        return (sums[self.length:] - sums[:len(data)]) / self.length
+
+    def reset(self):
+        self._sums = None
+
+
+class Decimator:
+    # keeps every factor-th sample, samples number 0, factor, 2 * factor... of the whole stream
+    def __init__(self, factor):
+        self.factor = factor
+        self._position = 0
+
+    def process(self, data):
+        offset = -self._position % self.factor
+        self._position += len(data)
+        return data[offset::self.factor]
+
+    def reset(self):
+        self._position = 0
+
+
+def process_data(processors, data):
+    # runs uint16 (samples x channels) data through processors, result is rounded back to uint16
+    values = data.astype(np.float64)
+    for processor in processors:
+        values = processor.process(values)
+    return np.clip(np.rint(values), 0, np.iinfo(np.uint16).max).astype(np.uint16)
+
+
+def get_decimation(processors):
+    decimation = 1
+    for processor in processors:
+        if isinstance(processor, Decimator):
+            decimation *= processor.factor
+    return decimation
+
+
+# Sink of DataManager, which runs unpacked data through processors in its own thread and passes the result
+# to its own sinks. So every sink gets the raw data (from DataManager) or processed data (from a DSPStage).
+class DSPStage:
+    QUEUE_SIZE = 32
+    OVERFLOW_POLICY = PipelineQueue.BLOCK  # state of processors needs every buffer
+
+    def __init__(self, processors, name="dsp"):
+        self.processors = processors
+        self.decimation = get_decimation(processors)
+        self.queue = PipelineQueue(self.QUEUE_SIZE, self.OVERFLOW_POLICY)
+        self.thread = threading.Thread(target=self._run, name="DSP stage {}".format(name))
+        self.metrics = StageMetrics(name, self.queue)
+        self._list_with_all_data_sinks = []
+
+    def add_buffer_to_queue(self, buffer):
+        self.queue.put_buffer(buffer)
+
+    # sinks list is replaced, not modified, so it can be changed while the thread iterates over it
+    def add_data_sink(self, data_sink):
+        self._list_with_all_data_sinks = self._list_with_all_data_sinks + [data_sink]
+
+    def remove_data_sink(self, data_sink):
+        self._list_with_all_data_sinks = [sink for sink in self._list_with_all_data_sinks if sink is not data_sink]
+
+    def _run(self):
+        while True:
+            buffer = self.queue.get()
+            if buffer is STOP_SENTINEL:
+                break
+            start = time.perf_counter()
+            data = process_data(self.processors, buffer)
+            if len(data) > 0:
+                for sink in self._list_with_all_data_sinks:
+                    sink.add_buffer_to_queue(data)
+            self.metrics.add_item(buffer.nbytes, data.nbytes, time.perf_counter() - start)
+            self.queue.task_done()
+
+    def stop(self):
+        self.queue.put_stop()
+        self.thread.join()
+
+    def start(self):
+        self.thread.start()
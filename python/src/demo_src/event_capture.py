@@ -0,0 +1,229 @@
+import time
+import threading
+
+import h5py
+import numpy as np
+
+from .pipeline_queue import PipelineQueue, STOP_SENTINEL
+from .stage_metrics import StageMetrics
+
+
+PRE_TRIGGER_TIME = 0.01  # in seconds
+POST_TRIGGER_TIME = 0.1  # in seconds
+
+# Layout of the event file: every event is a (samples x channels) uint16 data set events/<event number>,
+# with trigger_sample and first_sample attributes (sample numbers from the start of the acquisition).
+# events/index has a row of (trigger_sample, first_sample, length) for every event, in the order of events.
+# start_time, sampling_interval and the trigger settings are attributes of the events group.
+EVENTS_GROUP = 'events'
+INDEX_DATA_SET = 'index'
+INDEX_GROWTH = 1024  # in rows
+
+
+class EventTrigger:
+    MODE_EDGE = 'edge'  # samples where the signal crosses the level
+    MODE_LEVEL = 'level'  # all samples above (rising) or below (falling) the level
+    SLOPE_RISING = 'rising'
+    SLOPE_FALLING = 'falling'
+
+    def __init__(self, channel, level, mode=MODE_EDGE, slope=SLOPE_RISING, hold_off=None):
+        # hold_off is the minimal time between triggers in seconds, post-trigger time by default,
+        # so events don't overlap
+        self.channel = channel
+        self.level = level
+        self.mode = mode
+        self.slope = slope
+        self.hold_off = hold_off
+        self._previous_condition = None  # of the last sample of the previous buffer
+        self._next_allowed_sample = 0
+
+    def _get_condition(self, values):
+        if self.slope == self.SLOPE_RISING:
+            return values >= self.level
+        return values <= self.level
+
+    def find_triggers(self, buffer, first_sample, hold_off):
+        # returns sample numbers of triggers in buffer, which starts with sample number first_sample;
+        # hold_off in samples
+        condition = self._get_condition(buffer[:, self.channel])
+        if self.mode == self.MODE_EDGE:
+            previous_condition = np.empty_like(condition)
+            previous_condition[1:] = condition[:-1]
+            # the first sample of the acquisition is not an edge
+            previous_condition[:1] = condition[:1] if self._previous_condition is None else self._previous_condition
+            condition_met = condition & ~previous_condition
+        else:
+            condition_met = condition
+        if len(condition) > 0:
+            self._previous_condition = condition[-1]
+        candidates = np.flatnonzero(condition_met) + first_sample
+
+        # only the first candidate in every hold-off is a trigger, jumps from one trigger to the next
+        triggers = []
+        index = np.searchsorted(candidates, self._next_allowed_sample)
+        while index < len(candidates):
+            trigger = int(candidates[index])
+            triggers.append(trigger)
+            self._next_allowed_sample = trigger + hold_off
+            index = np.searchsorted(candidates, self._next_allowed_sample)
+        return triggers
+
+    def get_settings(self):
+        return {'channel': self.channel, 'level': self.level, 'mode': self.mode, 'slope': self.slope}
+
+
+class _Event:
+    def __init__(self, number, trigger_sample, first_sample, length, number_of_channels):
+        self.number = number
+        self.trigger_sample = trigger_sample
+        self.first_sample = first_sample
+        self.data = np.empty((length, number_of_channels), dtype=np.uint16)
+        self.filled = 0
+
+    def fill(self, buffer, first_sample):
+        # copies the part of buffer (starting with sample number first_sample) which belongs to the event
+        start = max(self.first_sample + self.filled, first_sample)
+        end = min(self.first_sample + len(self.data), first_sample + len(buffer))
+        if end > start:
+            self.data[start - self.first_sample:end - self.first_sample] = \
+                buffer[start - first_sample:end - first_sample]
+            self.filled = end - self.first_sample
+
+    def is_complete(self):
+        return self.filled == len(self.data)
+
+
+# Sink of DataManager for triggered recording: instead of all samples, only pre_trigger_time before and
+# post_trigger_time after every trigger are saved, each event as a separate data set (see the layout above).
+# The last pre_trigger_time of data is kept, so the pre-trigger part is copied when the trigger is found;
+# the post-trigger part is completed from the next buffers. Triggers are found in whole buffers at once.
+class EventRecorder:
+    QUEUE_SIZE = 32
+    OVERFLOW_POLICY = PipelineQueue.BLOCK  # triggers must be looked for in every sample
+
+    def __init__(self, sampling_interval, trigger, pre_trigger_time=PRE_TRIGGER_TIME,
+                 post_trigger_time=POST_TRIGGER_TIME, start_time=None):
+        self.sampling_interval = sampling_interval
+        self.trigger = trigger
+        self.pre_trigger_samples = int(round(pre_trigger_time / sampling_interval))
+        self.post_trigger_samples = max(int(round(post_trigger_time / sampling_interval)), 1)
+        hold_off = trigger.hold_off if trigger.hold_off is not None else post_trigger_time
+        self.hold_off_samples = max(int(round(hold_off / sampling_interval)), 1)
+        self.start_time = start_time  # time of the first buffer is used when not given
+        self.queue = PipelineQueue(self.QUEUE_SIZE, self.OVERFLOW_POLICY)
+        self.thread = threading.Thread(target=self._run, name="Event recorder")
+        self.metrics = StageMetrics("event recorder", self.queue)
+
+        self.file = None
+        self._group = None
+        self._index = None
+        self.number_of_channels = None
+        self._history = None  # last pre_trigger_samples samples before the current buffer
+        self._pending_events = []  # with post-trigger part not complete yet, in the order of triggers
+        self.samples_processed = 0
+        self.events_triggered = 0
+        self.events_written = 0
+
+    def open_file(self, file_path, number_of_channels):
+        self.number_of_channels = number_of_channels
+        self.file = h5py.File(file_path, 'w')
+        self._group = self.file.create_group(EVENTS_GROUP)
+        self._index = self._group.create_dataset(INDEX_DATA_SET, shape=(0, 3), maxshape=(None, 3), dtype='i8',
+                                                 chunks=(INDEX_GROWTH, 3))
+        self._group.attrs['sampling_interval'] = self.sampling_interval
+        self._group.attrs['pre_trigger_samples'] = self.pre_trigger_samples
+        self._group.attrs['post_trigger_samples'] = self.post_trigger_samples
+        self._group.attrs['hold_off_samples'] = self.hold_off_samples
+        for name, value in self.trigger.get_settings().items():
+            self._group.attrs['trigger_' + name] = value
+        self._history = np.empty((0, number_of_channels), dtype=np.uint16)
+
+    def add_buffer_to_queue(self, buffer):
+        self.queue.put_buffer(buffer)
+
+    def _run(self):
+        while True:
+            buffer = self.queue.get()
+            if buffer is STOP_SENTINEL:
+                break
+            if self.start_time is None:
+                self.start_time = time.time()
+            start = time.perf_counter()
+            written = self.process_buffer(buffer)
+            self.metrics.add_item(buffer.nbytes, written, time.perf_counter() - start)
+            self.queue.task_done()
+        # events cut by the end of the acquisition are saved as they are
+        for event in self._pending_events:
+            event.data = event.data[:event.filled]
+            self._write_event(event)
+        self._pending_events = []
+        self.close_file()
+
+    def process_buffer(self, buffer):
+        # returns number of bytes written to the file
+        first_sample = self.samples_processed
+        for event in self._pending_events:
+            event.fill(buffer, first_sample)
+
+        for trigger_sample in self.trigger.find_triggers(buffer, first_sample, self.hold_off_samples):
+            event_start = max(trigger_sample - self.pre_trigger_samples, 0)
+            event = _Event(self.events_triggered, trigger_sample, event_start,
+                           trigger_sample + self.post_trigger_samples - event_start, self.number_of_channels)
+            event.fill(self._history, first_sample - len(self._history))
+            event.fill(buffer, first_sample)
+            self._pending_events.append(event)
+            self.events_triggered += 1
+
+        # events end in the order of triggers
+        written = 0
+        while self._pending_events and self._pending_events[0].is_complete():
+            event = self._pending_events.pop(0)
+            self._write_event(event)
+            written += event.data.nbytes
+
+        if self.pre_trigger_samples > 0:
+            if len(buffer) >= self.pre_trigger_samples:
+                self._history = buffer[len(buffer) - self.pre_trigger_samples:].copy()
+            else:
+                self._history = np.concatenate((self._history, buffer))[-self.pre_trigger_samples:]
+        self.samples_processed += len(buffer)
+        return written
+
+    def _write_event(self, event):
+        data_set = self._group.create_dataset('{:06d}'.format(event.number), data=event.data)
+        data_set.attrs['trigger_sample'] = event.trigger_sample
+        data_set.attrs['first_sample'] = event.first_sample
+        if self.events_written >= self._index.shape[0]:
+            self._index.resize(self._index.shape[0] + INDEX_GROWTH, axis=0)
+        self._index[self.events_written] = (event.trigger_sample, event.first_sample, len(event.data))
+        self.events_written += 1
+
+    def close_file(self):
+        if self.file:
+            # index is grown in big steps, unused rows are removed here
+            self._index.resize(self.events_written, axis=0)
+            self._group.attrs['start_time'] = self.start_time if self.start_time is not None else time.time()
+            self.file.close()
+            self.file = None
+
+    def stop(self):
+        self.queue.put_stop()
+        self.thread.join()
+
+    def start(self):
+        self.thread.start()
+
+
+def read_events(file_path):
+    # returns settings of the recording (attributes of the events group) and a list of events:
+    # {'trigger_sample', 'first_sample', 'trigger_time' (in seconds from start_time), 'data'}
+    with h5py.File(file_path, 'r') as file:
+        group = file[EVENTS_GROUP]
+        settings = dict(group.attrs)
+        events = []
+        for number, (trigger_sample, first_sample, length) in enumerate(group[INDEX_DATA_SET][:]):
+            events.append({'trigger_sample': int(trigger_sample),
+                           'first_sample': int(first_sample),
+                           'trigger_time': trigger_sample * settings['sampling_interval'],
+                           'data': group['{:06d}'.format(number)][:]})
+    return settings, events
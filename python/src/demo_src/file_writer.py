@@ -1,73 +1,85 @@
 import threading
-import queue
 import time
 import numpy as np
 
 from .write_to_hdf5 import Hdf5Writer
+from .pipeline_queue import PipelineQueue, STOP_SENTINEL
+from .stage_metrics import StageMetrics
 
 
 class FileWriter:
-    BUFFERS_TO_WRITE = 100
+    CHUNKS_TO_WRITE = 8
+    QUEUE_SIZE = 32
+    OVERFLOW_POLICY = PipelineQueue.BLOCK  # data can't be lost
 
-    def __init__(self, sampling_interval):
+    def __init__(self, sampling_interval, start_time=None):
         self.hdf5_wirter = Hdf5Writer()
-        self.should_stop = False
         self.first_buffer = True
         self.sampling_interval=sampling_interval
-        self.queue = queue.Queue()
+        self.start_time = start_time  # time of the first buffer is used when not given
+        self.missing_rows = None  # set before stop(), see DataUnpacker.get_missing_rows()
+        self.queue = PipelineQueue(self.QUEUE_SIZE, self.OVERFLOW_POLICY)
         self.thread = threading.Thread(target=self._run, name="File writer")
+        self.metrics = StageMetrics("file writer", self.queue)
 
-        self._buffer_to_write = None
-        self._buffers_list_to_write = []
-        self._buffers_counter = 0
+        # incoming buffers are copied to the staging buffer, which is written when full
+        self._staging_buffer = None
+        self._staging_length = 0
 
     def open_file(self, file_path, number_of_columns):
-        self.hdf5_wirter.open_file(file_path, number_of_columns)
+        self.hdf5_wirter.open_file(file_path, number_of_columns, 1/self.sampling_interval)
+        self._staging_buffer = np.empty((self.CHUNKS_TO_WRITE * self.hdf5_wirter.chunk_length, number_of_columns),
+                                        dtype=np.uint16)
+        self._staging_length = 0
 
     def add_buffer_to_queue(self, buffer):
-        self.queue.put(buffer)
+        self.queue.put_buffer(buffer)
 
     def _run(self):
         while True:
-            should_stop = self.should_stop and self.queue.empty()
-            if should_stop:
+            buffer = self.queue.get()
+            if buffer is STOP_SENTINEL:
                 break
-            if self.queue.empty():
-                time.sleep(0.01)
-            else:
-                buffer = self.queue.get()
-                if self.first_buffer:
-                    self.add_file_attributes()
-                self.process_buffer(buffer)
-                self.queue.task_done()
+            if self.first_buffer:
+                self.add_file_attributes()
+            start = time.perf_counter()
+            self.process_buffer(buffer)
+            self.metrics.add_item(buffer.nbytes, buffer.nbytes, time.perf_counter() - start)
+            self.queue.task_done()
+        self.write_buffers()
+        if self.missing_rows is not None:
+            self.hdf5_wirter.add_missing_rows(self.missing_rows)
         self.hdf5_wirter.close_file()
 
-    def process_buffer_concatenating(self, buffer):
-        # concatenating
-        if self._buffer_to_write is None:
-            self._buffer_to_write = buffer
-        else:
-            self._buffer_to_write = np.concatenate((self._buffer_to_write, buffer))
-        self._buffers_counter += 1
-        if self._buffers_counter % self.BUFFERS_TO_WRITE == 0:
-            self.hdf5_wirter.append_data(self._buffer_to_write)
-            self._buffer_to_write = None
-
     def process_buffer(self, buffer):
-        # list and append
-        self._buffers_list_to_write.append(buffer)
-        self._buffers_counter += 1
-        if (self._buffers_counter % self.BUFFERS_TO_WRITE == 0) or (self.should_stop and self.queue.empty()):
-            self.hdf5_wirter.append_data(np.concatenate(self._buffers_list_to_write))
-            self._buffers_list_to_write = []
+        # big buffers are written directly, without copying them to the staging buffer first
+        staging_size = len(self._staging_buffer)
+        if self._staging_length == 0 and len(buffer) >= staging_size:
+            length = len(buffer) - len(buffer) % staging_size
+            self.hdf5_wirter.append_data(buffer[:length])
+            buffer = buffer[length:]
+        while len(buffer) > 0:
+            length = min(len(buffer), len(self._staging_buffer) - self._staging_length)
+            self._staging_buffer[self._staging_length:self._staging_length + length] = buffer[:length]
+            self._staging_length += length
+            buffer = buffer[length:]
+            if self._staging_length == len(self._staging_buffer):
+                self.write_buffers()
+
+    def write_buffers(self):
+        if self._staging_length > 0:
+            self.hdf5_wirter.append_data(self._staging_buffer[:self._staging_length])
+            self._staging_length = 0
 
     def add_file_attributes(self):
-        self.hdf5_wirter.add_attribute('start_time', time.time())
+        if self.start_time is None:
+            self.start_time = time.time()
+        self.hdf5_wirter.add_attribute('start_time', self.start_time)
         self.hdf5_wirter.add_attribute('sampling_interval', self.sampling_interval)
         self.first_buffer = False
 
     def stop(self):
-        self.should_stop = True
+        self.queue.put_stop()
         self.thread.join()
 
     def start(self):
@@ -79,7 +91,7 @@ if __name__ == '__main__':
     PACKETS_IN_BUFFER = 16 * 1024 // 64
 
     num_of_channels = 28
-    file_writer = FileWriter()
+    file_writer = FileWriter(1e-6)
     file_writer.open_file('test.h5', num_of_channels)
     file_writer.start()
     data = np.arange(PACKETS_IN_BUFFER* num_of_channels, dtype=np.uint16)
@@ -5,7 +5,10 @@ from datetime import datetime
 import struct
 import logging
 
-from FrontPanelAPI import ok
+try:
+    from FrontPanelAPI import ok
+except ImportError:
+    ok = None  # FrontPanel API is not needed when FPGAEmulator is used
 from .common import ok_error_message
 
 
@@ -14,6 +17,8 @@ logger = logging.getLogger("Status bar logger")
 
 class FPGADevice:
 
+    DDR_CAPACITY_IN_BYTES = 2**30  # see ddr3_fifo_controller.vhd
+
     FILL_LEVEL_WIRE_OUT_ADDRESS = 0x21
     DATA_GENERATION_TRIGGER_IN_ADDRESS = 0x40
     CONTROL_WIRE_IN_ADDRESS = 0x00
@@ -21,6 +26,8 @@ class FPGADevice:
     DATA_PIPE_OUT_ADDRESS = 0xa0
 
     def __init__(self):
+        if ok is None:
+            raise Exception("FrontPanel API not found, see FrontPanelAPI/README.md")
         self.xem = ok.okCFrontPanel()
         logger.info("Opening device...")
         error_code = self.xem.OpenBySerial("")
@@ -72,9 +79,12 @@ class FPGADevice:
         error_code = self.xem.UpdateWireIns()
         self.check_errors(error_code)
 
-    def receive_data(self, block_length, buffer_length):
-
-        buff = bytearray(buffer_length)
+    def receive_data(self, block_length, buffer_length, buffer=None):
+        # data is read into buffer (e.g. from BufferPool) when it is given, the returned transfer is its view
+        if buffer is None:
+            buff = bytearray(buffer_length)
+        else:
+            buff = memoryview(buffer)[:buffer_length]
         bytes_count_or_error = self.xem.ReadFromBlockPipeOut(self.DATA_PIPE_OUT_ADDRESS, block_length, buff)
         if bytes_count_or_error <= 0:
             logger.error("Error while reading from pipe: {}".format(bytes_count_or_error))
@@ -85,7 +95,8 @@ class FPGADevice:
                 return
         else:
             self.timeout_reported = False
-            return buff
+            # transfer can be shorter than requested, unread bytes are not returned
+            return buff[:bytes_count_or_error] if bytes_count_or_error < buffer_length else buff
 
     def get_DDR_fill_level(self):
         self.xem.UpdateWireOuts()
@@ -0,0 +1,228 @@
+import sys
+import time
+import logging
+
+import numpy as np
+
+from .common import ok_error_message
+
+
+logger = logging.getLogger("Status bar logger")
+
+
+def _sine_lookup_table(number_of_samples=256):
+    # the same table as SIN_LOOKUP_TABLE in sine_gen.vhd
+    phase = 2 * np.pi * np.arange(number_of_samples) / number_of_samples
+    return np.round(32767.5 + 32767.5 * np.sin(phase)).astype(np.int64)
+
+
+# Software replacement of FPGADevice, generates packets in the data_packet_wrapper.vhd format:
+# 32-bit packet ID, interleaved samples of sine (even) and saw (odd) sources and 32-bit sum of
+# all preceding words. Packets are kept in an emulated DDR of limited capacity, packets
+# that don't fit in it are lost like on the board.
+class FPGAEmulator:
+
+    DDR_CAPACITY_IN_BYTES = 2**30
+    READ_TIMEOUT = 1.0  # in seconds
+    ERROR_TIMEOUT = -2
+
+    SINE_ACCU_WIDTH = 30
+    SINE_LOOKUP_TABLE = _sine_lookup_table()
+
+    def __init__(self, number_of_channels=4, sampling_rate_Hz=1000, packet_length_in_bytes=512, real_time=True,
+                 dropped_packets_ratio=0.0, bad_checksums_ratio=0.0, timeouts_ratio=0.0, seed=None):
+        self.number_of_channels = number_of_channels
+        self.sampling_rate = sampling_rate_Hz
+        self.packet_length = packet_length_in_bytes
+        self.real_time = real_time
+
+        self.dropped_packets_ratio = dropped_packets_ratio
+        self.bad_checksums_ratio = bad_checksums_ratio
+        self.timeouts_ratio = timeouts_ratio
+        self._random = np.random.RandomState(seed)
+
+        self._words_in_packet = packet_length_in_bytes // 2
+        self._samples_in_packet = self._words_in_packet - 4
+        channels = np.arange(number_of_channels)
+        frequency_ratio = np.maximum(int(sampling_rate_Hz) // ((channels + 1) * 10), 1)
+        self._phase_increment = (2**self.SINE_ACCU_WIDTH) // frequency_ratio
+        self._slope_max = (channels + 1) * 1024
+        self._is_sine = channels % 2 == 0
+
+        self._generation_enabled = False
+        self._generation_start_time = 0
+        self._packets_before_start = 0
+        self._next_packet = 0
+        self._pending_bytes = bytearray()
+        self.packets_lost = 0
+
+        logger.info("Opening emulated device...")
+        self.timeout_reported = False
+
+    def load_bit_file(self, bit_file_path):
+        logger.info("Emulated device, bitfile {} not loaded".format(bit_file_path))
+
+    def reset_design(self, f_rate=0, sig_type=1):
+        logger.info("Performing reset")
+        self._packets_before_start = 0
+        self._generation_start_time = time.monotonic()
+        self._next_packet = 0
+        self._pending_bytes = bytearray()
+        self.packets_lost = 0
+
+    def start_data_generation(self):
+        if not self._generation_enabled:
+            self._generation_start_time = time.monotonic()
+            self._generation_enabled = True
+
+    def stop_data_generation(self):
+        if self._generation_enabled:
+            self._packets_before_start = self._produced_packets()
+            self._generation_enabled = False
+
+    def set_slope_max(self, value):
+        self._slope_max[:] = value
+
+    def receive_data(self, block_length, buffer_length, buffer=None):
+        if self._random.random_sample() < self.timeouts_ratio:
+            if self.real_time:
+                time.sleep(self.READ_TIMEOUT)
+            return self._report_error(self.ERROR_TIMEOUT)
+
+        packets_needed = -(-(buffer_length - len(self._pending_bytes)) // self.packet_length)
+        if not self._wait_for_packets(packets_needed):
+            return self._report_error(self.ERROR_TIMEOUT)
+
+        buff = self._pending_bytes + self._generate_packets(packets_needed)
+        self._pending_bytes = buff[buffer_length:]
+        del buff[buffer_length:]
+        self.timeout_reported = False
+        if buffer is None:
+            return buff
+        transfer = memoryview(buffer)[:buffer_length]
+        transfer[:] = buff
+        return transfer
+
+    def get_DDR_fill_level(self):
+        if not self.real_time:
+            return len(self._pending_bytes)
+        self._drop_overflowed_packets()
+        return (self._produced_packets() - self._next_packet) * self.packet_length + len(self._pending_bytes)
+
+    def _report_error(self, error_code):
+        logger.error("Error while reading from pipe: {}".format(error_code))
+        if self.timeout_reported:
+            raise Exception('Error while reading: {}'.format(ok_error_message[error_code]))
+        self.timeout_reported = True
+
+    def _produced_packets(self):
+        if not self._generation_enabled:
+            return self._packets_before_start
+        elapsed = time.monotonic() - self._generation_start_time
+        samples = int(elapsed * self.sampling_rate) * self.number_of_channels
+        return self._packets_before_start + samples // self._samples_in_packet
+
+    def _drop_overflowed_packets(self):
+        capacity_in_packets = self.DDR_CAPACITY_IN_BYTES // self.packet_length
+        backlog = self._produced_packets() - self._next_packet
+        if backlog > capacity_in_packets:
+            self.packets_lost += backlog - capacity_in_packets
+            self._next_packet += backlog - capacity_in_packets
+
+    def _wait_for_packets(self, number_of_packets):
+        if not self.real_time:
+            return self._generation_enabled
+        deadline = time.monotonic() + self.READ_TIMEOUT
+        while True:
+            self._drop_overflowed_packets()
+            missing = number_of_packets - (self._produced_packets() - self._next_packet)
+            if missing <= 0:
+                return True
+            if not self._generation_enabled:
+                return False
+            time_needed = missing * self._samples_in_packet / (self.number_of_channels * self.sampling_rate)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(time_needed, remaining))
+
+    def _generate_packets(self, number_of_packets):
+        # packets with injected drop are generated (they take their ID and samples) but never sent
+        if number_of_packets <= 0:
+            return bytearray()  # pending bytes of the previous packet cover the read
+        packet_indices = []
+        while number_of_packets > 0:
+            indices = self._next_packet + np.arange(number_of_packets, dtype=np.int64)
+            self._next_packet += number_of_packets
+            if self.dropped_packets_ratio > 0:
+                dropped = self._random.random_sample(number_of_packets) < self.dropped_packets_ratio
+                self.packets_lost += int(np.count_nonzero(dropped))
+                indices = indices[~dropped]
+            packet_indices.append(indices)
+            number_of_packets -= len(indices)
+        packet_indices = np.concatenate(packet_indices)
+
+        words = np.empty((len(packet_indices), self._words_in_packet), dtype='<u2')
+        packet_ids = packet_indices & 0xFFFFFFFF
+        words[:, 0] = packet_ids >> 16
+        words[:, 1] = packet_ids & 0xFFFF
+        words[:, 2:-2] = self._generate_samples(packet_indices)
+
+        checksum = (words[:, 0:-2:2].sum(axis=1, dtype=np.int64) << 16) + words[:, 1:-2:2].sum(axis=1, dtype=np.int64)
+        if self.bad_checksums_ratio > 0:
+            checksum += self._random.random_sample(len(checksum)) < self.bad_checksums_ratio
+        checksum &= 0xFFFFFFFF
+        words[:, -2] = checksum >> 16
+        words[:, -1] = checksum & 0xFFFF
+        return bytearray(words.tobytes())
+
+    def _generate_samples(self, packet_indices):
+        # samples are streamed continuously, so one time point may be split between two packets.
+        # All time points from the first to the last packet are generated as (time points x channels) array,
+        # the stream is cut into packets and the packets needed are selected
+        first_packet = int(packet_indices[0])
+        number_of_packets = int(packet_indices[-1]) - first_packet + 1
+        start = first_packet * self._samples_in_packet
+        end = start + number_of_packets * self._samples_in_packet
+        first_sample = start // self.number_of_channels
+        sample_number = np.arange(first_sample, -(-end // self.number_of_channels), dtype=np.int64)
+
+        samples = np.empty((len(sample_number), self.number_of_channels), dtype=np.uint16)
+        accumulator_mask = 2**self.SINE_ACCU_WIDTH - 1
+        sine_channels = np.flatnonzero(self._is_sine)
+        saw_channels = np.flatnonzero(~self._is_sine)
+        phase = ((sample_number & accumulator_mask)[:, np.newaxis] * self._phase_increment[sine_channels]) & accumulator_mask
+        samples[:, sine_channels] = self.SINE_LOOKUP_TABLE[phase >> (self.SINE_ACCU_WIDTH - 8)]
+        samples[:, saw_channels] = sample_number[:, np.newaxis] % (self._slope_max[saw_channels] + 1)
+
+        offset = start - first_sample * self.number_of_channels
+        stream = samples.reshape(-1)[offset:offset + number_of_packets * self._samples_in_packet]
+        stream = stream.reshape((number_of_packets, self._samples_in_packet))
+        if number_of_packets == len(packet_indices):
+            return stream
+        return stream[packet_indices - first_packet]
+
+
+if __name__ == '__main__':
+    from .data_unpacker import DataUnpacker
+
+    TRANSFER_LENGTH = 4 * 1024 * 1024
+    TRANSFERS = 64
+
+    number_of_channels = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    packet_length = int(sys.argv[2]) if len(sys.argv) > 2 else 512
+
+    device = FPGAEmulator(number_of_channels, packet_length_in_bytes=packet_length, real_time=False)
+    data_unpacker = DataUnpacker(packet_length, number_of_channels)
+    device.reset_design()
+    device.start_data_generation()
+    generation_time = 0
+    start = time.time()
+    for i in range(TRANSFERS):
+        generation_start = time.time()
+        buffer = device.receive_data(1024, TRANSFER_LENGTH)
+        generation_time += time.time() - generation_start
+        data_unpacker.unpack_from_buffer(buffer)
+    unpacking_time = time.time() - start - generation_time
+    print('Unpacking speed {:2f} MB/s'.format(TRANSFERS*TRANSFER_LENGTH/(1024*1024*unpacking_time)))
+    data_unpacker.print_summary()
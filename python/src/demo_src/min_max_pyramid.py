@@ -0,0 +1,153 @@
+import numpy as np
+
+
+GROUP_NAME = "min_max"
+DECIMATION_LEVELS = (16, 256, 4096, 65536)
+MAX_CHUNK_LENGTH = 1024
+MIN_GROWTH_IN_CHUNKS = 16
+
+
+def get_data_set_name(decimation):
+    return "decimation_{}".format(decimation)
+
+
+# Builds per-channel min/max summaries of the data set at a few decimation levels while it is being written.
+# Every level is stored in its own data set of shape (rows/decimation, 2, channels), with minimums at [:, 0, :]
+# and maximums at [:, 1, :]. Every level is computed from the previous one, incomplete blocks are
+# carried over to the next append.
+class MinMaxPyramidWriter:
+    def __init__(self, file, number_of_columns, decimation_levels=DECIMATION_LEVELS):
+        self._group = file.create_group(GROUP_NAME)
+        self._levels = []
+        previous_decimation = 1
+        for decimation in decimation_levels:
+            data_set = self._group.create_dataset(get_data_set_name(decimation),
+                                                  shape=(0, 2, number_of_columns),
+                                                  maxshape=(None, 2, number_of_columns),
+                                                  dtype='u2',
+                                                  chunks=(MAX_CHUNK_LENGTH, 2, number_of_columns))
+            data_set.attrs['decimation'] = decimation
+            self._levels.append({'factor': decimation // previous_decimation,
+                                 'data_set': data_set,
+                                 'length': 0,  # data sets are grown in big steps, like in Hdf5Writer
+                                 'carried_min': np.empty((0, number_of_columns), dtype=np.uint16),
+                                 'carried_max': np.empty((0, number_of_columns), dtype=np.uint16)})
+            previous_decimation = decimation
+
+    def append_data(self, data):
+        self._append(data, data, last=False)
+
+    def close(self):
+        # incomplete blocks are summarized as well, so the last data is covered by all levels
+        number_of_columns = self._levels[0]['carried_min'].shape[1] if self._levels else 0
+        empty = np.empty((0, number_of_columns), dtype=np.uint16)
+        self._append(empty, empty, last=True)
+        for level in self._levels:
+            level['data_set'].resize(level['length'], axis=0)
+
+    def _append(self, minimums, maximums, last):
+        for level in self._levels:
+            minimums, maximums = self._reduce(level, minimums, maximums, last)
+            if len(minimums) > 0:
+                data_set = level['data_set']
+                length = level['length']
+                end = length + len(minimums)
+                allocated_length = data_set.shape[0]
+                if end > allocated_length:
+                    growth = max(allocated_length // 2, MIN_GROWTH_IN_CHUNKS * MAX_CHUNK_LENGTH)
+                    data_set.resize(max(end, allocated_length + growth), axis=0)
+                data_set[length:end] = np.stack((minimums, maximums), axis=1)
+                level['length'] = end
+
+    def _reduce(self, level, minimums, maximums, last):
+        factor = level['factor']
+        reduced_min = []
+        reduced_max = []
+
+        carried_length = len(level['carried_min'])
+        if carried_length > 0:
+            missing = factor - carried_length
+            carried_min = np.concatenate((level['carried_min'], minimums[:missing]))
+            carried_max = np.concatenate((level['carried_max'], maximums[:missing]))
+            minimums = minimums[missing:]
+            maximums = maximums[missing:]
+            if len(carried_min) == factor or last:
+                reduced_min.append(carried_min.min(axis=0, keepdims=True))
+                reduced_max.append(carried_max.max(axis=0, keepdims=True))
+                carried_min = carried_min[:0]
+                carried_max = carried_max[:0]
+            level['carried_min'] = carried_min
+            level['carried_max'] = carried_max
+
+        number_of_blocks = len(minimums) // factor
+        if number_of_blocks > 0:
+            blocks_length = number_of_blocks * factor
+            # reduceat is several times faster than min() over the middle axis of a (blocks, factor, columns) view
+            block_starts = np.arange(0, blocks_length, factor)
+            reduced_min.append(np.minimum.reduceat(minimums[:blocks_length], block_starts, axis=0))
+            reduced_max.append(np.maximum.reduceat(maximums[:blocks_length], block_starts, axis=0))
+            minimums = minimums[blocks_length:]
+            maximums = maximums[blocks_length:]
+
+        if len(minimums) > 0:
+            if last:
+                reduced_min.append(minimums.min(axis=0, keepdims=True))
+                reduced_max.append(maximums.max(axis=0, keepdims=True))
+            else:
+                level['carried_min'] = minimums.copy()
+                level['carried_max'] = maximums.copy()
+
+        if not reduced_min:
+            return minimums[:0], maximums[:0]
+        return np.concatenate(reduced_min), np.concatenate(reduced_max)
+
+
+def read_envelope(file, data_set, channel, first_row, last_row, max_points):
+    # returns row numbers and values of the envelope of data_set[first_row:last_row, channel],
+    # every block is represented by its minimum and maximum, so the envelope has at most max_points points.
+    # With a list of channels (in increasing order) values are returned as (channels x points) array.
+    # The coarsest level giving enough points is read; raw data is read when no level does.
+    number_of_blocks = max(max_points // 2, 1)
+    decimation = 1
+    source = None
+    group = file.get(GROUP_NAME)
+    if group is not None:
+        levels = sorted((level.attrs['decimation'], level) for level in group.values())
+        for level_decimation, level in levels:
+            if (last_row - first_row) // level_decimation >= number_of_blocks:
+                decimation = int(level_decimation)
+                source = level
+
+    if source is None and group is None and last_row - first_row > max_points:
+        # file written without min/max summaries, data is subsampled to keep memory use bounded
+        step = -(-(last_row - first_row) // max_points)
+        return np.arange(first_row, last_row, step), data_set[first_row:last_row:step, channel].T
+
+    if source is None:
+        values = data_set[first_row:last_row, channel].T
+        minimums, maximums = values, values
+        rows = np.arange(first_row, last_row)
+    else:
+        first_block = first_row // decimation
+        last_block = -(-last_row // decimation)
+        values = source[first_block:last_block, :, channel]
+        minimums, maximums = values[:, 0].T, values[:, 1].T
+        rows = np.arange(first_block, last_block) * decimation
+
+    if len(rows) <= max_points and source is None:
+        return rows, values
+
+    # blocks read from file are merged further to fit in max_points
+    return min_max_envelope(rows, minimums, maximums, max_points)
+
+
+def min_max_envelope(rows, minimums, maximums, max_points):
+    # merges consecutive values (along the last axis) into blocks, every block is represented
+    # by its minimum and maximum, so the envelope has at most max_points points
+    number_of_blocks = max(max_points // 2, 1)
+    merged = -(-len(rows) // number_of_blocks)
+    block_starts = np.arange(0, len(rows), merged)
+    minimums = np.minimum.reduceat(minimums, block_starts, axis=-1)
+    maximums = np.maximum.reduceat(maximums, block_starts, axis=-1)
+    envelope = np.stack((minimums, maximums), axis=-1).reshape(minimums.shape[:-1] + (-1,))
+    return np.repeat(rows[block_starts], 2), envelope
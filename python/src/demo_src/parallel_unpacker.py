@@ -0,0 +1,279 @@
+import math
+import logging
+import time
+import queue
+import weakref
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .data_unpacker import DataUnpacker
+
+logger = logging.getLogger("Status bar logger")
+
+
+def _map_output_slots(buffer, number_of_slots, rows_in_slot, number_of_channels, packets_in_slot):
+    # decoded data, packet IDs and checksum flags of all output slots, in one block of shared memory
+    payload = np.ndarray((number_of_slots, rows_in_slot, number_of_channels), dtype=np.uint16, buffer=buffer)
+    offset = -(-payload.nbytes // 8) * 8
+    packet_ids = np.ndarray((number_of_slots, packets_in_slot), dtype=np.int64, buffer=buffer, offset=offset)
+    offset += packet_ids.nbytes
+    wrong_checksum = np.ndarray((number_of_slots, packets_in_slot), dtype=np.bool_, buffer=buffer, offset=offset)
+    return payload, packet_ids, wrong_checksum
+
+
+def _unpack_worker(tasks, results, input_memory_name, output_memory_name, output_slots_shape,
+                   packets_in_slot, packet_length_in_bytes, number_of_channels):
+    input_memory = shared_memory.SharedMemory(name=input_memory_name) if input_memory_name is not None else None
+    files = {}  # memory mapped by the worker itself, data of files is not sent through the input ring
+    output_memory = shared_memory.SharedMemory(name=output_memory_name)
+    payload_slots, packet_ids_slots, wrong_checksum_slots = _map_output_slots(output_memory.buf, *output_slots_shape,
+                                                                              packets_in_slot)
+    data_unpacker = DataUnpacker(packet_length_in_bytes, number_of_channels)
+    words_in_packet = packet_length_in_bytes // 2
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        sequence_number, input_slot, output_slot, file_path, offset, length = task
+        number_of_packets = length // packet_length_in_bytes
+        if file_path is None:
+            source = input_memory.buf
+        else:
+            if file_path not in files:
+                files[file_path] = np.memmap(file_path, dtype=np.uint8, mode='r')
+            source = files[file_path]
+        words = np.ndarray((number_of_packets, words_in_packet), dtype='<u2', buffer=source, offset=offset)
+
+        # IDs and checksums are computed here and written next to the payload, only continuity of IDs
+        # is checked in order by the collecting thread
+        packet_ids, wrong_checksum = data_unpacker.check_packets(words)
+        packet_ids_slots[output_slot, :number_of_packets] = packet_ids
+        wrong_checksum_slots[output_slot, :number_of_packets] = wrong_checksum
+        payload_slots[output_slot].reshape(-1)[:number_of_packets * (words_in_packet - 4)] = \
+            words[:, 2:-2].reshape(-1)
+        results.put((sequence_number, input_slot, output_slot, number_of_packets))
+        del words, source
+
+    del payload_slots, packet_ids_slots, wrong_checksum_slots
+    files.clear()
+    if input_memory is not None:
+        input_memory.close()
+    output_memory.close()
+
+
+# DataUnpacker decoding transfers in worker processes. Transfers are copied into slots of a shared
+# memory ring, workers decode them into slots of a second ring, with packet IDs and checksum flags,
+# and only slot numbers are sent between processes. Files (raw captures) are not copied at all, workers
+# map them and decode ranges given by offset and length, see add_file(). The collecting thread checks continuity of packet IDs
+# in the order the transfers were received and passes views of the output slots to the data handler;
+# a slot is reused when the sinks don't reference its data anymore. Data is copied only when packets
+# are filled or dropped, or when too many slots are kept by the sinks, so slow sinks never stop decoding.
+class ParallelDataUnpacker(DataUnpacker):
+    # transfers being decoded, shared memory takes about (2 + MAX_SLOTS_IN_SINKS / NUMBER_OF_SLOTS) *
+    # NUMBER_OF_SLOTS * max_transfer_length, independent of the number of processes
+    NUMBER_OF_SLOTS = 8
+    MAX_SLOTS_IN_SINKS = 8  # output slots passed to the sinks without copying, on top of those being decoded
+    RESULT_TIMEOUT = 1.0  # in seconds, how often workers are checked while waiting for results
+
+    def __init__(self, packet_length_in_bytes, number_of_channels, number_of_processes, max_transfer_length,
+                 bad_packets_policy=DataUnpacker.BAD_PACKETS_PASS, fill_gaps=True, input_ring=True):
+        # input_ring is not needed when only files are unpacked, max_transfer_length is then the length of
+        # file ranges
+        super().__init__(packet_length_in_bytes, number_of_channels, bad_packets_policy, fill_gaps)
+        self.number_of_processes = number_of_processes
+        self.number_of_slots = self.NUMBER_OF_SLOTS
+        self.number_of_output_slots = self.NUMBER_OF_SLOTS + self.MAX_SLOTS_IN_SINKS
+        self.input_ring = input_ring
+
+        # every slot holds whole packets and whole time points, so workers don't depend on each other
+        payload_words = packet_length_in_bytes // 2 - 4
+        self._payload_words = payload_words
+        packets_in_unit = number_of_channels // math.gcd(payload_words, number_of_channels)
+        self._transfer_unit = packets_in_unit * packet_length_in_bytes
+        self._input_slot_size = (max_transfer_length // self._transfer_unit + 1) * self._transfer_unit
+        self._packets_in_slot = self._input_slot_size // packet_length_in_bytes
+        rows_in_slot = self._packets_in_slot * payload_words // number_of_channels
+        self._output_slots_shape = (self.number_of_output_slots, rows_in_slot, number_of_channels)
+
+        self._input_memory = None
+        self._output_memory = None
+        self._payload_slots = None
+        self._packet_ids_slots = None
+        self._wrong_checksum_slots = None
+        self._free_slots = queue.Queue()
+        self._free_output_slots = queue.Queue()
+        self._output_lock = threading.Lock()
+        self._slots_in_sinks = 0
+        self._output_memory_released = False
+        self._transfer_remainder = b''
+        self._sequence_number = 0
+
+        context = multiprocessing.get_context('spawn')
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        self._context = context
+        self._processes = []
+        self._workers_failed = False
+        self._stop_requested = False
+        self.metrics.queue = None  # transfers wait in shared memory slots, not in the queue
+
+    def add_buffer_to_queue(self, buffer):
+        data = memoryview(buffer)
+        while len(self._transfer_remainder) + len(data) >= self._transfer_unit:
+            length = min(len(self._transfer_remainder) + len(data), self._input_slot_size)
+            data = self._send_task(data, length - length % self._transfer_unit)
+        self._transfer_remainder += bytes(data)
+        if self.buffer_pool is not None:
+            self.buffer_pool.release(buffer)  # transfer is copied to shared memory already
+
+    def _send_task(self, data, length):
+        # copies length bytes of the remainder and data to a free slot, returns the rest of data
+        slot = self._get_free_slot(self._free_slots)
+        output_slot = self._get_free_slot(self._free_output_slots)
+        start = slot * self._input_slot_size
+        carried = len(self._transfer_remainder)
+        self._input_memory.buf[start:start + carried] = self._transfer_remainder
+        self._input_memory.buf[start + carried:start + length] = data[:length - carried]
+        self._transfer_remainder = b''
+
+        self._tasks.put((self._sequence_number, slot, output_slot, None, start, length))
+        self._sequence_number += 1
+        return data[length - carried:]
+
+    def add_file(self, file_path, length):
+        # unpacks the first length bytes of a file in ranges of whole slots, blocks until all ranges are sent
+        for offset in range(0, length, self._input_slot_size):
+            output_slot = self._get_free_slot(self._free_output_slots)
+            self._tasks.put((self._sequence_number, None, output_slot, file_path, offset,
+                             min(self._input_slot_size, length - offset)))
+            self._sequence_number += 1
+
+    def _get_free_slot(self, free_slots):
+        # blocks when all slots are in use
+        while True:
+            if self._workers_failed:
+                raise Exception("Data unpacking process failed")
+            try:
+                return free_slots.get(timeout=self.RESULT_TIMEOUT)
+            except queue.Empty:
+                pass
+
+    def _run(self):
+        pending_results = {}
+        next_sequence_number = 0
+        while True:
+            try:
+                result = self._results.get(timeout=self.RESULT_TIMEOUT)
+            except queue.Empty:
+                # workers exit with code 0 when they are stopped
+                failed_processes = [process for process in self._processes if not process.is_alive() and
+                                    (process.exitcode != 0 or not self._stop_requested)]
+                if failed_processes:
+                    # results of its task will never come, following transfers can't be passed on in order
+                    logger.error("Data unpacking process {} failed with exit code {}".format(
+                        failed_processes[0].name, failed_processes[0].exitcode))
+                    self._workers_failed = True
+                    break
+                continue
+            if result is None:
+                break
+            pending_results[result[0]] = result
+            while next_sequence_number in pending_results:
+                self._process_result(*pending_results.pop(next_sequence_number)[1:])
+                next_sequence_number += 1
+
+    def _process_result(self, slot, output_slot, number_of_packets):
+        start = time.perf_counter()
+        if slot is not None:
+            self._free_slots.put(slot)
+        # output slot holds whole packets, so its data can be viewed as (packets x payload words)
+        number_of_samples = number_of_packets * self._payload_words
+        payload = self._payload_slots[output_slot].reshape(-1)[:number_of_samples]
+        payload = payload.reshape((number_of_packets, self._payload_words))
+        data = self.process_packets(payload, self._packet_ids_slots[output_slot, :number_of_packets],
+                                    self._wrong_checksum_slots[output_slot, :number_of_packets])
+        if (data is payload and len(self._samples_remainder) == 0 and number_of_samples % self.number_of_channels == 0
+                and self._slots_in_sinks < self.MAX_SLOTS_IN_SINKS):
+            data = self._get_output_slot_view(output_slot, number_of_samples // self.number_of_channels)
+        else:
+            data = self._copy_payload(data, None)
+            self._free_output_slots.put(output_slot)
+        del payload
+        self.metrics.add_item(number_of_packets * self.packet_length, data.nbytes, time.perf_counter() - start)
+        self.metrics.corrupt = self.with_incorrect_id + self.with_incorrect_checksum
+        if len(data) > 0 and self.unpacked_data_handler is not None:
+            self.unpacked_data_handler.add_buffer(data)
+
+    def _get_output_slot_view(self, output_slot, number_of_rows):
+        # views of the returned array keep it alive, the slot is released when all of them are gone
+        slot_length = self._output_slots_shape[1] * self.number_of_channels * 2
+        view = np.ndarray((number_of_rows, self.number_of_channels), dtype=np.uint16,
+                          buffer=self._output_memory.buf, offset=output_slot * slot_length)
+        with self._output_lock:
+            self._slots_in_sinks += 1
+        weakref.finalize(view, self._release_output_slot, output_slot)
+        return view
+
+    def _release_output_slot(self, output_slot):
+        # called by the thread dropping the last reference to the slot's data
+        with self._output_lock:
+            self._slots_in_sinks -= 1
+            self._free_output_slots.put(output_slot)
+            if self._output_memory_released and self._slots_in_sinks == 0:
+                self._output_memory.close()
+
+    def start(self):
+        if self.input_ring:
+            self._input_memory = shared_memory.SharedMemory(create=True,
+                                                            size=self.number_of_slots * self._input_slot_size)
+        number_of_output_slots, rows_in_slot, number_of_channels = self._output_slots_shape
+        payload_size = -(-number_of_output_slots * rows_in_slot * number_of_channels * 2 // 8) * 8
+        output_size = payload_size + number_of_output_slots * self._packets_in_slot * (8 + 1)
+        self._output_memory = shared_memory.SharedMemory(create=True, size=output_size)
+        self._payload_slots, self._packet_ids_slots, self._wrong_checksum_slots = \
+            _map_output_slots(self._output_memory.buf, *self._output_slots_shape, self._packets_in_slot)
+        for slot in range(self.number_of_slots):
+            self._free_slots.put(slot)
+        for output_slot in range(self.number_of_output_slots):
+            self._free_output_slots.put(output_slot)
+
+        for i in range(self.number_of_processes):
+            process = self._context.Process(target=_unpack_worker, name="Data unpacker {}".format(i),
+                                            args=(self._tasks, self._results,
+                                                  self._input_memory.name if self.input_ring else None,
+                                                  self._output_memory.name, self._output_slots_shape,
+                                                  self._packets_in_slot, self.packet_length, self.number_of_channels))
+            process.start()
+            self._processes.append(process)
+        super().start()
+
+    def stop(self):
+        self._stop_requested = True
+        # whole packets left from the last transfer are decoded too, like by DataUnpacker
+        length = len(self._transfer_remainder) - len(self._transfer_remainder) % self.packet_length
+        if length > 0 and not self._workers_failed:
+            incomplete_packet = self._transfer_remainder[length:]
+            self._send_task(b'', length)
+            self._remainder = bytearray(incomplete_packet)
+        for process in self._processes:
+            self._tasks.put(None)
+        for process in self._processes:
+            process.join()
+        self._results.put(None)
+        self.thread.join()
+
+        self._payload_slots = None
+        self._packet_ids_slots = None
+        self._wrong_checksum_slots = None
+        if self._input_memory is not None:
+            self._input_memory.close()
+            self._input_memory.unlink()
+        # data passed to the sinks stays mapped until they release it
+        self._output_memory.unlink()
+        with self._output_lock:
+            self._output_memory_released = True
+            if self._slots_in_sinks == 0:
+                self._output_memory.close()
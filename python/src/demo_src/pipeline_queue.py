@@ -0,0 +1,45 @@
+import queue
+
+
+STOP_SENTINEL = object()
+
+
+# Bounded queue connecting pipeline stages. When it is full, the producer either waits (BLOCK),
+# or the oldest buffer is dropped to make room for the new one (DROP_OLDEST).
+# Stage threads block on get() and finish after receiving STOP_SENTINEL.
+class PipelineQueue(queue.Queue):
+    BLOCK = 'block'
+    DROP_OLDEST = 'drop_oldest'
+
+    def __init__(self, maxsize, overflow_policy=BLOCK):
+        super().__init__(maxsize)
+        self.overflow_policy = overflow_policy
+        self.dropped = 0
+        self.high_water = 0  # the biggest number of items waiting in the queue
+
+    def put_buffer(self, buffer):
+        if self.overflow_policy == self.DROP_OLDEST:
+            self._put_dropping_oldest(buffer)
+        else:
+            self.put(buffer)
+
+    def put_stop(self):
+        if self.overflow_policy == self.DROP_OLDEST:
+            self._put_dropping_oldest(STOP_SENTINEL)
+        else:
+            self.put(STOP_SENTINEL)
+
+    def _put(self, item):
+        super()._put(item)
+        if len(self.queue) > self.high_water:
+            self.high_water = len(self.queue)
+
+    def _put_dropping_oldest(self, item):
+        with self.not_full:
+            if 0 < self.maxsize <= self._qsize() and self.queue[0] is not STOP_SENTINEL:
+                self._get()
+                self.unfinished_tasks -= 1
+                self.dropped += 1
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
@@ -1,77 +1,113 @@
 import threading
-import queue
 import time
 import numpy as np
-import copy
+
+from .pipeline_queue import PipelineQueue, STOP_SENTINEL
+from .min_max_pyramid import min_max_envelope
+from .stage_metrics import StageMetrics
+
+
+MAX_TIME_SPAN = 10  # in seconds
 
 
 class PlotData:
-    def __init__(self, number_of_channels, sampling_rate_Hz):
+    # last max_time_span seconds of data are kept in a circular (channels x capacity) array,
+    # time of a sample is computed from its number and the sampling rate
+    def __init__(self, number_of_channels, sampling_rate_Hz, max_time_span=MAX_TIME_SPAN):
         self.number_of_channels = number_of_channels
-        self._data = []
+        self.sampling_rate = sampling_rate_Hz
+        self.max_time_span = max_time_span
+        self.capacity = max(int(np.ceil(max_time_span * sampling_rate_Hz)), 1)
+        self._data = np.zeros((number_of_channels, self.capacity), dtype=np.uint16)
+        self._samples_written = 0
         self.min_time = 0
         self.max_time = 0
-        self.sampling_rate = sampling_rate_Hz
-
-        for i in range(number_of_channels):
-            # create empty dicts for every channel:
-            self._data.append({'values': None, 'time': None})
 
     def append_data(self, buffer):
-        buffer = buffer.transpose()
-        for i in range(self.number_of_channels):
-            if self._data[i]['values'] is None:
-                self._data[i]['values'] = buffer[i][:]
-                self._data[i]['time'] = self.max_time+(np.arange(buffer.shape[1])+1)/self.sampling_rate
-            else:
-                self._data[i]['time'] = np.concatenate((self._data[i]['time'], self.max_time+(np.arange(buffer.shape[1]))/self.sampling_rate))
-                self._data[i]['values'] = np.concatenate((self._data[i]['values'], buffer[i]))
-
-            assert self._data[i]['values'].shape == self._data[i]['time'].shape
-
-        self.max_time = self._data[-1]['time'][-1]
-
-    def get_data_channel(self, channel, time_span):
-        time_span = int(time_span*self.sampling_rate)
-        data_to_copy = {}
-        data_to_copy['values'] = self._data[channel]['values'][-time_span:]
-        data_to_copy['time'] = self._data[channel]['time'][-time_span:]
-        return copy.deepcopy(data_to_copy)
-
+        # only the last capacity samples of a longer buffer fit, but all of them are counted
+        number_of_samples = len(buffer)
+        buffer = buffer[-self.capacity:].transpose()
+        length = buffer.shape[1]
+        start = (self._samples_written + number_of_samples - length) % self.capacity
+        first_part = min(length, self.capacity - start)
+        self._data[:, start:start + first_part] = buffer[:, :first_part]
+        self._data[:, :length - first_part] = buffer[:, first_part:]
+        self._samples_written += number_of_samples
+
+        self.min_time = self._sample_time(max(self._samples_written - self.capacity, 0))
+        self.max_time = self._sample_time(self._samples_written - 1)
+
+    def _sample_time(self, sample_number):
+        return sample_number / self.sampling_rate
+
+    def _get_values(self, channels, number_of_samples):
+        # returns a contiguous copy of the last number_of_samples values
+        number_of_samples = min(number_of_samples, self._samples_written, self.capacity)
+        end = self._samples_written % self.capacity
+        start = end - number_of_samples
+        if start >= 0:
+            values = self._data[channels, start:end]
+            return values if type(channels) == list else values.copy()  # indexing with a list already copies
+        return np.concatenate((self._data[channels, start:], self._data[channels, :end]), axis=-1)
+
+    def _get_time(self, number_of_samples):
+        first_sample = self._samples_written - number_of_samples
+        return (first_sample + np.arange(number_of_samples)) / self.sampling_rate
+
+    def get_snapshot(self, channels, time_span):
+        # copy of the last time_span of a channel, or (channels x samples) array for a list of channels,
+        # together with the number of its first sample
+        values = self._get_values(channels, int(time_span*self.sampling_rate))
+        return self._samples_written - values.shape[-1], values
+
+    def to_plot_data(self, first_sample, values, max_points=None):
+        # with max_points given, long windows are reduced to min/max envelope of about max_points points,
+        # so the cost of plotting doesn't depend on the sampling rate and time span
+        number_of_samples = values.shape[-1]
+        if max_points is None or number_of_samples <= max_points:
+            return {'values': values, 'time': (first_sample + np.arange(number_of_samples)) / self.sampling_rate}
+        samples, values = min_max_envelope(np.arange(number_of_samples), values, values, max_points)
+        return {'values': values, 'time': (first_sample + samples) / self.sampling_rate}
+
+    def get_data_channel(self, channel, time_span, max_points=None):
+        return self.to_plot_data(*self.get_snapshot(channel, time_span), max_points)
 
     def get_data(self):
-        return copy.deepcopy(self._data)
+        values = self._get_values(slice(None), self.capacity)
+        time = self._get_time(values.shape[1])
+        return [{'values': channel_values, 'time': time} for channel_values in values]
 
     def get_available_time_span(self):
         return self.max_time-self.min_time
 
 
 class PlotDataSource:
+    QUEUE_SIZE = 8
+    OVERFLOW_POLICY = PipelineQueue.DROP_OLDEST  # stale data is not worth plotting
+
     def __init__(self, number_of_channels, sampling_rate_Hz):
         self.plot_data = PlotData(number_of_channels, sampling_rate_Hz)
         self.should_stop = False
-        self.queue = queue.Queue()
+        self.queue = PipelineQueue(self.QUEUE_SIZE, self.OVERFLOW_POLICY)
         self.thread = threading.Thread(target=self._run, name="Plot data source")
         self._lock = threading.Lock()
+        self.metrics = StageMetrics("plot source", self.queue)
 
 
     def add_buffer_to_queue(self, buffer):
-        with self._lock:
-            self.queue.put(buffer)
+        self.queue.put_buffer(buffer)
 
     def _run(self):
         while True:
-            # should_stop = self.should_stop and self.queue.empty()
+            buffer = self.queue.get()
             # dont wait to empty the queue
-            if self.should_stop:
+            if buffer is STOP_SENTINEL or self.should_stop:
                 break
-            if self.queue.empty():
-                time.sleep(0.01)
-            else:
-                buffer = self.queue.get()
-                with self._lock:
-                    self.process_buffer(buffer)
-                self.queue.task_done()
+            start = time.perf_counter()
+            with self._lock:
+                self.process_buffer(buffer)
+            self.metrics.add_item(buffer.nbytes, buffer.nbytes, time.perf_counter() - start)
+            self.queue.task_done()
 
     def get_available_time_span(self):
         with self._lock:
@@ -81,20 +117,25 @@ class PlotDataSource:
     def get_available_channels(self):
         return list(range(self.plot_data.number_of_channels))
 
-    def get_data(self, channel=None, time_span=None):
-        with self._lock:
-            if channel is None:
+    def get_max_time_span(self):
+        return self.plot_data.max_time_span
+
+    def get_data(self, channel=None, time_span=None, max_points=None):
+        # for a list of channels all of them are copied at once and values are returned as (channels x points) array
+        if channel is None:
+            with self._lock:
                 return self.plot_data.get_data()
-            elif type(channel) == int:
-                return self.plot_data.get_data_channel(channel, time_span)
-            elif type(channel) == list:
-                return [self.plot_data.get_data_channel(i, time_span) for i in channel]
+        with self._lock:
+            first_sample, values = self.plot_data.get_snapshot(channel, time_span)
+        # decimation works on the copy, so it doesn't hold back new data
+        return self.plot_data.to_plot_data(first_sample, values, max_points)
 
     def process_buffer(self, buffer):
         self.plot_data.append_data(buffer)
 
     def stop(self):
         self.should_stop = True
+        self.queue.put_stop()
         self.thread.join()
 
     def start(self):
@@ -0,0 +1,68 @@
+import os
+import json
+
+import numpy as np
+
+from .parallel_unpacker import ParallelDataUnpacker
+from .data_manager import DataManager
+from .file_writer import FileWriter
+from .raw_capture_writer import RawCaptureWriter
+
+
+RANGE_LENGTH = 4 * 1024 * 1024  # in bytes, part of the capture unpacked by one process at once
+
+
+def read_capture_info(capture_file_path):
+    with open(RawCaptureWriter.get_info_file_path(capture_file_path)) as file:
+        return json.load(file)
+
+
+def get_capture_length(capture_file_path, info):
+    # length of the data in a capture; when it was not closed properly, the file ends with preallocated
+    # zeros, which would pass as packets with ID 0 and zero checksum. Data is then looked for from the last
+    # saved written_length to the first packet made of zeros only
+    if info['length'] is not None:
+        return info['length']
+    packet_length = info['packet_length_in_bytes']
+    file_length = os.path.getsize(capture_file_path)
+    start = info.get('written_length') or 0
+    start -= start % packet_length
+    if file_length - start < packet_length:
+        return start
+    capture = np.memmap(capture_file_path, dtype=np.uint8, mode='r')
+    packets_in_range = max(RANGE_LENGTH // packet_length, 1)
+    while start + packet_length <= file_length:
+        number_of_packets = min(packets_in_range, (file_length - start) // packet_length)
+        packets = capture[start:start + number_of_packets * packet_length].reshape((number_of_packets, -1))
+        empty_packets = np.flatnonzero(~packets.any(axis=1))
+        if len(empty_packets) > 0:
+            return start + int(empty_packets[0]) * packet_length
+        start += number_of_packets * packet_length
+    return start
+
+
+def convert_raw_capture(capture_file_path, hdf5_file_path, number_of_processes=None, range_length=RANGE_LENGTH):
+    # capture file is memory mapped by ParallelDataUnpacker processes, which unpack it in ranges of
+    # range_length, the result is written by FileWriter in the same layout as during acquisition
+    info = read_capture_info(capture_file_path)
+    length = get_capture_length(capture_file_path, info)
+    if number_of_processes is None:
+        number_of_processes = os.cpu_count()
+
+    data_unpacker = ParallelDataUnpacker(info['packet_length_in_bytes'], info['number_of_channels'],
+                                         number_of_processes, range_length, input_ring=False)
+    file_writer = FileWriter(info['sampling_interval'], info['start_time'])
+    file_writer.open_file(hdf5_file_path, info['number_of_channels'])
+    data_manager = DataManager()
+    data_manager.add_data_sink(file_writer)
+    data_unpacker.add_data_handler(data_manager)
+
+    file_writer.start()
+    data_manager.start()
+    data_unpacker.start()
+    data_unpacker.add_file(capture_file_path, length)
+    data_unpacker.stop()
+    data_manager.stop()
+    file_writer.missing_rows = data_unpacker.get_missing_rows()
+    file_writer.stop()
+    return data_unpacker
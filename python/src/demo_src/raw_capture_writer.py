@@ -0,0 +1,130 @@
+import os
+import json
+import threading
+import time
+
+from .pipeline_queue import PipelineQueue, STOP_SENTINEL
+from .stage_metrics import StageMetrics
+
+
+# Writes raw transfers received from the FPGA to a preallocated file, without unpacking them.
+# Parameters needed to unpack the data later are stored in a json file next to it (see raw_capture_converter.py).
+class RawCaptureWriter:
+    QUEUE_SIZE = 64
+    OVERFLOW_POLICY = PipelineQueue.BLOCK  # data can't be lost
+    WRITE_LENGTH = 8 * 1024 * 1024
+    PREALLOCATION_STEP = 1024 * 1024 * 1024
+    INFO_INTERVAL = 1.0  # in seconds, how often written_length is saved while the capture is written
+
+    def __init__(self, number_of_channels, packet_length_in_bytes, sampling_interval):
+        self.number_of_channels = number_of_channels
+        self.packet_length = packet_length_in_bytes
+        self.sampling_interval = sampling_interval
+        self.queue = PipelineQueue(self.QUEUE_SIZE, self.OVERFLOW_POLICY)
+        self.thread = threading.Thread(target=self._run, name="Raw capture writer")
+        self.metrics = StageMetrics("raw capture writer", self.queue)
+
+        self.file_path = None
+        self._file_descriptor = None
+        self._allocated_length = 0
+        self.bytes_written = 0
+        self.start_time = None
+        self._info_written = 0  # time.monotonic() of the last info file update
+        self.buffer_pool = None  # received buffers are given back to it after writing
+
+        # small transfers are gathered in the write buffer, so the file is written in big sequential parts
+        self._write_buffer = bytearray(self.WRITE_LENGTH)
+        self._write_buffer_length = 0
+
+    @staticmethod
+    def get_info_file_path(file_path):
+        return file_path + '.json'
+
+    def open_file(self, file_path, preallocated_length=PREALLOCATION_STEP):
+        self.file_path = file_path
+        self._file_descriptor = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        self._allocated_length = 0
+        self.bytes_written = 0
+        self._preallocate(preallocated_length)
+
+    def _preallocate(self, length):
+        if hasattr(os, 'posix_fallocate'):
+            os.posix_fallocate(self._file_descriptor, self._allocated_length, length)
+        else:
+            os.ftruncate(self._file_descriptor, self._allocated_length + length)
+        self._allocated_length += length
+
+    def add_buffer_to_queue(self, buffer):
+        self.queue.put_buffer(buffer)
+
+    def _run(self):
+        while True:
+            buffer = self.queue.get()
+            if buffer is STOP_SENTINEL:
+                break
+            if self.start_time is None:
+                self.start_time = time.time()
+                self._write_info()
+            start = time.perf_counter()
+            self.process_buffer(buffer)
+            self.metrics.add_item(len(buffer), len(buffer), time.perf_counter() - start)
+            if self.buffer_pool is not None:
+                self.buffer_pool.release(buffer)
+            self.queue.task_done()
+        self.write_buffers()
+        self.close_file()
+
+    def process_buffer(self, buffer):
+        if self._write_buffer_length + len(buffer) > len(self._write_buffer):
+            self.write_buffers()
+        if len(buffer) >= len(self._write_buffer):
+            self._write(buffer)
+        else:
+            self._write_buffer[self._write_buffer_length:self._write_buffer_length + len(buffer)] = buffer
+            self._write_buffer_length += len(buffer)
+
+    def write_buffers(self):
+        if self._write_buffer_length > 0:
+            self._write(memoryview(self._write_buffer)[:self._write_buffer_length])
+            self._write_buffer_length = 0
+
+    def _write(self, data):
+        if self.bytes_written + len(data) > self._allocated_length:
+            self._preallocate(max(self.PREALLOCATION_STEP, len(data)))
+        data = memoryview(data)
+        written = 0
+        while written < len(data):
+            written += os.write(self._file_descriptor, data[written:])
+        self.bytes_written += len(data)
+        if time.monotonic() - self._info_written > self.INFO_INTERVAL:
+            self._write_info()
+
+    def _write_info(self):
+        info = {'number_of_channels': self.number_of_channels,
+                'packet_length_in_bytes': self.packet_length,
+                'sampling_interval': self.sampling_interval,
+                'start_time': self.start_time,
+                'length': self.bytes_written if self._file_descriptor is None else None,  # None until closed
+                # data up to written_length is in the file even if the capture is never closed,
+                # the rest of the file may be preallocated zeros
+                'written_length': self.bytes_written}
+        # replaced at once, so a crash never leaves a partly written info file
+        info_file_path = self.get_info_file_path(self.file_path)
+        with open(info_file_path + '.tmp', 'w') as file:
+            json.dump(info, file, indent=4)
+        os.replace(info_file_path + '.tmp', info_file_path)
+        self._info_written = time.monotonic()
+
+    def close_file(self):
+        if self._file_descriptor is not None:
+            os.ftruncate(self._file_descriptor, self.bytes_written)
+            os.close(self._file_descriptor)
+            self._file_descriptor = None
+            self._write_info()
+
+    def stop(self):
+        self.queue.put_stop()
+        self.thread.join()
+
+    def start(self):
+        self.thread.start()
@@ -1,19 +1,18 @@
 import h5py
 import numpy as np
-import copy
 
 
-from demo_src.plot_data_source import PlotData
+from demo_src.min_max_pyramid import read_envelope
 
 
+# Reads recordings lazily: the data set stays open and only rows of the requested time window are read,
+# so memory use depends on the number of plotted points, not on the file size.
 class HDF5FileReader:
     def __init__(self, file_path):
         self.file = h5py.File(file_path, 'r')
 
-        group_name = list(self.file.keys())[0]
-        self.group = self.file[group_name]
-        data_set_name = list(self.group.keys())[0]
-        self.data_set = self.group[data_set_name]
+        self.group = self.file["data"]
+        self.data_set = self.group["data_set"]
 
         self.number_of_sources = self.data_set.shape[1]
         self.time_span = self.data_set.shape[0]
@@ -22,20 +21,22 @@ class HDF5FileReader:
         self.sampling_interval = self.data_set.attrs['sampling_interval']
         self.sampling_rate = int(1/self.sampling_interval)
 
-        self.plot_data = PlotData(self.number_of_sources, self.sampling_rate)
+    def has_data(self):
+        return self.time_span > 0
 
-    def load_plot_data(self):
-        if self.time_span == 0:
-            return False
-        else:
-            self.plot_data.append_data(self.data_set[:])
-            return True
+    def get_data(self, channel, min_time, max_time, max_points):
+        # time is counted from start_time of the recording, long windows are returned as min/max envelope.
+        # For a list of channels values are returned as (channels x points) array
+        first_row = min(max(int(min_time / self.sampling_interval), 0), self.time_span)
+        last_row = min(max(int(max_time / self.sampling_interval) + 1, first_row), self.time_span)
+        rows, values = read_envelope(self.file, self.data_set, channel, first_row, last_row, max_points)
+        return {'values': values, 'time': rows * self.sampling_interval}
 
-    def get_data(self, channel, time_span):
-        if type(channel) == list:
-            return [self.plot_data.get_data_channel(i, self.time_span) for i in channel]
-        elif type(channel) == int:
-            return self.plot_data.get_data_channel(channel, self.time_span)
+    def get_duration(self):
+        return self.time_span * self.sampling_interval
 
     def get_available_channels(self):
-        return list(range(self.plot_data.number_of_channels))
+        return list(range(self.number_of_sources))
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,239 @@
+import time
+import logging
+import threading
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+from .pipeline_queue import PipelineQueue, STOP_SENTINEL
+from .stage_metrics import StageMetrics
+
+logger = logging.getLogger("Status bar logger")
+
+DEFAULT_NAME = 'fpga_data_transfer_demo'
+DEFAULT_DURATION = 10  # in seconds, default capacity of the ring
+
+# Layout of the shared memory: header of HEADER_FIELDS uint64 numbers, then (channels x (capacity + max window))
+# uint16 ring of samples. Sample number n of a channel is in column n % capacity; the first max window columns
+# are repeated after the capacity, so any window up to max window samples is contiguous.
+# Counters are numbers of samples since the start: RESERVED is increased before samples are written,
+# WRITTEN after that. Samples from WRITTEN - capacity to WRITTEN can be read, a window is overwritten
+# (overrun) when RESERVED - capacity gets past its first sample.
+MAGIC = 0x4644545346454544
+MAGIC_FIELD = 0
+NUMBER_OF_CHANNELS_FIELD = 1
+CAPACITY_FIELD = 2
+MAX_WINDOW_FIELD = 3
+SAMPLING_INTERVAL_FIELD = 4  # float64
+RESERVED_FIELD = 5
+WRITTEN_FIELD = 6
+CLOSED_FIELD = 7
+HEADER_FIELDS = 8
+HEADER_SIZE = HEADER_FIELDS * 8
+
+POLL_INTERVAL = 0.001  # in seconds
+
+_written_names = set()  # of feeds written by this process
+
+
+class OverrunError(Exception):
+    pass
+
+
+def _attach(name):
+    # memory is owned by the writer, readers must not remove it when they exit
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        memory = shared_memory.SharedMemory(name=name)
+        # a writer in the same process shares the registration, it is removed by its unlink()
+        if name not in _written_names:
+            resource_tracker.unregister(memory._name, 'shared_memory')
+        return memory
+
+
+def _map(memory):
+    header = np.ndarray((HEADER_FIELDS,), dtype=np.uint64, buffer=memory.buf)
+    number_of_channels = int(header[NUMBER_OF_CHANNELS_FIELD])
+    length = int(header[CAPACITY_FIELD]) + int(header[MAX_WINDOW_FIELD])
+    ring = np.ndarray((number_of_channels, length), dtype=np.uint16, buffer=memory.buf, offset=HEADER_SIZE)
+    return header, ring
+
+
+# Publishes unpacked data in a named shared memory ring (see the layout above) for other local processes,
+# which read it with SharedMemoryFeedReader without copying.
+class SharedMemoryFeed:
+    QUEUE_SIZE = 32
+    OVERFLOW_POLICY = PipelineQueue.BLOCK  # writing is a copy to memory, dropped buffers would break sample numbers
+
+    def __init__(self, number_of_channels, sampling_interval, name=DEFAULT_NAME, capacity=None, max_window=None):
+        if capacity is None:
+            capacity = int(DEFAULT_DURATION / sampling_interval)
+        if max_window is None:
+            max_window = capacity // 8
+        self.number_of_channels = number_of_channels
+        self.sampling_interval = sampling_interval
+        self.name = name
+        self.capacity = capacity
+        self.max_window = min(max_window, capacity)
+        self.queue = PipelineQueue(self.QUEUE_SIZE, self.OVERFLOW_POLICY)
+        self.thread = threading.Thread(target=self._run, name="Shared memory feed")
+        self.metrics = StageMetrics("shared memory", self.queue)
+
+        self._memory = None
+        self._header = None
+        self._ring = None
+        self.samples_written = 0
+
+    def add_buffer_to_queue(self, buffer):
+        self.queue.put_buffer(buffer)
+
+    def _run(self):
+        while True:
+            buffer = self.queue.get()
+            if buffer is STOP_SENTINEL:
+                break
+            start = time.perf_counter()
+            self.process_buffer(buffer)
+            self.metrics.add_item(buffer.nbytes, buffer.nbytes, time.perf_counter() - start)
+            self.queue.task_done()
+
+    def process_buffer(self, buffer):
+        first_sample = self.samples_written
+        if len(buffer) > self.capacity:
+            # only the last capacity samples fit in the ring
+            first_sample += len(buffer) - self.capacity
+            buffer = buffer[-self.capacity:]
+        end = first_sample + len(buffer)
+        self._header[RESERVED_FIELD] = end
+
+        position = first_sample % self.capacity
+        length = min(len(buffer), self.capacity - position)
+        self._write_columns(position, buffer[:length])
+        self._write_columns(0, buffer[length:])
+
+        self._header[WRITTEN_FIELD] = end
+        self.samples_written = end
+
+    def _write_columns(self, position, rows):
+        if len(rows) == 0:
+            return
+        end = position + len(rows)
+        self._ring[:, position:end] = rows.T
+        if position < self.max_window:
+            mirrored_end = min(end, self.max_window)
+            self._ring[:, self.capacity + position:self.capacity + mirrored_end] = \
+                self._ring[:, position:mirrored_end]
+
+    def start(self):
+        size = HEADER_SIZE + self.number_of_channels * (self.capacity + self.max_window) * 2
+        try:
+            self._memory = shared_memory.SharedMemory(name=self.name, create=True, size=size)
+        except FileExistsError:
+            # only a feed marked as closed is removed, the memory may belong to a running writer
+            existing_memory = _attach(self.name)
+            header = np.ndarray((HEADER_FIELDS,), dtype=np.uint64, buffer=existing_memory.buf) \
+                if existing_memory.size >= HEADER_SIZE else None
+            closed = header is not None and header[MAGIC_FIELD] == MAGIC and header[CLOSED_FIELD] != 0
+            header = None
+            existing_memory.close()
+            if not closed:
+                raise FileExistsError("Shared memory {} is in use, choose another name or remove it if its "
+                                      "writer has crashed".format(self.name))
+            existing_memory.unlink()
+            self._memory = shared_memory.SharedMemory(name=self.name, create=True, size=size)
+        _written_names.add(self.name)
+        header = np.ndarray((HEADER_FIELDS,), dtype=np.uint64, buffer=self._memory.buf)
+        header[:] = 0
+        header[NUMBER_OF_CHANNELS_FIELD] = self.number_of_channels
+        header[CAPACITY_FIELD] = self.capacity
+        header[MAX_WINDOW_FIELD] = self.max_window
+        header[SAMPLING_INTERVAL_FIELD:SAMPLING_INTERVAL_FIELD + 1].view(np.float64)[0] = self.sampling_interval
+        header[MAGIC_FIELD] = MAGIC  # set last, readers wait for it
+        self._header, self._ring = _map(self._memory)
+        logger.info("Shared memory feed {}: {} channels, {} samples".format(self.name, self.number_of_channels,
+                                                                            self.capacity))
+        self.thread.start()
+
+    def stop(self):
+        self.queue.put_stop()
+        self.thread.join()
+        self._header[CLOSED_FIELD] = 1
+        self._header = None
+        self._ring = None
+        self._memory.close()
+        self._memory.unlink()  # readers keep their mappings until they close them
+        _written_names.discard(self.name)
+
+
+# Reader of SharedMemoryFeed for other processes:
+#
+#     reader = SharedMemoryFeedReader()
+#     next_sample = reader.samples_written
+#     while reader.wait_for_data(next_sample + 1000):
+#         window = reader.get_window(next_sample, 1000)  # view of (channels x 1000) samples
+#         ...
+#         if not reader.is_valid(next_sample):
+#             ...  # window was overwritten while it was used
+#         next_sample += 1000
+class SharedMemoryFeedReader:
+    def __init__(self, name=DEFAULT_NAME):
+        self._memory = _attach(name)
+        header = np.ndarray((HEADER_FIELDS,), dtype=np.uint64, buffer=self._memory.buf)
+        if header[MAGIC_FIELD] != MAGIC:
+            self._memory.close()
+            raise Exception("Shared memory {} is not a data feed".format(name))
+        self._header, self._ring = _map(self._memory)
+        self.name = name
+        self.number_of_channels = int(self._header[NUMBER_OF_CHANNELS_FIELD])
+        self.capacity = int(self._header[CAPACITY_FIELD])
+        self.max_window = int(self._header[MAX_WINDOW_FIELD])
+        self.sampling_interval = float(self._header[SAMPLING_INTERVAL_FIELD:SAMPLING_INTERVAL_FIELD + 1]
+                                       .view(np.float64)[0])
+
+    @property
+    def samples_written(self):
+        return int(self._header[WRITTEN_FIELD])
+
+    @property
+    def closed(self):
+        return bool(self._header[CLOSED_FIELD])
+
+    def get_oldest_sample(self):
+        # first sample which can still be read
+        return max(int(self._header[RESERVED_FIELD]) - self.capacity, 0)
+
+    def wait_for_data(self, number_of_samples, timeout=None):
+        # waits until number_of_samples are written, returns False after timeout or when the writer is stopped
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.samples_written < number_of_samples:
+            if self.closed or (deadline is not None and time.monotonic() > deadline):
+                return False
+            time.sleep(POLL_INTERVAL)
+        return True
+
+    def get_window(self, first_sample, number_of_samples):
+        # returns (channels x number_of_samples) view of the ring, check is_valid() after using it
+        if number_of_samples > self.max_window:
+            raise ValueError("Window longer than {} samples".format(self.max_window))
+        if first_sample + number_of_samples > self.samples_written:
+            raise ValueError("Samples {}-{} not written yet".format(first_sample, first_sample + number_of_samples))
+        if not self.is_valid(first_sample):
+            raise OverrunError("Samples from {} are overwritten".format(first_sample))
+        position = first_sample % self.capacity
+        return self._ring[:, position:position + number_of_samples]
+
+    def get_latest(self, number_of_samples):
+        # returns number of the first sample and a view of the latest samples
+        samples_written = self.samples_written
+        first_sample = max(samples_written - number_of_samples, 0)
+        return first_sample, self.get_window(first_sample, samples_written - first_sample)
+
+    def is_valid(self, first_sample):
+        # False when samples from first_sample were (or are being) overwritten
+        return int(self._header[RESERVED_FIELD]) - self.capacity <= first_sample
+
+    def close(self):
+        self._header = None
+        self._ring = None
+        self._memory.close()
@@ -0,0 +1,226 @@
+import time
+import threading
+
+import numpy as np
+
+from .pipeline_queue import PipelineQueue, STOP_SENTINEL
+from .stage_metrics import StageMetrics
+
+
+STATS_WINDOWS = (0.1, 1.0, 10.0)  # in seconds
+BIN_DURATION = 0.01  # in seconds, statistics are kept for bins of samples, windows end at a bin boundary
+SNAPSHOT_INTERVAL = 0.1  # in seconds of data, how often statistics of the windows are computed
+FFT_LENGTH = 4096  # in samples, shorter at low sampling rates, so a spectrum is ready every SPECTRUM_INTERVAL
+MIN_FFT_LENGTH = 64
+SPECTRUM_AVERAGES = 8  # number of FFT blocks averaged in one spectrum
+SPECTRUM_INTERVAL = 1.0  # in seconds of data
+
+
+# Sink of DataManager with per-channel statistics of the signal for the GUI and acquire.py.
+# Min, max, sum and sum of squares are computed for every bin of samples and kept in circular arrays long
+# enough for the longest window, so min/max/mean/RMS of a window are reductions over its bins.
+# Spectrum is the mean power spectral density of SPECTRUM_AVERAGES consecutive blocks (mean removed, Hann
+# window), computed once every SPECTRUM_INTERVAL, the samples in between are not transformed. So the cost of
+# the spectrum doesn't depend on the sampling rate, and when statistics can't keep up, the oldest buffers
+# are dropped instead of slowing down the acquisition.
+# Results are replaced, never modified, so get_snapshot() only returns references to them. Samples are numbered
+# before the queue, so buffers it drops leave gaps: the unfinished bin and spectrum blocks are not joined across
+# a gap, and windows only take bins which end within the window time before the last bin.
+class SignalMonitor:
+    QUEUE_SIZE = 8
+    OVERFLOW_POLICY = PipelineQueue.DROP_OLDEST  # statistics of stale data are not worth a backlog
+
+    def __init__(self, number_of_channels, sampling_rate_Hz, windows=STATS_WINDOWS, fft_length=None,
+                 spectrum_averages=SPECTRUM_AVERAGES, spectrum_interval=SPECTRUM_INTERVAL):
+        self.number_of_channels = number_of_channels
+        self.sampling_rate = sampling_rate_Hz
+        self.bin_length = max(int(round(BIN_DURATION * sampling_rate_Hz)), 1)
+        bin_duration = self.bin_length / sampling_rate_Hz
+        self.windows = tuple(windows)
+        self._window_bins = [max(int(round(window / bin_duration)), 1) for window in self.windows]
+        self._snapshot_bins = max(int(round(SNAPSHOT_INTERVAL / bin_duration)), 1)
+        if fft_length is None:
+            fft_length = FFT_LENGTH
+            samples_in_interval = sampling_rate_Hz * spectrum_interval
+            while fft_length > MIN_FFT_LENGTH and fft_length * spectrum_averages > samples_in_interval:
+                fft_length //= 2
+        self.fft_length = fft_length
+        self.spectrum_averages = spectrum_averages
+        self._spectrum_interval_samples = max(int(spectrum_interval * sampling_rate_Hz), 1)
+
+        self.queue = PipelineQueue(self.QUEUE_SIZE, self.OVERFLOW_POLICY)
+        self.thread = threading.Thread(target=self._run, name="Signal monitor")
+        self.metrics = StageMetrics("signal monitor", self.queue)
+
+        capacity = max(self._window_bins)
+        self._bin_min = np.zeros((capacity, number_of_channels), dtype=np.uint16)
+        self._bin_max = np.zeros((capacity, number_of_channels), dtype=np.uint16)
+        self._bin_sum = np.zeros((capacity, number_of_channels))
+        self._bin_sum_of_squares = np.zeros((capacity, number_of_channels))
+        self._bin_end = np.zeros(capacity, dtype=np.int64)  # number of the sample after the bin
+        self._bins_written = 0
+        self._next_snapshot_bin = self._snapshot_bins
+        self._partial_bin = np.empty((0, number_of_channels), dtype=np.uint16)  # samples of the unfinished bin
+
+        self._window = np.hanning(fft_length)
+        # one-sided power spectral density of the window-weighted blocks
+        self._spectrum_scale = 2 / (sampling_rate_Hz * np.sum(self._window ** 2))
+        self._frequencies = np.fft.rfftfreq(fft_length, 1 / sampling_rate_Hz)
+        self._spectrum_blocks = np.empty((spectrum_averages * fft_length, number_of_channels), dtype=np.uint16)
+        self._spectrum_fill = 0
+        self._spectrum_first_sample = 0
+        self._next_spectrum_sample = 0
+
+        self.samples_received = 0  # by add_buffer_to_queue, including buffers dropped by the queue
+        self.samples_processed = 0  # number of the sample after the last processed buffer
+        self._stats = None
+        self._spectrum = None
+
+    def add_buffer_to_queue(self, buffer):
+        # samples are numbered before the queue, so blocks it drops leave gaps
+        first_sample = self.samples_received
+        self.samples_received += len(buffer)
+        self.queue.put_buffer((first_sample, buffer))
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is STOP_SENTINEL:
+                break
+            first_sample, buffer = item
+            start = time.perf_counter()
+            self.process_buffer(buffer, first_sample)
+            self.metrics.add_item(buffer.nbytes, 0, time.perf_counter() - start)
+            self.queue.task_done()
+
+    def process_buffer(self, buffer, first_sample=None):
+        # first_sample is the number of the first sample of buffer, the next one by default
+        if first_sample is not None and first_sample != self.samples_processed:
+            # samples before and after a gap are not joined
+            self._partial_bin = self._partial_bin[:0]
+            self._spectrum_fill = 0
+            self.samples_processed = first_sample
+        self._collect_spectrum_blocks(buffer)
+        bin_start = self.samples_processed - len(self._partial_bin)
+        self.samples_processed += len(buffer)
+
+        if len(self._partial_bin) > 0:
+            missing = self.bin_length - len(self._partial_bin)
+            self._partial_bin = np.concatenate((self._partial_bin, buffer[:missing]))
+            buffer = buffer[missing:]
+            if len(self._partial_bin) < self.bin_length:
+                return
+            self._add_bins(self._partial_bin, bin_start)
+            bin_start += self.bin_length
+        number_of_bins = len(buffer) // self.bin_length
+        self._add_bins(buffer[:number_of_bins * self.bin_length], bin_start)
+        self._partial_bin = buffer[number_of_bins * self.bin_length:].copy()
+
+        if self._bins_written >= self._next_snapshot_bin:
+            self._stats = self._compute_stats()
+            self._next_snapshot_bin = self._bins_written + self._snapshot_bins
+
+    def _add_bins(self, samples, first_sample):
+        # samples is (bins * bin_length x channels) from sample number first_sample, all bins are reduced at once
+        number_of_bins = len(samples) // self.bin_length
+        if number_of_bins == 0:
+            return
+        capacity = len(self._bin_min)
+        if number_of_bins > capacity:
+            samples = samples[(number_of_bins - capacity) * self.bin_length:]
+            first_sample += (number_of_bins - capacity) * self.bin_length
+            self._bins_written += number_of_bins - capacity
+            number_of_bins = capacity
+        # reductions of consecutive slices are much faster than reductions over the middle axis of 3D arrays
+        starts = np.arange(0, len(samples), self.bin_length)
+        squares = samples.astype(np.uint32)
+        np.multiply(squares, squares, out=squares)
+        positions = (self._bins_written + np.arange(number_of_bins)) % capacity
+        self._bin_min[positions] = np.minimum.reduceat(samples, starts, axis=0)
+        self._bin_max[positions] = np.maximum.reduceat(samples, starts, axis=0)
+        self._bin_sum[positions] = np.add.reduceat(samples, starts, axis=0, dtype=np.uint64)
+        self._bin_sum_of_squares[positions] = np.add.reduceat(squares, starts, axis=0, dtype=np.uint64)
+        self._bin_end[positions] = first_sample + starts + self.bin_length
+        self._bins_written += number_of_bins
+
+    def _compute_stats(self):
+        capacity = len(self._bin_min)
+        end = int(self._bin_end[(self._bins_written - 1) % capacity])
+        windows = {}
+        for window, window_bins in zip(self.windows, self._window_bins):
+            number_of_bins = min(window_bins, self._bins_written)
+            positions = (self._bins_written - number_of_bins + np.arange(number_of_bins)) % capacity
+            # bins before a gap can be older than the window
+            positions = positions[self._bin_end[positions] > end - window_bins * self.bin_length]
+            number_of_samples = len(positions) * self.bin_length
+            windows[window] = {'min': self._bin_min[positions].min(axis=0),
+                               'max': self._bin_max[positions].max(axis=0),
+                               'mean': self._bin_sum[positions].sum(axis=0) / number_of_samples,
+                               'rms': np.sqrt(self._bin_sum_of_squares[positions].sum(axis=0) / number_of_samples),
+                               'samples': number_of_samples}
+        return {'time': end / self.sampling_rate, 'windows': windows}
+
+    def _collect_spectrum_blocks(self, buffer):
+        # copies consecutive samples from _next_spectrum_sample until all blocks are filled
+        start = max(self._next_spectrum_sample - self.samples_processed, 0)
+        if start >= len(buffer):
+            return
+        if self._spectrum_fill == 0:
+            self._spectrum_first_sample = self.samples_processed + start
+        length = min(len(buffer) - start, len(self._spectrum_blocks) - self._spectrum_fill)
+        self._spectrum_blocks[self._spectrum_fill:self._spectrum_fill + length] = buffer[start:start + length]
+        self._spectrum_fill += length
+        if self._spectrum_fill == len(self._spectrum_blocks):
+            self._spectrum = self._compute_spectrum(self._spectrum_first_sample)
+            self._spectrum_fill = 0
+            self._next_spectrum_sample = self._spectrum_first_sample + max(self._spectrum_interval_samples,
+                                                                           len(self._spectrum_blocks))
+
+    def _compute_spectrum(self, first_sample):
+        # all blocks and channels are transformed at once
+        blocks = self._spectrum_blocks.reshape(self.spectrum_averages, self.fft_length, self.number_of_channels)
+        blocks = blocks.astype(np.float64)
+        blocks -= blocks.mean(axis=1, keepdims=True)
+        blocks *= self._window[:, np.newaxis]
+        transform = np.fft.rfft(blocks, axis=1)
+        power = (transform.real ** 2 + transform.imag ** 2).mean(axis=0) * self._spectrum_scale
+        power[0] /= 2  # DC and Nyquist bins have no negative frequency counterparts
+        if self.fft_length % 2 == 0:
+            power[-1] /= 2
+        return {'time': first_sample / self.sampling_rate,
+                'frequencies': self._frequencies,
+                'power_spectral_density': power,  # (frequencies x channels), in squared ADC counts per Hz
+                'averages': self.spectrum_averages}
+
+    def get_snapshot(self):
+        # latest statistics: {'time': end of data in seconds, 'windows': {window: {'min', 'max', 'mean', 'rms',
+        # 'samples'}}}, values are arrays of channels; latest spectrum: {'time': start of its data in seconds,
+        # 'frequencies', 'power_spectral_density', 'averages'}; both are None before they are computed
+        return {'stats': self._stats, 'spectrum': self._spectrum}
+
+    def stop(self):
+        self.queue.put_stop()
+        self.thread.join()
+        if self._bins_written > 0:
+            self._stats = self._compute_stats()
+
+    def start(self):
+        self.thread.start()
+
+
+def format_signal_stats(snapshot, window):
+    # one line per channel, for logs and acquire.py
+    stats = snapshot['stats']
+    if stats is None or window not in stats['windows']:
+        return []
+    values = stats['windows'][window]
+    spectrum = snapshot['spectrum']
+    lines = []
+    for channel in range(len(values['mean'])):
+        line = 'channel {}: min {}, max {}, mean {:.1f}, RMS {:.1f}'.format(
+            channel, values['min'][channel], values['max'][channel], values['mean'][channel], values['rms'][channel])
+        if spectrum is not None:
+            peak = np.argmax(spectrum['power_spectral_density'][1:, channel]) + 1  # without DC
+            line += ', spectrum peak {:.1f} Hz'.format(spectrum['frequencies'][peak])
+        lines.append(line)
+    return lines
@@ -0,0 +1,71 @@
+MEGABYTE = 1024 * 1024
+
+
+# Counters of a single pipeline stage. They are updated only by the stage thread, once per processed item,
+# and read without locking by get_stats().
+class StageMetrics:
+    def __init__(self, name, queue=None):
+        self.name = name
+        self.queue = queue
+        self.items = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.processing_time = 0.0  # in seconds
+        self.max_processing_time = 0.0
+        self.idle_time = 0.0  # in seconds, time between items when the stage waits for nothing, e.g. USB pipe
+        self.max_idle_time = 0.0
+        self.corrupt = 0
+
+    def add_item(self, bytes_in, bytes_out, processing_time):
+        self.items += 1
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+        self.processing_time += processing_time
+        if processing_time > self.max_processing_time:
+            self.max_processing_time = processing_time
+
+    def add_idle_time(self, idle_time):
+        self.idle_time += idle_time
+        if idle_time > self.max_idle_time:
+            self.max_idle_time = idle_time
+
+    def get_stats(self):
+        return {'name': self.name,
+                'items': self.items,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'processing_time': self.processing_time,
+                'mean_processing_time': self.processing_time / self.items if self.items else 0.0,
+                'max_processing_time': self.max_processing_time,
+                'idle_time': self.idle_time,
+                'max_idle_time': self.max_idle_time,
+                'queue_depth': self.queue.qsize() if self.queue is not None else 0,
+                'queue_high_water': self.queue.high_water if self.queue is not None else 0,
+                'queue_size': self.queue.maxsize if self.queue is not None else 0,
+                'dropped': self.queue.dropped if self.queue is not None else 0,
+                'corrupt': self.corrupt}
+
+
+def format_stats(previous_stats, stats, interval):
+    # one line summary of stages, rates and processing times are computed for the last interval
+    previous_stats = {stage_stats['name']: stage_stats for stage_stats in previous_stats}
+    parts = []
+    for stage_stats in stats:
+        previous = previous_stats.get(stage_stats['name'], {})
+        items = stage_stats['items'] - previous.get('items', 0)
+        bytes_in = stage_stats['bytes_in'] - previous.get('bytes_in', 0)
+        processing_time = stage_stats['processing_time'] - previous.get('processing_time', 0.0)
+        idle_time = stage_stats['idle_time'] - previous.get('idle_time', 0.0)
+        part = '{}: {:.1f} MB/s, {:.2f} ms/item'.format(stage_stats['name'],
+                                                        bytes_in / (MEGABYTE * interval),
+                                                        1000 * processing_time / items if items else 0.0)
+        if idle_time > 0 and items:
+            part += ', idle {:.3f} ms/item (max {:.3f})'.format(1000 * idle_time / items,
+                                                                1000 * stage_stats['max_idle_time'])
+        if stage_stats['queue_size']:
+            part += ', queue {}/{} (max {})'.format(stage_stats['queue_depth'], stage_stats['queue_size'],
+                                                    stage_stats['queue_high_water'])
+        if stage_stats['dropped'] or stage_stats['corrupt']:
+            part += ', dropped {}, corrupt {}'.format(stage_stats['dropped'], stage_stats['corrupt'])
+        parts.append(part)
+    return ' | '.join(parts)
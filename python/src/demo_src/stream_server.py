@@ -0,0 +1,258 @@
+import os
+import socket
+import struct
+import logging
+import threading
+import time
+
+import numpy as np
+
+from .pipeline_queue import PipelineQueue, STOP_SENTINEL
+from .stage_metrics import StageMetrics
+
+logger = logging.getLogger("Status bar logger")
+
+# Protocol, all numbers little endian:
+# client sends a subscription: SUBSCRIPTION header and number_of_channels uint16 channel indexes
+# (no channels means all of them), decimation 1 means every sample,
+# server sends frames: FRAME header and rows x channels uint16 samples.
+# Frame sequence numbers are counted per client, a gap means frames dropped for a slow client.
+# first_sample is the index of the first row in the full rate stream, a gap in it means blocks dropped
+# by the server.
+SUBSCRIPTION_MAGIC = b'FDTS'
+SUBSCRIPTION = struct.Struct('<4sHI')  # magic, number of channels, decimation
+FRAME_MAGIC = b'FDTF'
+FRAME = struct.Struct('<4sIQIHId')  # magic, sequence, first sample, rows, channels, decimation, sampling interval
+SUBSCRIPTION_TIMEOUT = 5.0  # in seconds
+SEND_TIMEOUT = 5.0  # in seconds, client which doesn't read for so long is disconnected
+ACCEPT_INTERVAL = 0.5  # in seconds, how often the server thread checks if it should stop
+
+
+def create_socket(address):
+    # address is a (host, port) tuple for TCP, or a path of Unix domain socket
+    if isinstance(address, str):
+        return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    return socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+
+def receive_exactly(connection, length):
+    buffer = bytearray(length)
+    view = memoryview(buffer)
+    received = 0
+    while received < length:
+        count = connection.recv_into(view[received:])
+        if count == 0:
+            raise ConnectionError("Connection closed")
+        received += count
+    return buffer
+
+
+# Subscriber of StreamServer. Frames are built and sent in its own thread, from a queue which drops
+# the oldest blocks, so a slow client never stalls the acquisition.
+class StreamClient:
+    QUEUE_SIZE = 64
+
+    def __init__(self, connection, address, channels, decimation, sampling_interval):
+        self.connection = connection
+        self.address = address
+        self.channels = channels
+        self.decimation = decimation
+        self.sampling_interval = sampling_interval
+        self.queue = PipelineQueue(self.QUEUE_SIZE, PipelineQueue.DROP_OLDEST)
+        self.thread = threading.Thread(target=self._run, name="Stream client {}".format(address))
+        self.next_sequence = 0  # numbered when queued, so frames dropped from the queue leave gaps
+        self.frames_sent = 0
+        self.last_sent_sample = 0  # index of the sample after the last sent block
+        self.connected = True
+
+    def add_block(self, first_sample, block):
+        self.queue.put_buffer((self.next_sequence, first_sample, block))
+        self.next_sequence = (self.next_sequence + 1) & 0xFFFFFFFF
+
+    def _run(self):
+        try:
+            while True:
+                item = self.queue.get()
+                if item is STOP_SENTINEL:
+                    break
+                sequence, first_sample, block = item
+                self._send_block(sequence, first_sample, block)
+                self.frames_sent += 1
+                self.last_sent_sample = first_sample + len(block)
+                self.queue.task_done()
+        except OSError as error:  # socket.timeout too, after SEND_TIMEOUT
+            logger.info("Stream client {} disconnected: {}".format(self.address, error))
+        self.connected = False
+        self.connection.close()
+
+    def _send_block(self, sequence, first_sample, block):
+        # rows of decimated stream are those with first_sample + row divisible by decimation
+        offset = -first_sample % self.decimation
+        rows = block[offset::self.decimation]
+        if self.channels is not None:
+            rows = rows[:, self.channels]
+        # header and samples are sent at once, small frames would take twice as much of the socket buffer
+        frame = bytearray(FRAME.size + 2 * rows.size)
+        FRAME.pack_into(frame, 0, FRAME_MAGIC, sequence, first_sample + offset, rows.shape[0], rows.shape[1],
+                        self.decimation, self.sampling_interval)
+        np.frombuffer(frame, dtype='<u2', offset=FRAME.size).reshape(rows.shape)[:] = rows
+        self.connection.sendall(frame)
+
+    def get_stats(self, samples_received):
+        # lag is the number of samples received by the server and not sent to the client yet
+        lag = samples_received - self.last_sent_sample
+        return {'address': self.address,
+                'channels': self.channels,
+                'decimation': self.decimation,
+                'frames_sent': self.frames_sent,
+                'frames_dropped': self.queue.dropped,
+                'queued': self.queue.qsize(),
+                'lag_samples': lag,
+                'lag': lag * self.sampling_interval}
+
+    def stop(self):
+        # queued frames are still sent, unless the client doesn't read them
+        self.queue.put_stop()
+        self.thread.join(SEND_TIMEOUT)
+        if self.thread.is_alive():
+            try:
+                self.connection.shutdown(socket.SHUT_RDWR)  # wakes up the thread blocked in sendall
+            except OSError:
+                pass
+            self.thread.join()
+
+
+# Serves unpacked data to clients connected to a local TCP or Unix domain socket, see the protocol above.
+# Like the other sinks, blocks are added by DataManager.
+class StreamServer:
+    QUEUE_SIZE = 32
+    OVERFLOW_POLICY = PipelineQueue.DROP_OLDEST  # clients can't stall the acquisition
+
+    def __init__(self, number_of_channels, sampling_interval, address):
+        self.number_of_channels = number_of_channels
+        self.sampling_interval = sampling_interval
+        self.address = address
+        self.queue = PipelineQueue(self.QUEUE_SIZE, self.OVERFLOW_POLICY)
+        self.thread = threading.Thread(target=self._run, name="Stream server")
+        self.accept_thread = threading.Thread(target=self._accept_clients, name="Stream server listener")
+        self.metrics = StageMetrics("stream server", self.queue)
+        self.samples_received = 0
+        self.should_stop = False
+
+        # clients list is replaced, not modified, so it can be changed while the thread iterates over it
+        self._clients = []
+        self._server_socket = None
+
+    def add_buffer_to_queue(self, buffer):
+        # samples are numbered before the queue, so blocks it drops leave gaps in first_sample of frames
+        first_sample = self.samples_received
+        self.samples_received += len(buffer)
+        self.queue.put_buffer((first_sample, buffer))
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is STOP_SENTINEL:
+                break
+            start = time.perf_counter()
+            first_sample, buffer = item
+            clients = self._clients
+            for client in clients:
+                if client.connected:
+                    client.add_block(first_sample, buffer)
+            self.metrics.add_item(buffer.nbytes, buffer.nbytes * len(clients), time.perf_counter() - start)
+            self.queue.task_done()
+
+    def _accept_clients(self):
+        while not self.should_stop:
+            try:
+                connection, address = self._server_socket.accept()
+            except socket.timeout:
+                self._remove_disconnected_clients()
+                continue
+            except OSError:
+                break  # socket closed
+            try:
+                client = self._subscribe(connection, address or self.address)
+            except (OSError, ValueError) as error:
+                logger.error("Stream client {} rejected: {}".format(address, error))
+                connection.close()
+                continue
+            logger.info("Stream client {} connected, channels {}, decimation {}".format(
+                client.address, client.channels, client.decimation))
+            client.thread.start()
+            self._clients = self._clients + [client]
+
+    def _subscribe(self, connection, address):
+        connection.settimeout(SUBSCRIPTION_TIMEOUT)
+        magic, number_of_channels, decimation = SUBSCRIPTION.unpack(receive_exactly(connection, SUBSCRIPTION.size))
+        if magic != SUBSCRIPTION_MAGIC:
+            raise ValueError("wrong subscription")
+        channels = None
+        if number_of_channels > 0:
+            channels = np.frombuffer(receive_exactly(connection, 2 * number_of_channels), dtype='<u2').tolist()
+            if max(channels) >= self.number_of_channels:
+                raise ValueError("no channel {}".format(max(channels)))
+        if decimation < 1:
+            raise ValueError("wrong decimation {}".format(decimation))
+        connection.settimeout(SEND_TIMEOUT)
+        if connection.family != getattr(socket, 'AF_UNIX', None):
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return StreamClient(connection, address, channels, decimation, self.sampling_interval)
+
+    def _remove_disconnected_clients(self):
+        disconnected = [client for client in self._clients if not client.connected]
+        if disconnected:
+            self._clients = [client for client in self._clients if client.connected]
+            for client in disconnected:
+                client.thread.join()
+
+    def get_clients_stats(self):
+        samples_received = self.samples_received
+        return [client.get_stats(samples_received) for client in self._clients if client.connected]
+
+    def start(self):
+        self._server_socket = create_socket(self.address)
+        if isinstance(self.address, str):
+            if os.path.exists(self.address):
+                os.unlink(self.address)
+        else:
+            self._server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server_socket.bind(self.address)
+        self._server_socket.listen()
+        self._server_socket.settimeout(ACCEPT_INTERVAL)
+        logger.info("Stream server listening on {}".format(self.address))
+        self.thread.start()
+        self.accept_thread.start()
+
+    def stop(self):
+        self.queue.put_stop()
+        self.thread.join()
+        self.should_stop = True
+        self.accept_thread.join()
+        self._server_socket.close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+        for client in self._clients:
+            client.stop()
+        self._clients = []
+
+
+# Client side of the protocol: returns a connected socket, frames are read from it with receive_frame()
+def subscribe(address, channels=None, decimation=1):
+    connection = create_socket(address)
+    connection.connect(address)
+    channels = [] if channels is None else list(channels)
+    connection.sendall(SUBSCRIPTION.pack(SUBSCRIPTION_MAGIC, len(channels), decimation) +
+                       np.array(channels, dtype='<u2').tobytes())
+    return connection
+
+
+def receive_frame(connection):
+    # returns sequence number, index of the first sample, interval between rows in seconds and data of a frame
+    magic, sequence, first_sample, rows, number_of_channels, decimation, sampling_interval = \
+        FRAME.unpack(receive_exactly(connection, FRAME.size))
+    if magic != FRAME_MAGIC:
+        raise ValueError("Wrong frame")
+    data = np.frombuffer(receive_exactly(connection, 2 * rows * number_of_channels), dtype='<u2')
+    return sequence, first_sample, sampling_interval * decimation, data.reshape((rows, number_of_channels))
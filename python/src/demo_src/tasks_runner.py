@@ -0,0 +1,417 @@
+import os
+import threading
+import logging
+import time
+
+import numpy as np
+
+from demo_src.fpga_device import FPGADevice
+from demo_src.fpga_emulator import FPGAEmulator
+from demo_src.data_unpacker import DataUnpacker
+from demo_src.parallel_unpacker import ParallelDataUnpacker
+from demo_src.file_writer import FileWriter
+from demo_src.data_manager import DataManager
+from demo_src.plot_data_source import PlotDataSource, PlotData
+from demo_src.raw_capture_writer import RawCaptureWriter
+from demo_src.stream_server import StreamServer
+from demo_src.shared_memory_feed import SharedMemoryFeed
+from demo_src.stage_metrics import StageMetrics, format_stats
+from demo_src.buffer_pool import BufferPool
+from demo_src.ddr_monitor import DDRMonitor
+from demo_src.dsp_stage import DSPStage
+from demo_src.signal_monitor import SignalMonitor
+from demo_src.event_capture import EventRecorder, PRE_TRIGGER_TIME, POST_TRIGGER_TIME
+from demo_src.transfer_calibration import get_data_rate, calibrate_transfers, get_calibration_key, \
+    load_calibration, save_calibration
+
+BLOCK_LENGTH = 1024
+MIN_TRANSFER_LENGTH = BLOCK_LENGTH
+MAX_TRANSFER_LENGTH = 4 * 1024 * 1024
+SPEED_REPORT_INTERVAL = 1  # in seconds
+STATS_LOG_INTERVAL = 5  # in seconds
+FILL_LEVEL_INTERVAL = 0.01  # in seconds, DDR fill level is estimated between readings
+BUFFER_POOL_SIZE = 16  # received transfers not processed yet, when all are in use the backlog waits in DDR
+# sinks which get the stream processed by dsp_processors, of: file_writer (or event recorder replacing it), plot,
+# stream_server, shared_memory, signal_monitor
+DSP_SINKS = ('file_writer',)
+
+MIN_TIME_SPAN = 1024
+
+logger = logging.getLogger("Status bar logger")
+
+
+# Runs the acquisition: receives data from the FPGA in its own thread and passes it through
+# the processing chain. Independent of Qt, see DemoTasksRunner for the GUI version.
+class TasksRunner:
+    def __init__(self):
+        self.device = None
+        self.data_unpacker = None
+        self.data_manager = None
+        self.file_writer = None
+        self.event_recorder = None
+        self.plot_data_source = None
+        self.raw_capture_writer = None
+        self.stream_server = None
+        self.shared_memory_feed = None
+        self.dsp_stage = None
+        self.signal_monitor = None
+        self._transfers_sink = None
+        self.buffer_pool = None
+        self.ddr_monitor = None
+
+        self.start_services_requested = False
+        self.emulated = False
+        self.calibrate = False
+        self.block_length = BLOCK_LENGTH
+        self.min_transfer_length = MIN_TRANSFER_LENGTH
+        self.max_transfer_length = MAX_TRANSFER_LENGTH
+        self.unpacking_processes = 0
+        self.raw_capture = False
+        self.plotting = True
+        self.signal_monitoring = False
+        self.trigger = None
+        self.pre_trigger_time = PRE_TRIGGER_TIME
+        self.post_trigger_time = POST_TRIGGER_TIME
+        self.stream_server_address = None
+        self.shared_memory_name = None
+        self.ddr_policy = DDRMonitor.POLICY_WARN
+        self.dsp_processors = None
+        self.dsp_sinks = DSP_SINKS
+        self.fill_level_interval = FILL_LEVEL_INTERVAL
+        self.report_transfers = True
+        self.log_stats = True
+        self.metrics = StageMetrics("reader")
+        self._transfer_lengths = []
+        self.bytes_received = 0
+        self.short_transfers = 0  # transfers with less data than requested
+        self.last_fill_level = 0
+        self._fill_level_time = None
+        self._fill_level_estimate = 0
+        self._data_rate = 0
+        self.error = None
+
+        self.should_stop = False
+        self.thread = threading.Thread(target=self._run, name="TaskRunner")
+
+    def start(self, bit_file_path, hdf5_file_path, number_of_channels, package_length_in_bytes, sampling_rate_Hz,
+              emulated=False, min_transfer_length=MIN_TRANSFER_LENGTH, max_transfer_length=MAX_TRANSFER_LENGTH,
+              unpacking_processes=0, raw_capture=False, plotting=True, calibrate=False,
+              stream_server_address=None, shared_memory_name=None, ddr_policy=DDRMonitor.POLICY_WARN,
+              dsp_processors=None, dsp_sinks=DSP_SINKS, signal_monitoring=False,
+              trigger=None, pre_trigger_time=PRE_TRIGGER_TIME, post_trigger_time=POST_TRIGGER_TIME):
+
+        self.bit_file_path = bit_file_path
+        self.hdf5_file_path = hdf5_file_path
+        self.number_of_channels = number_of_channels
+        self.package_length_in_bytes = package_length_in_bytes
+        self.sampling_rate_Hz = sampling_rate_Hz
+        self.sampling_interval = 1/sampling_rate_Hz
+        self.emulated = emulated
+        self._set_transfer_lengths(min_transfer_length, max_transfer_length)
+        self.unpacking_processes = unpacking_processes
+        self.raw_capture = raw_capture
+        self.plotting = plotting
+        self.calibrate = calibrate
+        self.stream_server_address = stream_server_address
+        self.shared_memory_name = shared_memory_name
+        self.ddr_policy = ddr_policy
+        self.dsp_processors = dsp_processors
+        self.dsp_sinks = dsp_sinks
+        self.signal_monitoring = signal_monitoring
+        self.trigger = trigger
+        self.pre_trigger_time = pre_trigger_time
+        self.post_trigger_time = post_trigger_time
+
+        #### start :
+        self.start_services_requested = True
+        self.thread.start()
+
+    def _start_services(self):
+        if self.emulated:
+            self.device = FPGAEmulator(self.number_of_channels, self.sampling_rate_Hz, self.package_length_in_bytes)
+        else:
+            self.device = FPGADevice()
+        self.device.load_bit_file(self.bit_file_path)
+        if self.calibrate:
+            self._calibrate_transfers()
+        self.buffer_pool = BufferPool(BUFFER_POOL_SIZE, self.max_transfer_length)
+        self.ddr_monitor = DDRMonitor(self.device.DDR_CAPACITY_IN_BYTES, policy=self.ddr_policy)
+        self._data_rate = get_data_rate(self.package_length_in_bytes, self.number_of_channels, self.sampling_rate_Hz)
+
+        if self.raw_capture:
+            self._start_raw_capture()
+        else:
+            self._start_processing()
+
+        self.device.reset_design()
+        self.device.start_data_generation()  # enable data generation
+
+        self._services_started()
+
+    def _set_transfer_lengths(self, min_transfer_length, max_transfer_length):
+        # transfer length must be a multiple of the block length
+        self.min_transfer_length = max(min_transfer_length - min_transfer_length % self.block_length, self.block_length)
+        self.max_transfer_length = max(max_transfer_length - max_transfer_length % self.block_length, self.min_transfer_length)
+
+    def _calibrate_transfers(self):
+        # block length and minimal transfer length are measured once for a bit file and stream parameters,
+        # the emulator is calibrated every time
+        key = get_calibration_key(self.package_length_in_bytes, self.number_of_channels, self.sampling_rate_Hz,
+                                  self.unpacking_processes)
+        calibration = None
+        if not self.emulated:
+            calibration = load_calibration(self.bit_file_path, key)
+        if calibration is None:
+            logger.info("Calibrating transfers...")
+            calibration = calibrate_transfers(self.device, self.package_length_in_bytes, self.number_of_channels,
+                                              self.sampling_rate_Hz, self.unpacking_processes)
+            if not self.emulated:
+                save_calibration(self.bit_file_path, key, calibration)
+        self.block_length = calibration['block_length']
+        self._set_transfer_lengths(calibration['transfer_length'], self.max_transfer_length)
+        logger.info("Block length {} B, transfer length {} B, {:.1f} MB/s ({:.1f}x data rate)".format(
+            self.block_length, self.min_transfer_length, calibration['capacity'] / (1024 * 1024),
+            calibration['headroom']))
+
+    def _services_started(self):
+        pass
+
+    def _services_stopped(self):
+        pass
+
+    def _start_processing(self):
+        if self.unpacking_processes > 0:
+            self.data_unpacker = ParallelDataUnpacker(self.package_length_in_bytes, self.number_of_channels,
+                                                      self.unpacking_processes, self.max_transfer_length)
+        else:
+            self.data_unpacker = DataUnpacker(packet_length_in_bytes=self.package_length_in_bytes, number_of_channels=self.number_of_channels)
+        self.data_manager = DataManager()
+        if self.dsp_processors:
+            self.dsp_stage = DSPStage(self.dsp_processors)
+            self.data_manager.add_data_sink(self.dsp_stage)
+        if self.trigger is not None:
+            # triggered recording, only events are written to the file
+            self.event_recorder = EventRecorder(self._get_sink_sampling_interval('file_writer'), self.trigger,
+                                                self.pre_trigger_time, self.post_trigger_time)
+            self.event_recorder.open_file(self.hdf5_file_path, self.number_of_channels)
+            self._add_data_sink('file_writer', self.event_recorder)
+        else:
+            self.file_writer = FileWriter(self._get_sink_sampling_interval('file_writer'))
+            self.file_writer.open_file(self.hdf5_file_path, self.number_of_channels)
+            self._add_data_sink('file_writer', self.file_writer)
+        if self.plotting:
+            self.plot_data_source = PlotDataSource(self.number_of_channels,
+                                                   1 / self._get_sink_sampling_interval('plot'))
+            self._add_data_sink('plot', self.plot_data_source)
+        if self.stream_server_address is not None:
+            self.stream_server = StreamServer(self.number_of_channels,
+                                              self._get_sink_sampling_interval('stream_server'),
+                                              self.stream_server_address)
+            self._add_data_sink('stream_server', self.stream_server)
+        if self.shared_memory_name is not None:
+            self.shared_memory_feed = SharedMemoryFeed(self.number_of_channels,
+                                                       self._get_sink_sampling_interval('shared_memory'),
+                                                       self.shared_memory_name)
+            self._add_data_sink('shared_memory', self.shared_memory_feed)
+        if self.signal_monitoring:
+            self.signal_monitor = SignalMonitor(self.number_of_channels,
+                                                1 / self._get_sink_sampling_interval('signal_monitor'))
+            self._add_data_sink('signal_monitor', self.signal_monitor)
+        self.data_unpacker.add_data_handler(self.data_manager)
+        self.data_unpacker.buffer_pool = self.buffer_pool
+
+        if self.file_writer is not None:
+            self.file_writer.start()
+        if self.event_recorder is not None:
+            self.event_recorder.start()
+        if self.plot_data_source is not None:
+            self.plot_data_source.start()
+        if self.stream_server is not None:
+            self.stream_server.start()
+        if self.shared_memory_feed is not None:
+            self.shared_memory_feed.start()
+        if self.signal_monitor is not None:
+            self.signal_monitor.start()
+        if self.dsp_stage is not None:
+            self.dsp_stage.start()
+        self.data_manager.start()
+        self.data_unpacker.start()
+        self._transfers_sink = self.data_unpacker
+
+    def _get_data_source(self, sink_name):
+        # sinks named in dsp_sinks get the processed stream, other sinks the raw one
+        if self.dsp_stage is not None and sink_name in self.dsp_sinks:
+            return self.dsp_stage
+        return self.data_manager
+
+    def _add_data_sink(self, sink_name, data_sink):
+        self._get_data_source(sink_name).add_data_sink(data_sink)
+
+    def _remove_data_sink(self, sink_name, data_sink):
+        self._get_data_source(sink_name).remove_data_sink(data_sink)
+
+    def _get_sink_sampling_interval(self, sink_name):
+        if self._get_data_source(sink_name) is self.dsp_stage:
+            return self.sampling_interval * self.dsp_stage.decimation
+        return self.sampling_interval
+
+    def _get_missing_rows(self, sink_name):
+        # rows of the sink's stream with filled or dropped samples
+        missing_rows = self.data_unpacker.get_missing_rows()
+        if self._get_data_source(sink_name) is self.dsp_stage and self.dsp_stage.decimation > 1:
+            decimation = self.dsp_stage.decimation
+            first_rows = -(-missing_rows[:, 0] // decimation)
+            end_rows = -(-missing_rows.sum(axis=1) // decimation)
+            missing_rows = np.stack((first_rows, end_rows - first_rows), axis=1)[end_rows > first_rows]
+        return missing_rows
+
+    def _start_raw_capture(self):
+        # received transfers are written to file as they are, see raw_capture_converter.py
+        raw_file_path = os.path.splitext(self.hdf5_file_path)[0] + '.raw'
+        self.raw_capture_writer = RawCaptureWriter(self.number_of_channels, self.package_length_in_bytes, self.sampling_interval)
+        self.raw_capture_writer.open_file(raw_file_path)
+        self.raw_capture_writer.buffer_pool = self.buffer_pool
+        self.raw_capture_writer.start()
+        self._transfers_sink = self.raw_capture_writer
+
+    def _stop_processing(self):
+        if self.plot_data_source is not None:
+            self._remove_data_sink('plot', self.plot_data_source)
+            self.plot_data_source.stop()
+        if self.stream_server is not None:
+            self._remove_data_sink('stream_server', self.stream_server)
+            self.stream_server.stop()
+        if self.signal_monitor is not None:
+            self._remove_data_sink('signal_monitor', self.signal_monitor)
+            self.signal_monitor.stop()
+        logger.debug("Waiting for data unpacker to finish its job....")
+        self.data_unpacker.stop()
+        self.data_unpacker.print_summary()
+        logger.debug("Waiting for data manager to finish its job....")
+        self.data_manager.stop()
+        if self.dsp_stage is not None:
+            logger.debug("Waiting for DSP stage to finish its job....")
+            self.dsp_stage.stop()
+        logger.debug("Waiting for file writer to finish its job....")
+        if self.file_writer is not None:
+            self.file_writer.missing_rows = self._get_missing_rows('file_writer')
+            self.file_writer.stop()
+        if self.event_recorder is not None:
+            self.event_recorder.stop()
+        if self.shared_memory_feed is not None:
+            self.shared_memory_feed.stop()
+        logger.debug("")
+
+    def _run(self):
+        try:
+            self._receive_data()
+        except Exception as exception:
+            # received data is still saved, error is kept for the caller
+            logger.error("Acquisition failed: {}".format(exception))
+            self.error = exception
+        self._stop_services()
+        self._services_stopped()
+
+    def _receive_data(self):
+        start = time.time()
+        stats_logged = start
+        previous_stats = []
+        receive_end = None
+        while True:
+            if self.start_services_requested:
+                self.start_services_requested = False
+                self._start_services()
+            elif self.should_stop:
+                self.device.stop_data_generation()  # disable data generation
+                break
+            else:
+                # receive buffer from FPGA and add it to further processing, the next read should start
+                # right after that, time between reads (pipe is idle) is measured
+                transfer_length = self._get_transfer_length()
+                buffer = self.buffer_pool.acquire()
+                receive_start = time.perf_counter()
+                if receive_end is not None:
+                    self.metrics.add_idle_time(receive_start - receive_end)
+                received_buffer = self.device.receive_data(self.block_length, transfer_length, buffer)
+                receive_end = time.perf_counter()
+                if received_buffer is None:
+                    self.buffer_pool.release(buffer)
+                else:
+                    self._fill_level_estimate -= len(received_buffer)
+                    if len(received_buffer) < transfer_length:
+                        self.short_transfers += 1
+                    self.metrics.add_item(len(received_buffer), len(received_buffer), receive_end - receive_start)
+                    self._transfers_sink.add_buffer_to_queue(received_buffer)
+                    self._transfer_lengths.append(transfer_length)
+                    self.bytes_received += len(received_buffer)
+                    if time.time() - start > SPEED_REPORT_INTERVAL:
+                        if self.report_transfers:
+                            self._report_transfers(time.time() - start)
+                        self._transfer_lengths = []
+                        start = time.time()
+                if self.log_stats and time.time() - stats_logged > STATS_LOG_INTERVAL:
+                    stats = self.get_stats()
+                    logger.info(format_stats(previous_stats, stats, time.time() - stats_logged) +
+                                ' | DDR: {:.1f} MB (max {:.1f} MB)'.format(self.last_fill_level / (1024 * 1024),
+                                                                         self.ddr_monitor.high_water / (1024 * 1024)))
+                    previous_stats = stats
+                    stats_logged = time.time()
+
+    def _stop_services(self):
+        # transfers sink is set after all stages are started
+        if self._transfers_sink is None:
+            return
+        if self.raw_capture_writer is not None:
+            logger.debug("Waiting for raw capture writer to finish its job....")
+            self.raw_capture_writer.stop()
+        elif self.data_unpacker is not None:
+            self._stop_processing()
+
+    def _get_transfer_length(self):
+        # read whole DDR backlog at once when it is big, small transfers keep latency low otherwise
+        fill_level = self._get_fill_level()
+        transfer_length = fill_level - fill_level % self.block_length
+        return min(max(transfer_length, self.min_transfer_length), self.max_transfer_length)
+
+    def _get_fill_level(self):
+        # fill level is read from the device every fill_level_interval and passed to the DDR monitor, in between
+        # it is estimated from the data rate and data received since the last reading, without USB transactions
+        now = time.monotonic()
+        if self._fill_level_time is None or now - self._fill_level_time >= self.fill_level_interval:
+            self.last_fill_level = self.device.get_DDR_fill_level()
+            self.ddr_monitor.add_fill_level(self.last_fill_level, self.device, now)
+            self._fill_level_time = now
+            self._fill_level_estimate = self.last_fill_level
+            return self.last_fill_level
+        produced = 0 if self.ddr_monitor.paused else self._data_rate * (now - self._fill_level_time)
+        return max(int(self._fill_level_estimate + produced), 0)
+
+    def _report_transfers(self, duration):
+        print('Speed {:2f} MB/s, transfers: {}, transfer length min/mean/max: {}/{:.0f}/{} B'.format(
+            sum(self._transfer_lengths)/(1024*1024*duration),
+            len(self._transfer_lengths),
+            min(self._transfer_lengths),
+            sum(self._transfer_lengths)/len(self._transfer_lengths),
+            max(self._transfer_lengths)))
+
+    def get_stats(self):
+        # counters of all running stages, in the order data flows through them
+        stages = [self, self.data_unpacker, self.data_manager, self.dsp_stage, self.file_writer, self.event_recorder,
+                  self.plot_data_source,
+                  self.stream_server, self.shared_memory_feed, self.signal_monitor, self.raw_capture_writer]
+        return [stage.metrics.get_stats() for stage in stages if stage is not None]
+
+    def get_data_source_handle(self):
+        return self.plot_data_source
+
+    def get_signal_snapshot(self):
+        # latest statistics and spectrum of the signal, see SignalMonitor.get_snapshot(), None when not monitored
+        if self.signal_monitor is None:
+            return None
+        return self.signal_monitor.get_snapshot()
+
+    def send_change_slope_max(self, value):
+        self.device.set_slope_max(value)
+
+    def stop(self):
+        self.should_stop = True
@@ -0,0 +1,133 @@
+import os
+import json
+import time
+import logging
+
+from .data_unpacker import DataUnpacker
+
+logger = logging.getLogger("Status bar logger")
+
+# block length must be a power of 2, transfer length a multiple of the block length
+BLOCK_LENGTHS = (1024, 4096, 16384)
+TRANSFER_LENGTHS = (1024, 4096, 16384, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024)
+HEADROOM = 2.0  # required ratio of the transfer capacity to the data rate
+READS_PER_SETTING = 4
+MAX_BACKLOG_WAIT = 1.0  # in seconds, transfers that take longer to fill the DDR are too slow anyway
+
+
+def get_data_rate(packet_length_in_bytes, number_of_channels, sampling_rate_Hz):
+    # bytes per second sent by the FPGA, with packet IDs and checksums
+    samples_in_packet = packet_length_in_bytes // 2 - 4
+    return sampling_rate_Hz * number_of_channels / samples_in_packet * packet_length_in_bytes
+
+
+# Finds the smallest transfer length (the lowest latency) for which reading and unpacking is at least
+# HEADROOM times faster than the data rate. Transfer lengths are checked from the smallest one and every
+# block length is tried for each of them. Every timed read waits until the DDR holds the whole transfer,
+# so only the USB transfer is measured; the time of unpacking the received data is added to it.
+# Data generation is started and stopped here, the design should be reset afterwards.
+def calibrate_transfers(device, packet_length_in_bytes, number_of_channels, sampling_rate_Hz, unpacking_processes=0):
+    data_rate = get_data_rate(packet_length_in_bytes, number_of_channels, sampling_rate_Hz)
+    best = None
+    device.reset_design()
+    device.start_data_generation()
+    try:
+        for transfer_length in TRANSFER_LENGTHS:
+            capacities = {}
+            for block_length in BLOCK_LENGTHS:
+                if block_length > transfer_length:
+                    continue
+                capacity = _measure_capacity(device, block_length, transfer_length, packet_length_in_bytes,
+                                             number_of_channels, unpacking_processes)
+                if capacity is None:
+                    break  # DDR is not filled fast enough for this transfer length
+                capacities[block_length] = capacity
+            if not capacities:
+                break
+            block_length = max(capacities, key=capacities.get)
+            if best is None or capacities[block_length] > best['capacity']:
+                best = {'block_length': block_length, 'transfer_length': transfer_length,
+                        'capacity': capacities[block_length]}
+            if capacities[block_length] >= HEADROOM * data_rate:
+                best = {'block_length': block_length, 'transfer_length': transfer_length,
+                        'capacity': capacities[block_length]}
+                break
+    finally:
+        device.stop_data_generation()
+
+    if best is None:
+        best = {'block_length': BLOCK_LENGTHS[0], 'transfer_length': TRANSFER_LENGTHS[0], 'capacity': 0.0}
+    best['data_rate'] = data_rate
+    best['headroom'] = best['capacity'] / data_rate if data_rate > 0 else float('inf')
+    return best
+
+
+def _measure_capacity(device, block_length, transfer_length, packet_length_in_bytes, number_of_channels,
+                      unpacking_processes):
+    # returns bytes per second which can be received and unpacked, None when DDR is filled too slowly
+    data_unpacker = DataUnpacker(packet_length_in_bytes, number_of_channels)
+    total_time = 0.0
+    for i in range(READS_PER_SETTING):
+        if not _wait_for_backlog(device, transfer_length):
+            return None
+        start = time.perf_counter()
+        buffer = device.receive_data(block_length, transfer_length)
+        read_time = time.perf_counter() - start
+        if buffer is None:
+            return None
+        start = time.perf_counter()
+        data_unpacker.unpack_from_buffer(buffer)
+        total_time += read_time + (time.perf_counter() - start) / max(unpacking_processes, 1)
+    return READS_PER_SETTING * transfer_length / total_time
+
+
+def _wait_for_backlog(device, length):
+    deadline = time.monotonic() + MAX_BACKLOG_WAIT
+    while device.get_DDR_fill_level() < length:
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.001)
+    return True
+
+
+# Results are stored in a json file next to the bit file, for every combination of stream parameters.
+# They are discarded when the bit file changes.
+def get_calibration_file_path(bit_file_path):
+    return bit_file_path + '.calibration.json'
+
+
+def get_calibration_key(packet_length_in_bytes, number_of_channels, sampling_rate_Hz, unpacking_processes):
+    return '{}ch_{}B_{}Hz_{}p'.format(number_of_channels, packet_length_in_bytes, sampling_rate_Hz, unpacking_processes)
+
+
+def _get_bit_file_signature(bit_file_path):
+    status = os.stat(bit_file_path)
+    return {'size': status.st_size, 'mtime': status.st_mtime}
+
+
+def load_calibration(bit_file_path, key):
+    try:
+        with open(get_calibration_file_path(bit_file_path)) as file:
+            calibrations = json.load(file)
+        if calibrations['bit_file'] != _get_bit_file_signature(bit_file_path):
+            return None
+        return calibrations['settings'].get(key)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def save_calibration(bit_file_path, key, calibration):
+    calibrations = {'bit_file': _get_bit_file_signature(bit_file_path), 'settings': {}}
+    try:
+        with open(get_calibration_file_path(bit_file_path)) as file:
+            stored = json.load(file)
+        if stored['bit_file'] == calibrations['bit_file']:
+            calibrations['settings'] = stored['settings']
+    except (OSError, ValueError, KeyError):
+        pass
+    calibrations['settings'][key] = calibration
+    try:
+        with open(get_calibration_file_path(bit_file_path), 'w') as file:
+            json.dump(calibrations, file, indent=4)
+    except OSError as error:
+        logger.error("Calibration not saved: {}".format(error))
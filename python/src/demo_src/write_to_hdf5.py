@@ -1,39 +1,79 @@
 import h5py
 import numpy as np
 
+from .min_max_pyramid import MinMaxPyramidWriter, DECIMATION_LEVELS
+
 
 class Hdf5Writer:
-    MAX_CHUNK_LENGTH = 1024
+    MIN_CHUNK_LENGTH = 1024
+    MAX_CHUNK_SIZE_IN_BYTES = 1024 * 1024
+    CHUNK_DURATION = 0.1  # in seconds
+    MIN_GROWTH_IN_CHUNKS = 64
 
     def __init__(self):
         self.file = None
         self._group = None
         self._data_set = None
+        self._min_max_pyramid = None
+        self._length = 0
+        self.chunk_length = self.MIN_CHUNK_LENGTH
 
     def __del__(self):
         self.close_file()
 
-    def open_file(self, file_path:str, number_of_columns):
+    def open_file(self, file_path:str, number_of_columns, sampling_rate_Hz=None, min_max_decimations=DECIMATION_LEVELS):
+        self.chunk_length = self.get_chunk_length(number_of_columns, sampling_rate_Hz)
+        self._length = 0
         self.file = h5py.File(file_path, 'w')
         self._group = self.file.create_group("data")
         self._data_set = self._group.create_dataset("data_set",
                                                     shape=(0, number_of_columns),
                                                     maxshape=(None, number_of_columns),
                                                     dtype='u2',
-                                                    chunks=(self.MAX_CHUNK_LENGTH, number_of_columns))
+                                                    chunks=(self.chunk_length, number_of_columns))
+        # summaries used by the offline viewer to draw long recordings without reading all the data
+        self._min_max_pyramid = None
+        if min_max_decimations:
+            self._min_max_pyramid = MinMaxPyramidWriter(self.file, number_of_columns, min_max_decimations)
+
+    def get_chunk_length(self, number_of_columns, sampling_rate_Hz):
+        # chunk holds about CHUNK_DURATION of data, but is not smaller than MIN_CHUNK_LENGTH rows
+        # and not bigger than MAX_CHUNK_SIZE_IN_BYTES
+        max_chunk_length = max(self.MAX_CHUNK_SIZE_IN_BYTES // (2 * number_of_columns), 1)
+        chunk_length = self.MIN_CHUNK_LENGTH
+        if sampling_rate_Hz is not None:
+            chunk_length = max(int(sampling_rate_Hz * self.CHUNK_DURATION), chunk_length)
+        return min(chunk_length, max_chunk_length)
+
     def add_attribute(self, name, value):
         # it is recommended to access attributes that way, but how to specify data types then?
         self._data_set.attrs[name] = value
 
+    def add_missing_rows(self, missing_rows):
+        # (first row, number of rows) of filled gaps and dropped packets, their values are not real samples
+        self._group.create_dataset("missing_rows", data=np.asarray(missing_rows, dtype=np.int64).reshape(-1, 2))
+
     def close_file(self):
         if self.file:
+            # data set is grown in big steps, unused rows are removed here
+            self._data_set.resize(self._length, axis=0)
+            if self._min_max_pyramid is not None:
+                self._min_max_pyramid.close()
             self.file.close()
             self.file = None
 
     def append_data(self, data:np.array):
-        shape = self._data_set.shape
-        self._data_set.resize((shape[0]+data.shape[0], data.shape[1]))
-        self._data_set[shape[0]:,:] = data
+        end = self._length + data.shape[0]
+        allocated_length = self._data_set.shape[0]
+        if end > allocated_length:
+            growth = max(allocated_length // 2, self.MIN_GROWTH_IN_CHUNKS * self.chunk_length)
+            new_length = max(end, allocated_length + growth)
+            new_length = -(-new_length // self.chunk_length) * self.chunk_length
+            self._data_set.resize(new_length, axis=0)
+        self._data_set.write_direct(np.ascontiguousarray(data, dtype=np.uint16), dest_sel=np.s_[self._length:end])
+        self._length = end
+        if self._min_max_pyramid is not None:
+            self._min_max_pyramid.append_data(data)
 
 
 if __name__ == '__main__':
@@ -1,15 +1,20 @@
+import numpy as np
 import pyqtgraph as pg
 
 
 from PySide2 import QtCore
 #from .plot_data_source import PlotData
 
+CURVE_COLORS = 8
+
 
 class GraphicWidget(pg.GraphicsLayoutWidget):
     def __init__(self, parent):
         super().__init__(parent=parent)
 
         self._plot = self.addPlot(row=0, col=0, colspan=3)
+        self._plot.addLegend()
+        self._curves = {}
         x_axis = self._plot.getAxis('bottom')
         x_axis.setLabel(text='time', unitPrefix='s')
         x_axis.enableAutoSIPrefix(True)
@@ -18,31 +23,42 @@ class GraphicWidget(pg.GraphicsLayoutWidget):
     def setDownsampling(self, ds, auto, mode):
         self._plot.setDownsampling(ds, auto, mode)
 
+    def connect_x_range_changed(self, slot):
+        self._plot.sigXRangeChanged.connect(slot)
+
+    def get_x_range(self):
+        return self._plot.viewRange()[0]
+
+    def get_plot_width(self):
+        # in pixels
+        return max(int(self._plot.getViewBox().width()), 1)
+
     def plot_data(self, data_to_plot, min_time):
         self._max_x = data_to_plot['time'][-1]
         self._plot.setXRange(min_time, self._max_x, padding=0)
+        self.update_data(data_to_plot)
 
-        plotted_curves = self._plot.listDataItems()
-
+    def update_data(self, data_to_plot):
+        # one curve per plotted channel, values are (channels x points) array
         time = data_to_plot['time']
-        values = data_to_plot['values']
-        #channel_number = i
-        #channel_name = "Channel_{}".format(i+1)
-        channel_name = "Data"
+        channels = data_to_plot['channels']
+        for channel in list(self._curves):
+            if channel not in channels:
+                self._plot.removeItem(self._curves.pop(channel))
         if len(time) < 2:
             return  # skip empty and single points channels
 
-        if len(plotted_curves) != 0:
-            plotted_curves[0].setData(time, values, name=channel_name)
-            #plotted_curves[0].channel_id = channel_number
-
-        else:
-            curve = self._plot.plot(time, values,
-                                    clickable=True, name=channel_name,
-                                    connect="finite")
-
-            #curve.channel_id = channel_number
-            curve.channel_name = channel_name
-            curve.is_selected = False
-            pen = pg.mkPen(color=(0,0,200), width=3)
-            curve.setPen(pen)
+        for channel, values in zip(channels, np.atleast_2d(data_to_plot['values'])):
+            curve = self._curves.get(channel)
+            if curve is not None:
+                curve.setData(time, values)
+            else:
+                channel_name = "Channel {}".format(channel)
+                curve = self._plot.plot(time, values,
+                                        clickable=True, name=channel_name,
+                                        connect="finite")
+                curve.channel_name = channel_name
+                curve.is_selected = False
+                pen = pg.mkPen(color=pg.intColor(channel, hues=CURVE_COLORS), width=3)
+                curve.setPen(pen)
+                self._curves[channel] = curve
@@ -83,6 +83,12 @@ class MainMenuWidget(QtWidgets.QWidget):
     def get_sampling_rate_in_kHz(self):
         return self._ui.spinBox_sampling_rate.value()
 
+    def get_emulated_device(self):
+        return self._ui.checkBox_emulated_device.isChecked()
+
+    def get_calibrate(self):
+        return self._ui.checkBox_calibrate.isChecked()
+
     ############## offline viewer part ###############################
 
     def _open_clicked(self):
@@ -56,7 +56,8 @@ class MainWindow(QMainWindow):
 
     def _process_start_demo(self):
         bit_file_path = self._menu_widget.get_bitfile_path()
-        if not os.path.isfile(bit_file_path):
+        emulated = self._menu_widget.get_emulated_device()
+        if not emulated and not os.path.isfile(bit_file_path):
             logger.error("Error! Wrong bitfile path")
             return
 
@@ -72,7 +73,8 @@ class MainWindow(QMainWindow):
         output_h5_file_path = os.path.join(results_dir, 'received_data{:%Y_%m_%d_%H:%M}.h5'.format(datetime.now()))
 
         self.demo_tasks_runner.services_started.connect(self._process_services_started)
-        self.demo_tasks_runner.start(bit_file_path, output_h5_file_path, number_of_channels, package_length_in_bytes, sampling_rate_Hz)
+        self.demo_tasks_runner.start(bit_file_path, output_h5_file_path, number_of_channels, package_length_in_bytes, sampling_rate_Hz,
+                                     emulated, calibrate=self._menu_widget.get_calibrate())
 
     def _process_open_file(self):
         file_to_open_path = self._menu_widget.get_hdf5_file_path()
@@ -80,7 +82,7 @@ class MainWindow(QMainWindow):
             logger.error("Error! Wrong hdf5 file path")
             return
         self._file_reader = HDF5FileReader(file_to_open_path)
-        if not self._file_reader.load_plot_data():
+        if not self._file_reader.has_data():
             logger.info("Selected file is empty")
             return
         self._menu_widget.hide()
@@ -120,6 +122,7 @@ class MainWindow(QMainWindow):
         self.demo_tasks_runner.stop()
 
     def after_services_stopped(self):
+        self._plot_widget.stop_plotting()
         self._plot_widget.hide()
         self._menu_widget.show()
 
@@ -136,6 +139,8 @@ class MainWindow(QMainWindow):
         self.demo_tasks_runner.send_change_slope_max(value)
 
     def closeEvent(self, event):
+        if self._plot_widget is not None:
+            self._plot_widget.stop_plotting()
         self._process_stop_demo(close=True)
 
 
@@ -1,7 +1,10 @@
 import os
+import queue
+import logging
+import threading
 from PySide2 import QtWidgets
 from PySide2.QtWidgets import QTableWidgetItem, QHeaderView
-from PySide2.QtCore import Slot, Signal, QTimer
+from PySide2.QtCore import Slot, Signal, QTimer, Qt
 
 import pyqtgraph as pg
 
@@ -11,11 +14,17 @@ os.environ["PYQTGRAPH_QT_LIB"] = "PySide2" # added for now, pyqtgraph not workin
 
 
 TIMER_INTERVAL_MS = 700
+ZOOM_DELAY_MS = 100  # data is read again when zooming or panning stopped for that long
+POINTS_PER_PIXEL = 2  # min and max of the data under every pixel of the plot
+
+logger = logging.getLogger("Status bar logger")
 
 class PlotWidget(QtWidgets.QWidget):
     stop_clicked = Signal()
     pause_clicked = Signal()
     change_slope_max = Signal(int)
+    plot_data_ready = Signal(object)
+    plot_data_failed = Signal(str)
 
     def __init__(self, offline=False):
         super().__init__()
@@ -33,8 +42,18 @@ class PlotWidget(QtWidgets.QWidget):
 
         if offline:
             self._set_offline_layout()
-            self._graphic_widget.setDownsampling(ds=100, auto=True, mode='subsample')
+            self.zoom_timer = self.create_zoom_timer()
+            self._graphic_widget.connect_x_range_changed(self._x_range_changed)
         else:
+            # data is read and decimated in a separate thread, so the GUI is not blocked at high sampling rates
+            self._plot_requests = queue.Queue()
+            self._plot_request_pending = False  # until the GUI thread gets the result of the previous request
+            self._plot_data_stopped = threading.Event()
+            self.plot_data_ready.connect(self._plot_prepared_data)
+            self.plot_data_failed.connect(self._plot_data_failed)
+            self._plot_data_thread = threading.Thread(target=self._prepare_plot_data, name="Plot data preparer",
+                                                      daemon=True)
+            self._plot_data_thread.start()
             self.replot_timer = self.create_replot_timer()
 
 
@@ -57,19 +76,31 @@ class PlotWidget(QtWidgets.QWidget):
         replot_timer.start(TIMER_INTERVAL_MS)
         return replot_timer
 
+    def create_zoom_timer(self):
+        zoom_timer = QTimer()
+        zoom_timer.setSingleShot(True)
+        zoom_timer.timeout.connect(self._plot_visible_range)
+        return zoom_timer
+
     def add_data_source_handle(self, data_source_handle):
         self.data_source_handle = data_source_handle
+        if not self.offline:
+            self._ui.spinBox_time_span.setMaximum(self.data_source_handle.get_max_time_span())
         self.update_channels_list(self.data_source_handle.get_available_channels())
-        self._ui.comboBox_channels.currentIndexChanged.connect(self._channel_changed)
+        self._ui.listWidget_channels.itemChanged.connect(self._channels_changed)
 
     def update_channels_list(self, available_channles):
+        # first channel is plotted at start, any subset of channels can be checked
         for channel in available_channles:
-            self._ui.comboBox_channels.addItem(f"{channel}")
+            item = QtWidgets.QListWidgetItem(f"{channel}", self._ui.listWidget_channels)
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Checked if channel == available_channles[0] else Qt.Unchecked)
 
-    @Slot(str)
-    def _channel_changed(self, selected_channel: str):
-        channel_number = int(selected_channel)
-        self.plot_data()
+    def _channels_changed(self, *args):
+        if self.offline:
+            self._plot_visible_range()
+        else:
+            self.plot_data()
 
     @Slot(int)
     def change_time_span(self, new_time_span: int):
@@ -83,22 +114,95 @@ class PlotWidget(QtWidgets.QWidget):
 
     @Slot()
     def _replot_timer_timeout(self):
-        if not self.paused:
+        if not self.paused and not self._plot_data_stopped.is_set():
             if self.data_source_handle is not None:
                 if self.data_source_handle.get_available_time_span()>self.time_span:
                     self.plot_data()
             self.replot_timer.start(TIMER_INTERVAL_MS)
 
+    def _x_range_changed(self, *args):
+        self.zoom_timer.start(ZOOM_DELAY_MS)
+
+    @Slot()
+    def _plot_visible_range(self):
+        min_time, max_time = self._graphic_widget.get_x_range()
+        plot_data = self._read_data(self._get_selected_channels(), min_time, max_time, self._get_max_points())
+        self._graphic_widget.update_data(plot_data)
+
     @Slot()
     def plot_data(self):
-        selected_channel = self._get_selected_channel()
-        plot_data = self.data_source_handle.get_data(selected_channel, self.time_span)
+        selected_channels = self._get_selected_channels()
+        if self.offline:
+            # whole recording is shown first, only the visible part is read when zooming
+            plot_data = self._read_data(selected_channels, 0, self.data_source_handle.get_duration(),
+                                        self._get_max_points())
+            if len(plot_data['time']) > 0:
+                self._graphic_widget.plot_data(plot_data, 0)
+            return
+        if not self._plot_request_pending:
+            self._plot_request_pending = True
+            self._plot_requests.put((selected_channels, self.time_span, self._get_max_points()))
+
+    def _prepare_plot_data(self):
+        while True:
+            request = self._plot_requests.get()
+            if request is None or self._plot_data_stopped.is_set():
+                break
+            channels, time_span, max_points = request
+            try:
+                plot_data = self._read_data(channels, time_span, max_points)
+                plot_data['time_span'] = time_span
+            except Exception as error:
+                # the thread must keep serving requests, the plot is updated again by the next one
+                self.plot_data_failed.emit(str(error))
+                continue
+            self.plot_data_ready.emit(plot_data)
+
+    def stop_plotting(self):
+        # live data is not read anymore, the thread is stopped before the data source and the widget are gone
+        if self.offline:
+            return
+        self.replot_timer.stop()
+        self._plot_data_stopped.set()
+        self._plot_requests.put(None)
+        self._plot_data_thread.join()
+
+    def closeEvent(self, event):
+        self.stop_plotting()
+        super().closeEvent(event)
+
+    def _read_data(self, channels, *window):
+        # all selected channels are read at once; window is (time_span, max_points) for live data
+        # and (min_time, max_time, max_points) for files
+        if channels:
+            plot_data = self.data_source_handle.get_data(channels, *window)
+        else:
+            plot_data = {'values': [], 'time': []}
+        plot_data['channels'] = channels
+        return plot_data
+
+    @Slot(object)
+    def _plot_prepared_data(self, plot_data):
+        self._plot_request_pending = False
+        if len(plot_data['time']) == 0:
+            self._graphic_widget.update_data(plot_data)
+            return
         max_time = plot_data['time'][-1]
-        min_time = max(0, max_time - self.time_span)
+        min_time = max(0, max_time - plot_data['time_span'])
         self._graphic_widget.plot_data(plot_data, min_time)
 
-    def _get_selected_channel(self):
-        return int(self._ui.comboBox_channels.currentText())
+    @Slot(str)
+    def _plot_data_failed(self, message):
+        self._plot_request_pending = False
+        logger.error("Reading data for the plot failed: {}".format(message))
+
+    def _get_max_points(self):
+        return POINTS_PER_PIXEL * self._graphic_widget.get_plot_width()
+
+    def _get_selected_channels(self):
+        channels_list = self._ui.listWidget_channels
+        return sorted(int(channels_list.item(i).text()) for i in range(channels_list.count())
+                      if channels_list.item(i).checkState() == Qt.Checked)
 
     def _stop_clicked(self):
         self.stop_clicked.emit()
@@ -0,0 +1,74 @@
+import os
+import sys
+
+import numpy as np
+
+current_script_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_script_dir, '../src'))
+
+from demo_src.data_unpacker import DataUnpacker
+
+PACKET_LENGTH = 64
+NUMBER_OF_CHANNELS = 2
+PAYLOAD_WORDS = PACKET_LENGTH // 2 - 4
+
+
+def make_packets(packet_ids):
+    # packets with given IDs and correct checksums, payload words are numbers of the samples
+    words = np.zeros((len(packet_ids), PACKET_LENGTH // 2), dtype=np.int64)
+    words[:, 0] = np.asarray(packet_ids) >> 16
+    words[:, 1] = np.asarray(packet_ids) & 0xFFFF
+    words[:, 2:-2] = (np.arange(len(packet_ids) * PAYLOAD_WORDS) % 0x10000).reshape(-1, PAYLOAD_WORDS)
+    checksum = ((words[:, 0:-2:2].sum(axis=1) << 16) + words[:, 1:-2:2].sum(axis=1)) & 0xFFFFFFFF
+    words[:, -2] = checksum >> 16
+    words[:, -1] = checksum & 0xFFFF
+    return words.astype('<u2')
+
+
+def test_corrupted_id_followed_by_good_packet():
+    words = make_packets(range(20))
+    words[10, 1] = 2  # ID of packet 10 reads low, its checksum doesn't match
+    data_unpacker = DataUnpacker(PACKET_LENGTH, NUMBER_OF_CHANNELS)
+    data = data_unpacker.unpack_from_buffer(words.tobytes())
+
+    assert data_unpacker.filled_packets == 0
+    assert data.size == 20 * PAYLOAD_WORDS
+    assert data_unpacker.with_incorrect_checksum == 1
+    assert data_unpacker.with_incorrect_id == 1
+    assert data_unpacker.last_id == 19
+    assert len(data_unpacker.missing_ranges) == 0
+
+
+def test_trailing_corrupted_packet_is_not_last_id():
+    words = make_packets(range(20))
+    data_unpacker = DataUnpacker(PACKET_LENGTH, NUMBER_OF_CHANNELS)
+    first_part = words[:10].copy()
+    first_part[9, 1] = 2
+    data_unpacker.unpack_from_buffer(first_part.tobytes())
+    assert data_unpacker.last_id == 8
+
+    data = data_unpacker.unpack_from_buffer(words[10:].tobytes())
+    assert data_unpacker.filled_packets == 0
+    assert data.size == 10 * PAYLOAD_WORDS
+
+
+def test_lost_packets_are_filled_and_recorded():
+    words = make_packets([0, 1, 2, 5, 6, 7])
+    data_unpacker = DataUnpacker(PACKET_LENGTH, NUMBER_OF_CHANNELS)
+    data = data_unpacker.unpack_from_buffer(words.tobytes())
+
+    assert data_unpacker.filled_packets == 2
+    assert data.size == 8 * PAYLOAD_WORDS
+    assert data_unpacker.missing_ranges == [(3 * PAYLOAD_WORDS, 2 * PAYLOAD_WORDS)]
+    rows = 3 * PAYLOAD_WORDS // NUMBER_OF_CHANNELS
+    assert data_unpacker.get_missing_rows().tolist() == [[rows, 2 * PAYLOAD_WORDS // NUMBER_OF_CHANNELS]]
+
+
+def test_dropped_packets_are_recorded():
+    words = make_packets(range(6))
+    words[4, 5] += 1  # wrong checksum
+    data_unpacker = DataUnpacker(PACKET_LENGTH, NUMBER_OF_CHANNELS, DataUnpacker.BAD_PACKETS_DROP)
+    data = data_unpacker.unpack_from_buffer(words.tobytes())
+
+    assert data.size == 6 * PAYLOAD_WORDS
+    assert data_unpacker.missing_ranges == [(4 * PAYLOAD_WORDS, PAYLOAD_WORDS)]
@@ -0,0 +1,49 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+current_script_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_script_dir, '../src'))
+
+from demo_src.dsp_stage import FIRFilter, IIRFilter, MovingAverage, Decimator, process_data, signal
+
+PART_LENGTHS = (1, 1000, 4097, 13, 5000)  # around FIRFilter.CHUNK_LENGTH, and shorter than the filters
+
+
+def make_data(number_of_rows):
+    random = np.random.RandomState(0)
+    return random.randint(0, 0x10000, size=(number_of_rows, 3)).astype(np.uint16)
+
+
+def process_in_parts(processors, data):
+    ends = np.cumsum(PART_LENGTHS)
+    return np.concatenate([process_data(processors, part) for part in np.split(data, ends[ends < len(data)])])
+
+
+def check_parts_equal_whole(make_processors):
+    data = make_data(sum(PART_LENGTHS))
+    whole = process_data(make_processors(), data)
+    parts = process_in_parts(make_processors(), data)
+    assert np.array_equal(parts, whole)
+    return whole
+
+
+def test_fir_filter_and_decimator():
+    coefficients = np.hanning(33) / np.hanning(33).sum()
+    whole = check_parts_equal_whole(lambda: [FIRFilter(coefficients), Decimator(5)])
+    assert len(whole) == -(-sum(PART_LENGTHS) // 5)
+
+
+def test_moving_average():
+    data = make_data(sum(PART_LENGTHS))
+    whole = check_parts_equal_whole(lambda: [MovingAverage(100)])
+    expected = np.convolve(data[:, 0], np.ones(100) / 100, 'valid')
+    assert np.abs(whole[99:, 0] - expected).max() <= 0.5 + 1e-6
+
+
+@pytest.mark.skipif(signal is None, reason="scipy is not installed")
+def test_iir_filter():
+    b, a = signal.butter(4, 0.1)
+    check_parts_equal_whole(lambda: [IIRFilter(b, a), Decimator(3)])
@@ -0,0 +1,59 @@
+import os
+import sys
+
+import numpy as np
+
+current_script_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_script_dir, '../src'))
+
+from demo_src.event_capture import EventTrigger, EventRecorder, read_events
+
+SAMPLING_INTERVAL = 1e-3
+PRE_TRIGGER_SAMPLES = 10
+POST_TRIGGER_SAMPLES = 50
+BUFFER_LENGTH = 37
+LEVEL = 500
+
+
+def make_signal(number_of_samples, pulses):
+    # pulses of (first sample, length) in channel 0, sample numbers in channel 1
+    data = np.zeros((number_of_samples, 2), dtype=np.uint16)
+    data[:, 1] = np.arange(number_of_samples)
+    for first_sample, length in pulses:
+        data[first_sample:first_sample + length, 0] = 1000
+    return data
+
+
+def record(file_path, data, trigger):
+    event_recorder = EventRecorder(SAMPLING_INTERVAL, trigger, PRE_TRIGGER_SAMPLES * SAMPLING_INTERVAL,
+                                   POST_TRIGGER_SAMPLES * SAMPLING_INTERVAL)
+    event_recorder.open_file(file_path, data.shape[1])
+    event_recorder.start()
+    for start in range(0, len(data), BUFFER_LENGTH):
+        event_recorder.add_buffer_to_queue(data[start:start + BUFFER_LENGTH])
+    event_recorder.stop()
+    return read_events(file_path)
+
+
+def test_event_windows(tmp_path):
+    # the second pulse is in the hold-off of the first one, the last event is cut by the end of the data
+    data = make_signal(500, [(5, 3), (30, 3), (200, 11), (480, 20)])
+    settings, events = record(str(tmp_path / 'events.h5'), data, EventTrigger(0, LEVEL))
+
+    assert settings['pre_trigger_samples'] == PRE_TRIGGER_SAMPLES
+    assert settings['post_trigger_samples'] == POST_TRIGGER_SAMPLES
+    assert [event['trigger_sample'] for event in events] == [5, 200, 480]
+    assert [event['first_sample'] for event in events] == [0, 190, 470]
+    expected_ends = [5 + POST_TRIGGER_SAMPLES, 200 + POST_TRIGGER_SAMPLES, len(data)]
+    for event, end in zip(events, expected_ends):
+        assert np.array_equal(event['data'], data[event['first_sample']:end])
+    assert np.isclose(events[1]['trigger_time'], 200 * SAMPLING_INTERVAL)
+
+
+def test_falling_level_trigger(tmp_path):
+    data = make_signal(300, [(0, 100)])
+    trigger = EventTrigger(0, LEVEL, EventTrigger.MODE_LEVEL, EventTrigger.SLOPE_FALLING, hold_off=0.1)
+    settings, events = record(str(tmp_path / 'level.h5'), data, trigger)
+
+    assert [event['trigger_sample'] for event in events] == [100, 200]
+    assert np.array_equal(events[0]['data'], data[90:150])
@@ -0,0 +1,62 @@
+import os
+import sys
+
+import h5py
+import numpy as np
+
+current_script_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_script_dir, '../src'))
+
+from demo_src.file_writer import FileWriter
+
+SAMPLING_INTERVAL = 1e-3
+NUMBER_OF_CHANNELS = 3
+
+
+def make_data(number_of_rows):
+    return (np.arange(number_of_rows * NUMBER_OF_CHANNELS) % 0x10000).astype(np.uint16).reshape(-1, NUMBER_OF_CHANNELS)
+
+
+def write_file(file_path, buffers):
+    file_writer = FileWriter(SAMPLING_INTERVAL)
+    file_writer.open_file(file_path, NUMBER_OF_CHANNELS)
+    file_writer.add_file_attributes()
+    for buffer in buffers:
+        file_writer.process_buffer(buffer)
+    file_writer.write_buffers()
+    file_writer.hdf5_wirter.close_file()
+    return file_writer
+
+
+def read_data_set(file_path):
+    with h5py.File(file_path, 'r') as file:
+        return file['data/data_set'][:]
+
+
+def test_staged_buffers_are_written_in_order(tmp_path):
+    file_path = str(tmp_path / 'staged.h5')
+    data = make_data(50000)
+    # the first buffer is written directly, the small ones go through the staging buffer
+    lengths = [20000, 1000, 3000, 7] + [500] * 9
+    ends = np.cumsum(lengths)
+    buffers = np.split(data, ends)
+    file_writer = write_file(file_path, buffers)
+
+    assert len(file_writer._staging_buffer) < lengths[0]
+    assert np.array_equal(read_data_set(file_path), data)
+
+
+def test_data_set_is_trimmed_on_close(tmp_path):
+    file_path = str(tmp_path / 'trimmed.h5')
+    data = make_data(1234)
+    write_file(file_path, [data])
+
+    stored = read_data_set(file_path)
+    assert stored.shape == data.shape
+    assert np.array_equal(stored, data)
+
+
+def test_empty_file(tmp_path):
+    file_path = str(tmp_path / 'empty.h5')
+    write_file(file_path, [])
+    assert read_data_set(file_path).shape == (0, NUMBER_OF_CHANNELS)
@@ -0,0 +1,63 @@
+import os
+import sys
+
+import numpy as np
+
+current_script_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_script_dir, '../src'))
+
+from demo_src.fpga_emulator import FPGAEmulator
+from demo_src.data_unpacker import DataUnpacker
+
+PACKET_LENGTH = 64
+NUMBER_OF_CHANNELS = 3
+TRANSFER_LENGTHS = (10, 1000, 64, 333)  # not multiples of the packet length, some shorter than a packet
+
+
+def receive_and_unpack(device, data_unpacker, number_of_transfers):
+    device.reset_design()
+    device.start_data_generation()
+    data = [data_unpacker.unpack_from_buffer(device.receive_data(1024, TRANSFER_LENGTHS[i % len(TRANSFER_LENGTHS)]))
+            for i in range(number_of_transfers)]
+    return np.concatenate(data)
+
+
+def test_round_trip():
+    device = FPGAEmulator(NUMBER_OF_CHANNELS, 1000, PACKET_LENGTH, real_time=False)
+    data_unpacker = DataUnpacker(PACKET_LENGTH, NUMBER_OF_CHANNELS)
+    data = receive_and_unpack(device, data_unpacker, 400)
+
+    assert data_unpacker.all_received > 0
+    assert data_unpacker.with_incorrect_checksum == 0
+    assert data_unpacker.with_incorrect_id == 0
+    assert data_unpacker.filled_packets == 0
+    # odd channels are saws counting samples up to their slope max
+    sample_numbers = np.arange(len(data))
+    assert np.array_equal(data[:, 1], sample_numbers % (2 * 1024 + 1))
+    assert data[:, 0].min() < 1000 and data[:, 0].max() > 64000
+
+
+def test_dropped_packets_are_filled():
+    device = FPGAEmulator(NUMBER_OF_CHANNELS, 1000, PACKET_LENGTH, real_time=False, dropped_packets_ratio=0.05,
+                          seed=1)
+    data_unpacker = DataUnpacker(PACKET_LENGTH, NUMBER_OF_CHANNELS)
+    data = receive_and_unpack(device, data_unpacker, 400)
+
+    assert device.packets_lost > 0
+    assert data_unpacker.filled_packets == device.packets_lost
+    # samples of packets which were received are at their places
+    sample_numbers = np.arange(len(data))
+    received = np.ones(len(data), dtype=bool)
+    for first_row, number_of_rows in data_unpacker.get_missing_rows():
+        received[first_row:first_row + number_of_rows] = False
+    assert np.array_equal(data[received, 1], sample_numbers[received] % (2 * 1024 + 1))
+
+
+def test_bad_checksums_are_dropped():
+    device = FPGAEmulator(NUMBER_OF_CHANNELS, 1000, PACKET_LENGTH, real_time=False, bad_checksums_ratio=0.05, seed=1)
+    data_unpacker = DataUnpacker(PACKET_LENGTH, NUMBER_OF_CHANNELS, DataUnpacker.BAD_PACKETS_DROP)
+    receive_and_unpack(device, data_unpacker, 400)
+
+    assert data_unpacker.with_incorrect_checksum > 0
+    assert data_unpacker.filled_packets == 0
+    assert len(data_unpacker.missing_ranges) == data_unpacker.with_incorrect_checksum
@@ -0,0 +1,57 @@
+import os
+import sys
+
+import h5py
+import numpy as np
+
+current_script_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_script_dir, '../src'))
+
+from demo_src.write_to_hdf5 import Hdf5Writer
+from demo_src.min_max_pyramid import GROUP_NAME, get_data_set_name, read_envelope
+
+DECIMATION_LEVELS = (4, 16, 64)
+NUMBER_OF_CHANNELS = 2
+BUFFER_LENGTH = 37  # blocks of every level are split between buffers
+
+
+def make_data(number_of_rows):
+    random = np.random.RandomState(0)
+    return random.randint(0, 0x10000, size=(number_of_rows, NUMBER_OF_CHANNELS)).astype(np.uint16)
+
+
+def write_file(file_path, data):
+    hdf5_writer = Hdf5Writer()
+    hdf5_writer.open_file(file_path, NUMBER_OF_CHANNELS, min_max_decimations=DECIMATION_LEVELS)
+    for start in range(0, len(data), BUFFER_LENGTH):
+        hdf5_writer.append_data(data[start:start + BUFFER_LENGTH])
+    hdf5_writer.close_file()
+
+
+def test_levels_are_min_max_of_blocks(tmp_path):
+    file_path = str(tmp_path / 'pyramid.h5')
+    data = make_data(1000)  # not a multiple of any decimation, the last blocks are incomplete
+    write_file(file_path, data)
+
+    with h5py.File(file_path, 'r') as file:
+        for decimation in DECIMATION_LEVELS:
+            level = file[GROUP_NAME][get_data_set_name(decimation)]
+            assert level.attrs['decimation'] == decimation
+            block_starts = np.arange(0, len(data), decimation)
+            assert level.shape == (len(block_starts), 2, NUMBER_OF_CHANNELS)
+            assert np.array_equal(level[:, 0], np.minimum.reduceat(data, block_starts, axis=0))
+            assert np.array_equal(level[:, 1], np.maximum.reduceat(data, block_starts, axis=0))
+
+
+def test_envelope_keeps_extremes(tmp_path):
+    file_path = str(tmp_path / 'envelope.h5')
+    data = make_data(5000)
+    data[1234, 1] = 0xFFFF
+    data[4321, 1] = 0
+    write_file(file_path, data)
+
+    with h5py.File(file_path, 'r') as file:
+        rows, values = read_envelope(file, file['data/data_set'], 1, 0, len(data), 100)
+    assert len(rows) == len(values) <= 100
+    assert values.max() == 0xFFFF
+    assert values.min() == 0
@@ -0,0 +1,47 @@
+import os
+import sys
+
+import numpy as np
+
+current_script_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_script_dir, '../src'))
+
+from demo_src.plot_data_source import PlotData
+
+NUMBER_OF_CHANNELS = 2
+SAMPLING_RATE = 100
+
+
+def make_samples(first_sample, number_of_samples):
+    # value of every sample is its number, channels differ by 1000
+    samples = np.arange(first_sample, first_sample + number_of_samples, dtype=np.uint16)
+    return np.stack([samples + 1000 * channel for channel in range(NUMBER_OF_CHANNELS)], axis=1)
+
+
+def test_wraparound_keeps_last_samples():
+    plot_data = PlotData(NUMBER_OF_CHANNELS, SAMPLING_RATE, max_time_span=1)
+    written = 0
+    for length in (30, 50, 40, 70):
+        plot_data.append_data(make_samples(written, length))
+        written += length
+
+    first_sample, values = plot_data.get_snapshot([0, 1], 1)
+    assert first_sample == written - plot_data.capacity
+    assert np.array_equal(values, make_samples(first_sample, plot_data.capacity).T)
+    assert plot_data.max_time == (written - 1) / SAMPLING_RATE
+    assert plot_data.min_time == first_sample / SAMPLING_RATE
+
+
+def test_buffer_longer_than_capacity():
+    plot_data = PlotData(NUMBER_OF_CHANNELS, SAMPLING_RATE, max_time_span=1)
+    plot_data.append_data(make_samples(0, 30))
+    plot_data.append_data(make_samples(30, 250))
+    plot_data.append_data(make_samples(280, 10))
+
+    first_sample, values = plot_data.get_snapshot([0, 1], 1)
+    assert first_sample == 290 - plot_data.capacity
+    assert np.array_equal(values, make_samples(first_sample, plot_data.capacity).T)
+    assert plot_data.max_time == 289 / SAMPLING_RATE
+    data = plot_data.get_data_channel(1, 0.5)
+    assert np.array_equal(data['time'], np.arange(240, 290) / SAMPLING_RATE)
+    assert np.array_equal(data['values'], np.arange(240, 290) + 1000)
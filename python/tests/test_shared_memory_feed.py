@@ -0,0 +1,64 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+current_script_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_script_dir, '../src'))
+
+from demo_src.shared_memory_feed import SharedMemoryFeed, SharedMemoryFeedReader, OverrunError
+
+CAPACITY = 100
+MAX_WINDOW = 20
+NUMBER_OF_CHANNELS = 2
+TIMEOUT = 5  # in seconds
+
+
+def make_data(number_of_samples):
+    return np.arange(number_of_samples * NUMBER_OF_CHANNELS, dtype=np.uint16).reshape(-1, NUMBER_OF_CHANNELS)
+
+
+def write(feed, reader, buffer):
+    feed.add_buffer_to_queue(buffer)
+    assert reader.wait_for_data(feed.samples_written + len(buffer), TIMEOUT)
+
+
+@pytest.fixture
+def feed():
+    feed = SharedMemoryFeed(NUMBER_OF_CHANNELS, 1e-3, 'test_feed_{}'.format(os.getpid()), CAPACITY, MAX_WINDOW)
+    feed.start()
+    yield feed
+    feed.stop()
+
+
+def test_windows_across_the_end_of_the_ring(feed):
+    data = make_data(250)
+    reader = SharedMemoryFeedReader(feed.name)
+    for start in range(0, len(data), 30):
+        write(feed, reader, data[start:start + 30])
+        first_sample = max(reader.samples_written - MAX_WINDOW, reader.get_oldest_sample())
+        window = reader.get_window(first_sample, reader.samples_written - first_sample)
+        assert np.array_equal(window, data[first_sample:reader.samples_written].T)
+        assert reader.is_valid(first_sample)
+    reader.close()
+
+
+def test_overrun_is_detected(feed):
+    data = make_data(200)
+    reader = SharedMemoryFeedReader(feed.name)
+    write(feed, reader, data[:50])
+    window = reader.get_window(10, MAX_WINDOW)
+    assert reader.is_valid(10)
+
+    # samples from 10 are overwritten once more than CAPACITY samples follow them
+    write(feed, reader, data[50:110])
+    assert reader.is_valid(10)
+    write(feed, reader, data[110:111])
+    assert not reader.is_valid(10)
+    assert not np.array_equal(window, data[10:10 + MAX_WINDOW].T)
+    with pytest.raises(OverrunError):
+        reader.get_window(10, MAX_WINDOW)
+    assert reader.get_oldest_sample() == 11
+    window = None
+    reader.close()
@@ -0,0 +1,71 @@
+import os
+import sys
+
+import numpy as np
+
+current_script_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_script_dir, '../src'))
+
+from demo_src.signal_monitor import SignalMonitor
+
+SAMPLING_RATE = 10000
+BUFFER_LENGTH = 777
+
+
+def make_signal(duration):
+    # 300 Hz sine and a saw, (samples x channels)
+    sample_numbers = np.arange(int(duration * SAMPLING_RATE))
+    sine = 2000 + 1000 * np.sin(2 * np.pi * 300 * sample_numbers / SAMPLING_RATE)
+    return np.stack((sine.astype(np.uint16), (sample_numbers % 4096).astype(np.uint16)), axis=1)
+
+
+def test_stats_of_continuous_signal():
+    data = make_signal(5)
+    signal_monitor = SignalMonitor(2, SAMPLING_RATE)
+    for start in range(0, len(data), BUFFER_LENGTH):
+        signal_monitor.process_buffer(data[start:start + BUFFER_LENGTH])
+
+    stats = signal_monitor.get_snapshot()['stats']
+    end = int(round(stats['time'] * SAMPLING_RATE))
+    window = stats['windows'][1.0]
+    assert window['samples'] == SAMPLING_RATE
+    window_data = data[end - window['samples']:end]
+    assert np.array_equal(window['min'], window_data.min(axis=0))
+    assert np.array_equal(window['max'], window_data.max(axis=0))
+    assert np.allclose(window['mean'], window_data.mean(axis=0))
+
+
+def test_gap_is_not_joined():
+    data = make_signal(5)
+    gap_start, gap_end = 2 * SAMPLING_RATE, int(3.5 * SAMPLING_RATE)
+    signal_monitor = SignalMonitor(2, SAMPLING_RATE)
+    processed = 0
+    for start in range(0, len(data), BUFFER_LENGTH):
+        if gap_start <= start < gap_end:
+            continue  # dropped by the queue
+        signal_monitor.process_buffer(data[start:start + BUFFER_LENGTH], start)
+        processed += len(data[start:start + BUFFER_LENGTH])
+
+    snapshot = signal_monitor.get_snapshot()
+    end = int(round(snapshot['stats']['time'] * SAMPLING_RATE))
+    # bins start again with the first buffer after the gap
+    first_after_gap = -(-gap_end // BUFFER_LENGTH) * BUFFER_LENGTH
+    assert first_after_gap < end <= len(data)
+    assert (end - first_after_gap) % signal_monitor.bin_length == 0
+    # the longest window holds all samples in whole bins, not the time span including the gap
+    assert snapshot['stats']['windows'][10.0]['samples'] <= processed
+    assert snapshot['stats']['windows'][1.0]['samples'] == SAMPLING_RATE
+    assert snapshot['spectrum']['time'] * SAMPLING_RATE >= gap_end
+
+
+def test_samples_are_numbered_before_the_queue():
+    signal_monitor = SignalMonitor(2, SAMPLING_RATE)
+    data = make_signal(2)
+    for start in range(0, 20 * BUFFER_LENGTH, BUFFER_LENGTH):
+        signal_monitor.add_buffer_to_queue(data[start:start + BUFFER_LENGTH])
+    first_samples = []
+    while signal_monitor.queue.qsize() > 0:
+        first_samples.append(signal_monitor.queue.get()[0])
+    # the oldest buffers were dropped, the rest keep their numbers
+    assert first_samples == list(range(20 * BUFFER_LENGTH - len(first_samples) * BUFFER_LENGTH,
+                                       20 * BUFFER_LENGTH, BUFFER_LENGTH))
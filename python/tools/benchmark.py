@@ -0,0 +1,276 @@
+"""
+Offline benchmark of the demo_src pipeline stages, no FPGA board needed.
+
+Synthetic packets in the data_packet_wrapper.vhd format are generated by FPGAEmulator, and throughput (MB/s of
+the stage input) and per-buffer latency are measured for DataUnpacker, FileWriter (with Hdf5Writer),
+PlotData.append_data and DataManager fan-out. Fan-out only passes references to the buffers, so its throughput
+is measured in buffers per second. Packet length, number of channels and transfer size are swept one
+at a time around the default configuration. Results are saved as JSON, and compared with a baseline file
+when given, throughput lower than the baseline by more than the tolerance is reported as a regression.
+Fan-out is much noisier, its buffers per second and p99 latency are compared with a separate tolerance.
+
+usage: python benchmark.py [-o results.json] [-b baseline.json] [-t 0.2] [--fan-out-tolerance 0.5] [--quick]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+from datetime import datetime
+
+import numpy as np
+
+# add src directory to PYTHONPATH
+file_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(os.path.dirname(file_dir), 'src'))
+
+from demo_src.fpga_emulator import FPGAEmulator
+from demo_src.data_unpacker import DataUnpacker
+from demo_src.file_writer import FileWriter
+from demo_src.plot_data_source import PlotData
+from demo_src.data_manager import DataManager
+
+MEGABYTE = 1024 * 1024
+
+DEFAULT_PACKET_LENGTH = 512
+DEFAULT_CHANNELS = 4
+DEFAULT_TRANSFER_LENGTH = MEGABYTE
+DEFAULT_SINKS = 2
+SAMPLING_RATE = 1000000
+
+PACKET_LENGTHS = (128, 512, 2048)
+CHANNELS = (1, 4, 16)
+TRANSFER_LENGTHS = (64 * 1024, MEGABYTE, 4 * MEGABYTE)
+SINKS = (1, 2, 4)
+
+DATA_LENGTH = 128 * MEGABYTE
+QUICK_DATA_LENGTH = 16 * MEGABYTE
+DEFAULT_TOLERANCE = 0.2
+DEFAULT_FAN_OUT_TOLERANCE = 0.5  # results of fan-out differ by tens of percent from run to run
+REPEATS = 3  # the best of repeated measurements is kept, to reduce the noise
+MIN_FAN_OUT_BUFFERS = 10000  # fan-out only passes references, many buffers are needed for a stable result
+
+
+def generate_transfers(packet_length, number_of_channels, transfer_length, data_length):
+    device = FPGAEmulator(number_of_channels, SAMPLING_RATE, packet_length, real_time=False)
+    device.reset_design()
+    device.start_data_generation()
+    number_of_transfers = max(data_length // transfer_length, 1)
+    return [bytes(device.receive_data(1024, transfer_length)) for i in range(number_of_transfers)]
+
+
+def unpack_transfers(transfers, packet_length, number_of_channels):
+    data_unpacker = DataUnpacker(packet_length, number_of_channels)
+    return [data_unpacker.unpack_from_buffer(transfer) for transfer in transfers]
+
+
+def summarize(stage, params, bytes_processed, total_time, latencies):
+    # bytes_processed is None for stages which don't touch the data
+    latencies = np.array(latencies) * 1000
+    result = {'stage': stage,
+              'params': params,
+              'items_per_s': len(latencies) / total_time,
+              'latency_ms': {'mean': float(latencies.mean()),
+                             'p50': float(np.percentile(latencies, 50)),
+                             'p99': float(np.percentile(latencies, 99)),
+                             'max': float(latencies.max())}}
+    if bytes_processed is not None:
+        result['mb_per_s'] = bytes_processed / (MEGABYTE * total_time)
+    return result
+
+
+def is_fan_out(result):
+    return result['stage'] == 'data_manager'
+
+
+def get_throughput(result):
+    # speed of fan-out doesn't depend on the size of buffers, it is compared in buffers per second
+    return result['items_per_s'] if is_fan_out(result) else result['mb_per_s']
+
+
+def time_calls(function, buffers):
+    latencies = []
+    start = time.perf_counter()
+    for buffer in buffers:
+        call_start = time.perf_counter()
+        function(buffer)
+        latencies.append(time.perf_counter() - call_start)
+    return time.perf_counter() - start, latencies
+
+
+def benchmark_unpacker(transfers, packet_length, number_of_channels, params):
+    data_unpacker = DataUnpacker(packet_length, number_of_channels)
+    total_time, latencies = time_calls(data_unpacker.unpack_from_buffer, transfers)
+    return summarize('unpacker', params, sum(len(transfer) for transfer in transfers), total_time, latencies)
+
+
+def benchmark_file_writer(buffers, number_of_channels, params):
+    with tempfile.TemporaryDirectory() as directory:
+        file_writer = FileWriter(1 / SAMPLING_RATE)
+        file_writer.open_file(os.path.join(directory, 'benchmark.h5'), number_of_channels)
+        file_writer.add_file_attributes()
+        total_time, latencies = time_calls(file_writer.process_buffer, buffers)
+        # data left in the staging buffer is written and the file closed as part of the measurement
+        start = time.perf_counter()
+        file_writer.write_buffers()
+        file_writer.hdf5_wirter.close_file()
+        total_time += time.perf_counter() - start
+    return summarize('file_writer', params, sum(buffer.nbytes for buffer in buffers), total_time, latencies)
+
+
+def benchmark_plot_data(buffers, number_of_channels, params):
+    plot_data = PlotData(number_of_channels, SAMPLING_RATE)
+    total_time, latencies = time_calls(plot_data.append_data, buffers)
+    return summarize('plot_data', params, sum(buffer.nbytes for buffer in buffers), total_time, latencies)
+
+
+class _TimestampSink:
+    # records when buffers arrive, without processing them
+    def __init__(self):
+        self.arrival_times = []
+
+    def add_buffer_to_queue(self, buffer):
+        self.arrival_times.append(time.perf_counter())
+
+
+def benchmark_data_manager(buffers, number_of_sinks, params):
+    # latency is the time from add_buffer() to the arrival of the buffer in the last sink
+    buffers = buffers * -(-MIN_FAN_OUT_BUFFERS // len(buffers))
+    data_manager = DataManager()
+    sinks = [_TimestampSink() for i in range(number_of_sinks)]
+    for sink in sinks:
+        data_manager.add_data_sink(sink)
+    data_manager.start()
+    put_times = []
+    start = time.perf_counter()
+    for buffer in buffers:
+        put_times.append(time.perf_counter())
+        data_manager.add_buffer(buffer)
+    data_manager.stop()
+    total_time = time.perf_counter() - start
+    latencies = np.array(sinks[-1].arrival_times) - np.array(put_times)
+    return summarize('data_manager', params, None, total_time, latencies)
+
+
+def get_configurations():
+    # every parameter is swept with the other ones set to their defaults
+    default = {'packet_length': DEFAULT_PACKET_LENGTH, 'channels': DEFAULT_CHANNELS,
+               'transfer_length': DEFAULT_TRANSFER_LENGTH}
+    configurations = [default]
+    for name, values in (('packet_length', PACKET_LENGTHS), ('channels', CHANNELS),
+                         ('transfer_length', TRANSFER_LENGTHS)):
+        for value in values:
+            configuration = dict(default, **{name: value})
+            if configuration not in configurations:
+                configurations.append(configuration)
+    return configurations
+
+
+def best_of(repeats, benchmark, *args):
+    return max((benchmark(*args) for i in range(repeats)), key=get_throughput)
+
+
+def run_benchmarks(data_length, repeats=REPEATS):
+    results = []
+    for configuration in get_configurations():
+        packet_length = configuration['packet_length']
+        number_of_channels = configuration['channels']
+        transfer_length = configuration['transfer_length']
+        transfers = generate_transfers(packet_length, number_of_channels, transfer_length, data_length)
+        buffers = unpack_transfers(transfers, packet_length, number_of_channels)
+
+        results.append(best_of(repeats, benchmark_unpacker, transfers, packet_length, number_of_channels,
+                               configuration))
+        if packet_length != DEFAULT_PACKET_LENGTH:
+            continue  # unpacked data doesn't depend on the packet length
+
+        buffer_params = {'channels': number_of_channels, 'transfer_length': transfer_length}
+        results.append(best_of(repeats, benchmark_file_writer, buffers, number_of_channels, buffer_params))
+        results.append(best_of(repeats, benchmark_plot_data, buffers, number_of_channels, buffer_params))
+        sinks_sweep = SINKS if transfer_length == DEFAULT_TRANSFER_LENGTH else (DEFAULT_SINKS,)
+        for number_of_sinks in sinks_sweep:
+            results.append(best_of(repeats, benchmark_data_manager, buffers, number_of_sinks,
+                                   dict(buffer_params, sinks=number_of_sinks)))
+    return results
+
+
+def get_key(result):
+    return result['stage'], tuple(sorted(result['params'].items()))
+
+
+def compare_with_baseline(results, baseline, tolerance, fan_out_tolerance=DEFAULT_FAN_OUT_TOLERANCE):
+    # returns results slower than the baseline by more than tolerance, fan-out is also a regression
+    # when its p99 latency is longer than the baseline by more than fan_out_tolerance
+    baseline_results = {get_key(result): result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        baseline_result = baseline_results.get(get_key(result))
+        if baseline_result is None:
+            continue
+        result['baseline_throughput'] = get_throughput(baseline_result)
+        if is_fan_out(result):
+            result['baseline_p99_ms'] = baseline_result['latency_ms']['p99']
+            if (result['items_per_s'] < result['baseline_throughput'] * (1 - fan_out_tolerance) or
+                    result['latency_ms']['p99'] > result['baseline_p99_ms'] * (1 + fan_out_tolerance)):
+                regressions.append(result)
+        elif result['mb_per_s'] < result['baseline_throughput'] * (1 - tolerance):
+            regressions.append(result)
+    return regressions
+
+
+def print_results(results, regressions):
+    for result in results:
+        params = ', '.join('{}={}'.format(name, value) for name, value in result['params'].items())
+        if is_fan_out(result):
+            throughput = '{:>9.0f} buffers/s'.format(result['items_per_s'])
+        else:
+            throughput = '{:>9.1f} MB/s     '.format(result['mb_per_s'])
+        line = '{:<13} {:<60} {}  latency mean/p99/max {:.2f}/{:.2f}/{:.2f} ms'.format(
+            result['stage'], params, throughput,
+            result['latency_ms']['mean'], result['latency_ms']['p99'], result['latency_ms']['max'])
+        if 'baseline_throughput' in result:
+            line += '  ({:+.0f}% vs baseline'.format(100 * (get_throughput(result) / result['baseline_throughput'] - 1))
+            if 'baseline_p99_ms' in result:
+                line += ', p99 {:+.0f}%'.format(100 * (result['latency_ms']['p99'] / result['baseline_p99_ms'] - 1))
+            line += ')'
+        if result in regressions:
+            line += '  REGRESSION'
+        print(line)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the pipeline stages.")
+    parser.add_argument('-o', '--output', default='benchmark_results.json', help="output JSON file")
+    parser.add_argument('-b', '--baseline', default=None, help="JSON file with results to compare with")
+    parser.add_argument('-t', '--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed relative throughput drop against the baseline")
+    parser.add_argument('--fan-out-tolerance', type=float, default=DEFAULT_FAN_OUT_TOLERANCE,
+                        help="allowed relative drop of buffers per second and rise of p99 latency of fan-out")
+    parser.add_argument('--quick', action='store_true', help="use less data, for a rough check")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    data_length = QUICK_DATA_LENGTH if args.quick else DATA_LENGTH
+    results = run_benchmarks(data_length)
+
+    regressions = []
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            regressions = compare_with_baseline(results, json.load(file), args.tolerance, args.fan_out_tolerance)
+    print_results(results, regressions)
+
+    with open(args.output, 'w') as file:
+        json.dump({'date': datetime.now().isoformat(),
+                   'platform': platform.platform(),
+                   'python': platform.python_version(),
+                   'numpy': np.__version__,
+                   'data_length': data_length,
+                   'results': results}, file, indent=4)
+
+    if regressions:
+        print('{} regressions found'.format(len(regressions)))
+        sys.exit(1)